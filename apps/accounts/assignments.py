@@ -0,0 +1,332 @@
+"""
+Assignment graph used by permission checks.
+
+The moderator -> community managers, client -> community managers and
+client -> moderator relations are mirrored in Redis so that permission
+checks are set lookups instead of M2M queries. The graph is built lazily
+under a version number and kept up to date incrementally from the
+``m2m_changed``/``post_save`` signals in ``apps.accounts.signals``. Changes
+that can't be applied incrementally drop the current version, and the next
+lookup rebuilds it. If Redis is unavailable lookups fall back to queries.
+
+One rebuild runs at a time, under a lock. Every change bumps a counter, and
+a rebuild only publishes its version if the counter didn't move while it
+read the database, so a change committed meanwhile is never lost. Lookups
+that find no published graph query the database instead.
+"""
+
+import logging
+import uuid
+
+from planit.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Seconds a built graph is kept before it is rebuilt from the database
+ASSIGNMENT_GRAPH_TIMEOUT = 24 * 3600
+
+# Seconds a rebuild may take before another one can start
+_REBUILD_LOCK_TIMEOUT = 60
+
+_VERSION_KEY = "assignment_graph:version"
+_GENERATION_KEY = "assignment_graph:generation"
+_CHANGES_KEY = "assignment_graph:changes"
+_REBUILD_LOCK_KEY = "assignment_graph:rebuild_lock"
+
+# KEYS: version, changes
+# ARGV: version, changes seen before reading the database, timeout
+_PUBLISH_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[2] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+return 1
+"""
+
+# KEYS: lock
+# ARGV: token
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Relation names, also used in the Redis keys
+MODERATOR_CMS = "moderator_cms"
+CLIENT_CMS = "client_cms"
+CLIENT_MODERATOR = "client_moderator"
+
+
+def _set_key(version, relation, owner_id):
+    return f"assignment_graph:{version}:{relation}:{owner_id}"
+
+
+def _moderators_key(version):
+    return f"assignment_graph:{version}:{CLIENT_MODERATOR}"
+
+
+class _GraphUnavailable(Exception):
+    """No graph is published, lookups have to query the database"""
+
+
+def rebuild_assignment_graph(redis_conn=None):
+    """
+    Load every assignment from the database under a new version, and
+    publish it. Returns the version, or ``None`` if another rebuild is
+    running or an assignment changed meanwhile.
+    """
+    redis_conn = redis_conn or get_redis()
+    token = uuid.uuid4().hex
+    if not redis_conn.set(_REBUILD_LOCK_KEY, token, nx=True, ex=_REBUILD_LOCK_TIMEOUT):
+        return None
+    try:
+        return _build_graph(redis_conn)
+    finally:
+        redis_conn.eval(_RELEASE_SCRIPT, 1, _REBUILD_LOCK_KEY, token)
+
+
+def _build_graph(redis_conn):
+    from apps.accounts.models import User
+
+    # Read before the database, a change committed after it is noticed
+    changes = redis_conn.get(_CHANGES_KEY)
+    version = redis_conn.incr(_GENERATION_KEY)
+
+    pipe = redis_conn.pipeline(transaction=False)
+    for relation, through in (
+        (MODERATOR_CMS, User.assigned_communitymanagers.through),
+        (CLIENT_CMS, User.assigned_communitymanagerstoclient.through),
+    ):
+        for owner_id, cm_id in through.objects.values_list(
+            "from_user_id", "to_user_id"
+        ):
+            key = _set_key(version, relation, owner_id)
+            pipe.sadd(key, cm_id)
+            pipe.expire(key, ASSIGNMENT_GRAPH_TIMEOUT)
+
+    moderators = dict(
+        User.objects.filter(assigned_moderator__isnull=False).values_list(
+            "id", "assigned_moderator_id"
+        )
+    )
+    if moderators:
+        pipe.hset(_moderators_key(version), mapping=moderators)
+        pipe.expire(_moderators_key(version), ASSIGNMENT_GRAPH_TIMEOUT)
+
+    pipe.execute()
+
+    # Publish the new version only once it is complete, and still current
+    if not redis_conn.eval(
+        _PUBLISH_SCRIPT,
+        2,
+        _VERSION_KEY,
+        _CHANGES_KEY,
+        version,
+        (changes or b"0").decode(),
+        ASSIGNMENT_GRAPH_TIMEOUT,
+    ):
+        return None
+    return version
+
+
+def _current_version(redis_conn):
+    """
+    The published version, rebuilt if there is none.
+
+    Raises:
+        _GraphUnavailable: If no graph could be published
+    """
+    version = redis_conn.get(_VERSION_KEY)
+    if version is None:
+        version = rebuild_assignment_graph(redis_conn)
+        if version is None:
+            raise _GraphUnavailable()
+    return int(version)
+
+
+def invalidate_assignment_graph():
+    """Drop the current graph, the next lookup rebuilds it"""
+    try:
+        pipe = get_redis().pipeline()
+        pipe.incr(_CHANGES_KEY)
+        pipe.delete(_VERSION_KEY)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Error invalidating assignment graph: {e}")
+
+
+def _apply(update):
+    """
+    Run ``update(pipe, version)`` against the live graph, if there is one.
+    Either way a rebuild in progress won't be published.
+    """
+    try:
+        redis_conn = get_redis()
+        redis_conn.incr(_CHANGES_KEY)
+        version = redis_conn.get(_VERSION_KEY)
+        if version is None:
+            return
+        pipe = redis_conn.pipeline()
+        update(pipe, int(version))
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Error updating assignment graph: {e}")
+        invalidate_assignment_graph()
+
+
+def add_assignments(relation, owner_id, cm_ids):
+    def update(pipe, version):
+        key = _set_key(version, relation, owner_id)
+        pipe.sadd(key, *cm_ids)
+        pipe.expire(key, ASSIGNMENT_GRAPH_TIMEOUT)
+
+    if cm_ids:
+        _apply(update)
+
+
+def remove_assignments(relation, owner_id, cm_ids):
+    def update(pipe, version):
+        pipe.srem(_set_key(version, relation, owner_id), *cm_ids)
+
+    if cm_ids:
+        _apply(update)
+
+
+def clear_assignments(relation, owner_id):
+    _apply(lambda pipe, version: pipe.delete(_set_key(version, relation, owner_id)))
+
+
+def set_assigned_moderator(client_id, moderator_id):
+    def update(pipe, version):
+        if moderator_id is None:
+            pipe.hdel(_moderators_key(version), client_id)
+        else:
+            pipe.hset(_moderators_key(version), client_id, moderator_id)
+            pipe.expire(_moderators_key(version), ASSIGNMENT_GRAPH_TIMEOUT)
+
+    _apply(update)
+
+
+def _query_client_community_manager(client_id, cm_id):
+    from apps.accounts.models import User
+
+    return User.assigned_communitymanagerstoclient.through.objects.filter(
+        from_user_id=client_id, to_user_id=cm_id
+    ).exists()
+
+
+def is_client_community_manager(client_id, cm_id):
+    """Whether the community manager is assigned to the client"""
+    try:
+        redis_conn = get_redis()
+        version = _current_version(redis_conn)
+        return bool(
+            redis_conn.sismember(_set_key(version, CLIENT_CMS, client_id), cm_id)
+        )
+    except _GraphUnavailable:
+        return _query_client_community_manager(client_id, cm_id)
+    except Exception as e:
+        logger.warning(f"Error reading assignment graph: {e}")
+        return _query_client_community_manager(client_id, cm_id)
+
+
+def _query_assigned_to_user(user, owner_id):
+    from apps.accounts.models import User
+
+    through = User.assigned_communitymanagers.through
+    return (
+        through.objects.filter(from_user_id=owner_id, to_user_id=user.id).exists()
+        or User.objects.filter(id=owner_id, assigned_moderator_id=user.id).exists()
+        or (
+            user.is_moderator
+            and through.objects.filter(
+                from_user_id=user.id, to_user_id=owner_id
+            ).exists()
+        )
+    )
+
+
+def is_assigned_to_user(user, owner_id):
+    """
+    Whether ``user`` works for ``owner_id``: as one of its community
+    managers, as its assigned moderator, or as a moderator the owner is a
+    community manager of.
+    """
+    try:
+        redis_conn = get_redis()
+        version = _current_version(redis_conn)
+        pipe = redis_conn.pipeline(transaction=False)
+        pipe.sismember(_set_key(version, MODERATOR_CMS, owner_id), user.id)
+        pipe.hget(_moderators_key(version), owner_id)
+        pipe.sismember(_set_key(version, MODERATOR_CMS, user.id), owner_id)
+        owner_cm, owner_moderator, user_cm = pipe.execute()
+    except _GraphUnavailable:
+        return _query_assigned_to_user(user, owner_id)
+    except Exception as e:
+        logger.warning(f"Error reading assignment graph: {e}")
+        return _query_assigned_to_user(user, owner_id)
+
+    return bool(
+        owner_cm
+        or (owner_moderator is not None and int(owner_moderator) == user.id)
+        or (user.is_moderator and user_cm)
+    )
+
+
+def _query_assigned_owners(user, owner_ids):
+    from apps.accounts.models import User
+
+    through = User.assigned_communitymanagers.through
+    assigned = set(
+        through.objects.filter(
+            from_user_id__in=owner_ids, to_user_id=user.id
+        ).values_list("from_user_id", flat=True)
+    )
+    assigned.update(
+        User.objects.filter(
+            id__in=owner_ids, assigned_moderator_id=user.id
+        ).values_list("id", flat=True)
+    )
+    if user.is_moderator:
+        assigned.update(
+            through.objects.filter(
+                from_user_id=user.id, to_user_id__in=owner_ids
+            ).values_list("to_user_id", flat=True)
+        )
+    return assigned
+
+
+def get_assigned_owners(user, owner_ids):
+    """
+    The ids among ``owner_ids`` that ``user`` works for, as defined by
+    ``is_assigned_to_user``, in one round-trip.
+    """
+    owner_ids = [int(owner_id) for owner_id in owner_ids]
+    if not owner_ids:
+        return set()
+    try:
+        redis_conn = get_redis()
+        version = _current_version(redis_conn)
+        pipe = redis_conn.pipeline(transaction=False)
+        for owner_id in owner_ids:
+            pipe.sismember(_set_key(version, MODERATOR_CMS, owner_id), user.id)
+        pipe.hmget(_moderators_key(version), owner_ids)
+        pipe.smembers(_set_key(version, MODERATOR_CMS, user.id))
+        *owner_cms, owner_moderators, user_cms = pipe.execute()
+    except _GraphUnavailable:
+        return _query_assigned_owners(user, owner_ids)
+    except Exception as e:
+        logger.warning(f"Error reading assignment graph: {e}")
+        return _query_assigned_owners(user, owner_ids)
+
+    user_cms = {int(cm_id) for cm_id in user_cms} if user.is_moderator else set()
+    return {
+        owner_id
+        for owner_id, owner_cm, owner_moderator in zip(
+            owner_ids, owner_cms, owner_moderators
+        )
+        if owner_cm
+        or (owner_moderator is not None and int(owner_moderator) == user.id)
+        or owner_id in user_cms
+    }
@@ -1,9 +1,9 @@
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.exceptions import TokenError
-from rest_framework_simplejwt.tokens import UntypedToken
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework import exceptions
 
-from apps.accounts.models import User
+from apps.accounts.principal_cache import get_principal
 
 
 class JWTCookieAuthentication(JWTAuthentication):
@@ -38,9 +38,7 @@ class JWTCookieAuthentication(JWTAuthentication):
         Validates the token and ensures it's not tampered with.
         """
         try:
-            # Use UntypedToken for initial validation
-            UntypedToken(raw_token)
-            # Then use the parent's validation for full JWT validation
+            # The parent decodes and fully validates the token once
             return super().get_validated_token(raw_token)
         except TokenError as e:
             raise exceptions.AuthenticationFailed(f"Invalid token: {str(e)}")
@@ -56,7 +54,10 @@ class JWTCookieAuthentication(JWTAuthentication):
                     "Token contained no recognizable user identification"
                 )
 
-            user = User.objects.get(id=user_id)
+            # Served from the principal cache, no query on a hit
+            user = get_principal(user_id, validated_token.get(api_settings.JTI_CLAIM))
+            if user is None:
+                raise exceptions.AuthenticationFailed("User not found.")
 
             # Verify user is still active and verified
             if not user.is_active:
@@ -67,8 +68,8 @@ class JWTCookieAuthentication(JWTAuthentication):
 
             return user
 
-        except User.DoesNotExist:
-            raise exceptions.AuthenticationFailed("User not found.")
+        except exceptions.AuthenticationFailed:
+            raise
         except Exception as e:
             raise exceptions.AuthenticationFailed(f"Authentication failed: {str(e)}")
 
@@ -123,7 +124,10 @@ class JWTHeaderAuthentication(JWTAuthentication):
                     "Token contained no recognizable user identification"
                 )
 
-            user = User.objects.get(id=user_id)
+            # Served from the principal cache, no query on a hit
+            user = get_principal(user_id, validated_token.get(api_settings.JTI_CLAIM))
+            if user is None:
+                raise exceptions.AuthenticationFailed("User not found.")
 
             # Verify user is still active and verified
             if not user.is_active:
@@ -134,8 +138,8 @@ class JWTHeaderAuthentication(JWTAuthentication):
 
             return user
 
-        except User.DoesNotExist:
-            raise exceptions.AuthenticationFailed("User not found.")
+        except exceptions.AuthenticationFailed:
+            raise
         except Exception as e:
             raise exceptions.AuthenticationFailed(f"Authentication failed: {str(e)}")
 
@@ -1,6 +1,8 @@
 from channels.generic.websocket import AsyncWebsocketConsumer
 import json
 
+from apps.collaboration import presence
+
 
 class MyConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -27,38 +29,25 @@ class UserActivityConsumer(AsyncWebsocketConsumer):
             await self.channel_layer.group_add(self.group_name, self.channel_name)
             await self.accept()
 
-            # Notify group about the new user
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    "type": "user_joined",
-                    "user": {
-                        "id": self.user_id,
-                        "name": f"{self.scope['user'].first_name} {self.scope['user'].last_name}".strip()
-                        if self.scope["user"].first_name or self.scope["user"].last_name
-                        else self.scope["user"].email,
-                        "email": self.scope["user"].email,
-                        "profilePicture": self.scope["user"].user_image.url
-                        if self.scope["user"].user_image
-                        else "",
-                    },
-                },
-            )
+            # Joins and leaves reach the group as coalesced presence diffs.
+            # The presence of the users a client shows is read in bulk from
+            # the presence endpoint, never sent to every new connection
+            await presence.aconnect(self.user_id, self.channel_name)
         else:
             await self.close()
 
-    async def disconnect(self):
+    async def disconnect(self, close_code):
         if self.user_id:
             # Remove user from the group
             await self.channel_layer.group_discard(self.group_name, self.channel_name)
-
-            # Notify group about the user leaving
-            await self.channel_layer.group_send(
-                self.group_name, {"type": "user_left", "userId": self.user_id}
-            )
+            await presence.adisconnect(self.user_id, self.channel_name)
 
     async def receive(self, text_data):
         data = json.loads(text_data)
+        if data.get("action") == "heartbeat":
+            await presence.aheartbeat(self.user_id, self.channel_name)
+            return
+
         # Broadcast the received data to the group, excluding the sender
         await self.channel_layer.group_send(
             self.group_name,
@@ -69,19 +58,19 @@ class UserActivityConsumer(AsyncWebsocketConsumer):
             },
         )
 
-    async def user_joined(self, event):
-        # Send the user joined message to WebSocket, excluding the current user
-        if self.user_id != event["user"]["id"]:
-            await self.send(
-                text_data=json.dumps({"type": "user-joined", "user": event["user"]})
-            )
-
-    async def user_left(self, event):
-        # Send the user left message to WebSocket, excluding the current user
-        if self.user_id != event["userId"]:
-            await self.send(
-                text_data=json.dumps({"type": "user-left", "userId": event["userId"]})
-            )
+    async def presence_diff(self, event):
+        # Send the users who came online or went offline since the last diff,
+        # excluding the current user
+        for user in event["users"]:
+            if self.user_id != user["id"]:
+                await self.send(
+                    text_data=json.dumps({"type": "user-joined", "user": user})
+                )
+        for user_id in event["offline"]:
+            if self.user_id != user_id:
+                await self.send(
+                    text_data=json.dumps({"type": "user-left", "userId": user_id})
+                )
 
     async def user_activity_message(self, event):
         # Exclude the sender from receiving their own message
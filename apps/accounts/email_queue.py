@@ -0,0 +1,316 @@
+"""
+Queued email delivery.
+
+Emails are pushed to a Redis list and delivered in batches by
+``deliver_queued_emails``, which reuses one SMTP connection for the whole
+batch instead of opening a new one per message.
+
+A batch is moved to a processing list of its own while it is sent and only
+dropped once every message was handled, so messages of a worker that dies
+mid-batch are put back on the queue after ``EMAIL_PROCESSING_TIMEOUT``
+(and may be sent twice). Failed messages wait in a sorted set scored by
+their next attempt time, with exponential backoff, and are moved to a
+dead-letter list once they run out of attempts. ``redrive_failed_emails``
+queues dead-lettered messages again.
+"""
+
+import json
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection, send_mail
+
+from planit.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+EMAIL_QUEUE_KEY = "email_queue"
+EMAIL_FAILED_KEY = "email_queue:failed"
+EMAIL_METRICS_KEY = "email_queue:metrics"
+EMAIL_SCHEDULED_KEY = "email_queue:scheduled"
+EMAIL_RETRY_KEY = "email_queue:retry"
+EMAIL_PROCESSING_KEY = "email_queue:processing"
+
+# Messages sent per SMTP connection
+EMAIL_BATCH_SIZE = getattr(settings, "EMAIL_BATCH_SIZE", 100)
+
+# Delivery attempts per message before it is dead-lettered
+EMAIL_MAX_ATTEMPTS = getattr(settings, "EMAIL_MAX_ATTEMPTS", 5)
+
+# Seconds before the first retry of a failed message, doubled on every retry
+EMAIL_RETRY_DELAY = getattr(settings, "EMAIL_RETRY_DELAY", 60)
+
+# Seconds after which a batch that is still being sent counts as abandoned
+EMAIL_PROCESSING_TIMEOUT = 600
+
+# Seconds a delivery run waits so that emails queued together share a batch
+EMAIL_DELIVERY_DELAY = 1
+
+# A scheduled run that never started is forgotten after this many seconds,
+# the periodic delivery task picks up anything left behind
+EMAIL_SCHEDULED_TIMEOUT = 30
+
+# KEYS: queue, processing list, processing registry
+# ARGV: batch size, abandoned after
+_TAKE_BATCH_SCRIPT = """
+local records = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #records == 0 then
+    return records
+end
+redis.call('LTRIM', KEYS[1], #records, -1)
+redis.call('RPUSH', KEYS[2], unpack(records))
+redis.call('ZADD', KEYS[3], ARGV[2], KEYS[2])
+return records
+"""
+
+# KEYS: queue, retries, processing registry
+# ARGV: now
+# Returns the number of retries due and of abandoned messages requeued
+_REQUEUE_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for _, record in ipairs(due) do
+    redis.call('RPUSH', KEYS[1], record)
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+local abandoned = 0
+for _, key in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[1])) do
+    for _, record in ipairs(redis.call('LRANGE', key, 0, -1)) do
+        redis.call('RPUSH', KEYS[1], record)
+        abandoned = abandoned + 1
+    end
+    redis.call('DEL', key)
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', ARGV[1])
+return {#due, abandoned}
+"""
+
+
+def queue_email(
+    subject,
+    message,
+    recipient_list,
+    fail_silently=False,
+    schedule=True,
+    from_email=None,
+):
+    """
+    Queue an email for batched delivery.
+
+    Unless ``schedule`` is False a delivery run is scheduled shortly after.
+    Falls back to sending it right away if the queue is unavailable.
+    """
+    record = {
+        "id": uuid.uuid4().hex,
+        "subject": subject,
+        "message": message,
+        "from_email": from_email or settings.EMAIL_HOST_USER,
+        "to": list(recipient_list),
+        "fail_silently": fail_silently,
+        "attempts": 0,
+    }
+    try:
+        redis_conn = get_redis()
+        redis_conn.rpush(EMAIL_QUEUE_KEY, json.dumps(record))
+        # Only one delivery run is scheduled at a time
+        should_schedule = schedule and redis_conn.set(
+            EMAIL_SCHEDULED_KEY, 1, ex=EMAIL_SCHEDULED_TIMEOUT, nx=True
+        )
+    except Exception as e:
+        logger.warning(f"Email queue unavailable, sending directly: {e}")
+        send_mail(
+            subject,
+            message,
+            record["from_email"],
+            recipient_list,
+            fail_silently=fail_silently,
+        )
+        return
+
+    if should_schedule:
+        from apps.accounts.tasks import deliver_queued_emails
+
+        deliver_queued_emails.apply_async(countdown=EMAIL_DELIVERY_DELAY)
+
+
+def _take_batch(redis_conn, batch_size):
+    """Move up to ``batch_size`` messages to a new processing list"""
+    processing_key = f"{EMAIL_PROCESSING_KEY}:{uuid.uuid4().hex}"
+    raw_records = redis_conn.eval(
+        _TAKE_BATCH_SCRIPT,
+        3,
+        EMAIL_QUEUE_KEY,
+        processing_key,
+        EMAIL_PROCESSING_KEY,
+        batch_size,
+        time.time() + EMAIL_PROCESSING_TIMEOUT,
+    )
+    return processing_key, [json.loads(record) for record in raw_records]
+
+
+def _build_message(record, connection):
+    return EmailMessage(
+        subject=record["subject"],
+        body=record["message"],
+        from_email=record["from_email"],
+        to=record["to"],
+        connection=connection,
+    )
+
+
+def _requeue_or_fail(pipe, record, error):
+    record["attempts"] += 1
+    if record["attempts"] < EMAIL_MAX_ATTEMPTS:
+        # Keeps otherwise identical messages apart in the retry set
+        record.setdefault("id", uuid.uuid4().hex)
+        delay = EMAIL_RETRY_DELAY * 2 ** (record["attempts"] - 1)
+        pipe.zadd(EMAIL_RETRY_KEY, {json.dumps(record): time.time() + delay})
+        return "retried"
+
+    record["error"] = str(error)
+    pipe.rpush(EMAIL_FAILED_KEY, json.dumps(record))
+    log = logger.info if record["fail_silently"] else logger.error
+    log(f"Giving up on email '{record['subject']}' to {record['to']}: {error}")
+    return "failed"
+
+
+def deliver_email_batch(batch_size=EMAIL_BATCH_SIZE, connection=None):
+    """
+    Deliver up to ``batch_size`` queued emails over a single connection.
+
+    ``connection`` defaults to ``get_connection()``, pass one explicitly to
+    deliver through another backend (e.g. a local SMTP sink). Returns the
+    number of messages taken from the queue.
+    """
+    redis_conn = get_redis()
+    processing_key, records = _take_batch(redis_conn, batch_size)
+    if not records:
+        return 0
+    taken = len(records)
+
+    started = time.monotonic()
+    counts = {"sent": 0, "retried": 0, "failed": 0}
+    pipe = redis_conn.pipeline()
+
+    connection = connection or get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        logger.warning(f"Could not open email connection: {e}")
+        for record in records:
+            counts[_requeue_or_fail(pipe, record, e)] += 1
+        records = []
+
+    try:
+        for record in records:
+            # One message per call so a bad address only fails its own email
+            try:
+                sent = connection.send_messages([_build_message(record, connection)])
+                if not sent:
+                    raise RuntimeError("message was not accepted")
+                counts["sent"] += 1
+            except Exception as e:
+                counts[_requeue_or_fail(pipe, record, e)] += 1
+    finally:
+        connection.close()
+
+    elapsed = time.monotonic() - started
+    # Every message is handled, the batch is acknowledged with the retries
+    pipe.delete(processing_key)
+    pipe.zrem(EMAIL_PROCESSING_KEY, processing_key)
+    pipe.hincrby(EMAIL_METRICS_KEY, "batches", 1)
+    for name, count in counts.items():
+        pipe.hincrby(EMAIL_METRICS_KEY, name, count)
+    pipe.hset(
+        EMAIL_METRICS_KEY,
+        mapping={"last_batch_size": taken, "last_batch_seconds": elapsed},
+    )
+    pipe.execute()
+
+    logger.info(
+        f"Email batch: {counts['sent']} sent, {counts['retried']} retried, "
+        f"{counts['failed']} failed in {elapsed:.2f}s"
+    )
+    return sum(counts.values())
+
+
+def requeue_due_emails(now=None):
+    """
+    Put retries whose time has come and the messages of abandoned batches
+    back on the queue. Returns the number of messages requeued.
+    """
+    due, abandoned = get_redis().eval(
+        _REQUEUE_DUE_SCRIPT,
+        3,
+        EMAIL_QUEUE_KEY,
+        EMAIL_RETRY_KEY,
+        EMAIL_PROCESSING_KEY,
+        time.time() if now is None else now,
+    )
+    if abandoned:
+        logger.warning(f"Requeued {abandoned} emails of abandoned batches")
+    return due + abandoned
+
+
+def deliver_queued_emails(batch_size=EMAIL_BATCH_SIZE, max_batches=50):
+    """Drain the queue batch by batch. Returns the number of messages handled."""
+    redis_conn = get_redis()
+    # Emails queued from now on schedule a new run
+    redis_conn.delete(EMAIL_SCHEDULED_KEY)
+    requeue_due_emails()
+
+    handled = 0
+    for _ in range(max_batches):
+        taken = deliver_email_batch(batch_size)
+        handled += taken
+        if taken < batch_size:
+            break
+    return handled
+
+
+def redrive_failed_emails(limit=None):
+    """
+    Queue dead-lettered emails again with fresh attempts, the oldest first.
+    Returns the number of messages requeued.
+    """
+    end = -1 if limit is None else limit - 1
+
+    def redrive(pipe):
+        raw_records = pipe.lrange(EMAIL_FAILED_KEY, 0, end)
+        records = []
+        for raw_record in raw_records:
+            record = json.loads(raw_record)
+            record["attempts"] = 0
+            record.pop("error", None)
+            records.append(json.dumps(record))
+        pipe.multi()
+        if records:
+            pipe.ltrim(EMAIL_FAILED_KEY, len(records), -1)
+            pipe.rpush(EMAIL_QUEUE_KEY, *records)
+        return len(records)
+
+    return get_redis().transaction(redrive, EMAIL_FAILED_KEY, value_from_callable=True)
+
+
+def get_email_metrics():
+    """Delivery counters and the throughput of the last batch"""
+    redis_conn = get_redis()
+    pipe = redis_conn.pipeline()
+    pipe.hgetall(EMAIL_METRICS_KEY)
+    pipe.llen(EMAIL_QUEUE_KEY)
+    pipe.llen(EMAIL_FAILED_KEY)
+    pipe.zcard(EMAIL_RETRY_KEY)
+    raw_metrics, queued, dead_lettered, retrying = pipe.execute()
+
+    metrics = {key.decode(): float(value) for key, value in raw_metrics.items()}
+    for name in ("batches", "sent", "retried", "failed", "last_batch_size"):
+        metrics[name] = int(metrics.get(name, 0))
+    seconds = metrics.get("last_batch_seconds", 0.0)
+    metrics["last_batch_per_second"] = (
+        metrics["last_batch_size"] / seconds if seconds else 0.0
+    )
+    metrics["queued"] = queued
+    metrics["dead_lettered"] = dead_lettered
+    metrics["retrying"] = retrying
+    return metrics
@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+from channels.db import database_sync_to_async
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.accounts.models import User
+from planit.websocket_auth import TokenAuthMiddleware
+
+
+async def _inner_app(scope, receive, send):
+    return scope["user"]
+
+
+@database_sync_to_async
+def _get_user(user_id):
+    return User.objects.get(id=user_id)
+
+
+async def _uncached_connect(token):
+    """The lookup every connect made before the principal cache"""
+    access_token = AccessToken(token)
+    return await _get_user(access_token.payload.get("user_id"))
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate a WebSocket reconnect storm and report connects per second: "
+        "before (token decode and a User.objects.get per connect, as the "
+        "middleware did without the principal cache), through "
+        "TokenAuthMiddleware with fresh tokens (cache misses), then "
+        "reconnecting with the same tokens (cache hits)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--connections", type=int, default=1000)
+        parser.add_argument(
+            "--users", type=int, default=20, help="Number of distinct users"
+        )
+
+    def handle(self, *args, **options):
+        users = list(User.objects.filter(is_active=True)[: options["users"]])
+        if not users:
+            raise CommandError("No active users to authenticate as")
+
+        tokens = [
+            str(AccessToken.for_user(users[i % len(users)]))
+            for i in range(options["connections"])
+        ]
+
+        before = asyncio.run(self.storm(tokens, _uncached_connect))
+        middleware_connect = self.middleware_connect()
+        cold = asyncio.run(self.storm(tokens, middleware_connect))
+        warm = asyncio.run(self.storm(tokens, middleware_connect))
+
+        self.stdout.write(f"{len(tokens)} connects, {len(users)} users")
+        self.stdout.write(f"  before (database lookups): {before:.1f} connects/s")
+        self.stdout.write(f"  cache misses:              {cold:.1f} connects/s")
+        self.stdout.write(
+            self.style.SUCCESS(f"  cache hits:                {warm:.1f} connects/s")
+        )
+
+    def middleware_connect(self):
+        middleware = TokenAuthMiddleware(_inner_app)
+
+        async def connect(token):
+            scope = {
+                "type": "websocket",
+                "query_string": f"token={token}".encode(),
+                "client": ["127.0.0.1", 0],
+            }
+            return await middleware(scope, None, None)
+
+        return connect
+
+    async def storm(self, tokens, connect):
+        async def authenticate(token):
+            user = await connect(token)
+            if user.is_anonymous:
+                raise CommandError("Benchmark connection was not authenticated")
+
+        started = time.monotonic()
+        await asyncio.gather(*(authenticate(token) for token in tokens))
+        return len(tokens) / (time.monotonic() - started)
@@ -1,7 +1,11 @@
 from django.core.management.base import BaseCommand
 from django.core.cache import cache
 from apps.accounts.models import User
-from apps.accounts.services import get_cached_user_data, clear_user_cache
+from apps.accounts.services import (
+    USERS_LIST_KEY,
+    get_cached_user_data,
+    clear_user_cache,
+)
 import json
 
 
@@ -157,14 +161,7 @@ class Command(BaseCommand):
 
             redis_conn = get_redis_connection("default")
 
-            patterns = ["*:user_data:*", "*:user:*", "*:current-user*"]
-
-            total_redis_keys = 0
-            for pattern in patterns:
-                keys = redis_conn.keys(pattern)
-                total_redis_keys += len(keys)
-
-            self.stdout.write(f"Redis user keys: {total_redis_keys}")
+            self.stdout.write(f"Users list records: {redis_conn.hlen(USERS_LIST_KEY)}")
 
         except Exception:
             self.stdout.write("Redis: Not available")
@@ -0,0 +1,69 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from apps.accounts import email_queue
+
+
+class Command(BaseCommand):
+    help = (
+        "Deliver queued emails and report throughput. Use --host/--port to "
+        "send through a local SMTP sink, e.g. `python -m aiosmtpd -n -l "
+        "localhost:1025`, and --queue-test to enqueue test messages first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", help="SMTP host to deliver through")
+        parser.add_argument("--port", type=int, default=1025, help="SMTP port")
+        parser.add_argument(
+            "--queue-test",
+            type=int,
+            default=0,
+            help="Number of test messages to enqueue before delivering",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=email_queue.EMAIL_BATCH_SIZE
+        )
+
+    def handle(self, *args, **options):
+        for i in range(options["queue_test"]):
+            email_queue.queue_email(
+                f"Test email {i}",
+                "Test message sent by the deliver_emails command.",
+                [f"test{i}@example.com"],
+                schedule=False,
+                from_email="noreply@example.com",
+            )
+
+        connection = None
+        if options["host"]:
+            connection = get_connection(
+                "django.core.mail.backends.smtp.EmailBackend",
+                host=options["host"],
+                port=options["port"],
+                username="",
+                password="",
+                use_tls=False,
+            )
+
+        started = time.monotonic()
+        email_queue.requeue_due_emails()
+        handled = 0
+        while True:
+            taken = email_queue.deliver_email_batch(
+                options["batch_size"], connection=connection
+            )
+            handled += taken
+            if taken < options["batch_size"]:
+                break
+        elapsed = time.monotonic() - started
+
+        rate = handled / elapsed if elapsed else 0.0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Handled {handled} emails in {elapsed:.2f}s ({rate:.1f}/s)"
+            )
+        )
+        for name, value in email_queue.get_email_metrics().items():
+            self.stdout.write(f"  {name}: {value}")
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from apps.accounts import email_queue
+
+
+class Command(BaseCommand):
+    help = (
+        "Queue dead-lettered emails again with fresh attempts, e.g. once an "
+        "SMTP outage is over. They are sent by the next delivery run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit", type=int, help="Number of emails to requeue, all by default"
+        )
+
+    def handle(self, *args, **options):
+        requeued = email_queue.redrive_failed_emails(options["limit"])
+        self.stdout.write(self.style.SUCCESS(f"Requeued {requeued} failed emails"))
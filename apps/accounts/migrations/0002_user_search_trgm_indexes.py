@@ -0,0 +1,56 @@
+from django.db import migrations
+
+# Trigram indexes behind apps.accounts.services.search_users. They cover both
+# the prefix (LIKE) and similarity (%) matches on UPPER(field). PostgreSQL
+# only, other databases use the unindexed fallback search.
+SEARCH_FIELDS = ("first_name", "last_name", "email")
+
+
+def _drop_invalid_index(schema_editor, name):
+    # An interrupted CONCURRENTLY build leaves an invalid index behind, which
+    # IF NOT EXISTS would otherwise keep
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = indexrelid "
+            "WHERE relname = %s AND NOT indisvalid",
+            [name],
+        )
+        invalid = cursor.fetchone() is not None
+    if invalid:
+        schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for field in SEARCH_FIELDS:
+        name = f"accounts_user_{field}_trgm_idx"
+        _drop_invalid_index(schema_editor, name)
+        schema_editor.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} "
+            f'ON accounts_user USING gin (UPPER("{field}") gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for field in SEARCH_FIELDS:
+        schema_editor.execute(
+            f"DROP INDEX CONCURRENTLY IF EXISTS accounts_user_{field}_trgm_idx"
+        )
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction, and keeps the
+    # users table writable while the indexes are built
+    atomic = False
+
+    dependencies = [
+        ("accounts", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
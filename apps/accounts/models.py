@@ -1,7 +1,7 @@
 from django.contrib.auth.models import AbstractUser, BaseUserManager
-from django.db import models
+from django.db import models, transaction
 from django.core.cache import cache
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
 
@@ -140,13 +140,22 @@ class User(AbstractUser):
 
     def clear_cache(self):
         """Clear all cached data for this user"""
-        cache.delete(f"user_meta:{self.id}")
-        cache.delete(f"user_fullname:{self.id}")
-        cache.delete(f"user_notifications:{self.id}")
-        cache.delete(f"user_unread_count:{self.id}")
+        _clear_user_cache(self.id)
+
+
+def _clear_user_cache(user_id):
+    from apps.accounts.principal_cache import invalidate_principal
+
+    cache.delete(f"user_meta:{user_id}")
+    cache.delete(f"user_fullname:{user_id}")
+    invalidate_principal(user_id)
 
 
 @receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
 def clear_user_cache(sender, instance, **kwargs):
-    """Clear user cache when user model is updated"""
-    instance.clear_cache()
+    """Clear user cache once the change to the user is committed"""
+    # Clearing before the commit lets a concurrent lookup cache the old row
+    # again; the id is bound now as a deleted instance loses its pk
+    user_id = instance.pk
+    transaction.on_commit(lambda: _clear_user_cache(user_id))
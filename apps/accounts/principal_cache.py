@@ -0,0 +1,113 @@
+"""
+Short-lived cache of authenticated users.
+
+Users resolved from a token are cached per (user id, token jti) for
+``PRINCIPAL_CACHE_TIMEOUT`` seconds. Every entry records the user's cache
+version, which is bumped whenever the user is saved or deleted, so a stale
+principal is never served after a change to the account. Both lookups go
+out in a single ``get_many`` round-trip.
+"""
+
+import logging
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Seconds an authenticated user is served from the cache
+PRINCIPAL_CACHE_TIMEOUT = 60
+
+
+def _version_key(user_id):
+    return f"principal_version:{user_id}"
+
+
+def _principal_key(user_id, jti):
+    return f"principal:{user_id}:{jti}"
+
+
+def _read_cached_principal(user_id, jti):
+    """
+    Look a principal up in the cache only.
+
+    Returns ``(user, version)``; ``user`` is ``None`` on a miss and
+    ``version`` is the one to store a freshly loaded user under, or ``None``
+    if the cache is unavailable.
+    """
+    version_key = _version_key(user_id)
+    principal_key = _principal_key(user_id, jti)
+    try:
+        cached = cache.get_many([version_key, principal_key])
+    except Exception as e:
+        logger.warning(f"Error reading principal cache for user {user_id}: {e}")
+        return None, None
+
+    version = cached.get(version_key)
+    entry = cached.get(principal_key)
+    if version is not None and entry is not None and entry[0] == version:
+        return entry[1], version
+
+    # The version is read before the user so that a save racing with
+    # this lookup leaves the entry stale instead of serving old data
+    if version is None:
+        try:
+            cache.add(version_key, 1, timeout=None)
+            version = cache.get(version_key)
+        except Exception as e:
+            logger.warning(f"Error reading principal cache for user {user_id}: {e}")
+    return None, version
+
+
+def _load_principal(user_id, jti, version):
+    from apps.accounts.models import User
+
+    user = User.objects.filter(id=user_id).first()
+    if user is not None and version is not None:
+        try:
+            cache.set(
+                _principal_key(user_id, jti), (version, user), PRINCIPAL_CACHE_TIMEOUT
+            )
+        except Exception as e:
+            logger.warning(f"Error caching principal for user {user_id}: {e}")
+    return user
+
+
+def get_principal(user_id, jti):
+    """
+    Return the ``User`` for a token, from the cache when possible.
+
+    Returns ``None`` if the user does not exist.
+    """
+    user, version = _read_cached_principal(user_id, jti)
+    if user is not None:
+        return user
+    return _load_principal(user_id, jti, version)
+
+
+async def aget_principal(user_id, jti):
+    """
+    Async variant of ``get_principal``.
+
+    The cache read runs outside the thread that serializes database access,
+    so cache hits never queue behind queries; only misses go through
+    ``database_sync_to_async``.
+    """
+    user, version = await sync_to_async(_read_cached_principal, thread_sensitive=False)(
+        user_id, jti
+    )
+    if user is not None:
+        return user
+    return await database_sync_to_async(_load_principal)(user_id, jti, version)
+
+
+def invalidate_principal(user_id):
+    """Expire every cached principal of a user, whatever the token"""
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:
+        # No version yet, so nothing can be cached against it
+        pass
+    except Exception as e:
+        logger.warning(f"Error invalidating principal cache for user {user_id}: {e}")
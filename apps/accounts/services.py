@@ -1,13 +1,84 @@
+import json
+import logging
+import uuid
+
 from django.core.cache import cache
 from django.core.cache.backends.base import InvalidCacheBackendError
+from django.db import connections
+from django.db.models import Prefetch, Q
+from django.db.models.functions import Upper
+from django.db.models.lookups import StartsWith
 from redis.exceptions import ConnectionError
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
+from planit.redis_client import get_redis
+from .principal_cache import invalidate_principal
 from .serializers import GetUserSerializer
 
 # Cache timeout in seconds (1 hour)
 USER_CACHE_TIMEOUT = 3600
 USERS_LIST_CACHE_TIMEOUT = 1800  # 30 minutes for user list cache
+USERS_LIST_CHUNK_SIZE = 500  # Users fetched per query when building the list
+
+# Redis hash of user id -> JSON record, read whole with HGETALL
+USERS_LIST_KEY = "users_list"
+
+# Bumped by every change, a rebuild is only published if it didn't move
+USERS_LIST_CHANGES_KEY = "users_list:changes"
+
+# User fields that appear in a users list record (their own or a dependent's)
+USERS_LIST_FIELDS = {
+    "first_name",
+    "last_name",
+    "phone_number",
+    "email",
+    "user_image",
+    "is_administrator",
+    "is_superadministrator",
+    "is_moderator",
+    "is_community_manager",
+    "is_client",
+    "is_verified",
+    "is_active",
+    "is_staff",
+    "assigned_moderator",
+}
+
+# Only touch the hash when it is there, so a single upsert never leaves a
+# partial list behind that would later be read as complete
+_UPSERT_USERS_LIST_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV))
+return 1
+"""
+
+# Replace the list with the rebuilt one, unless a change was made since the
+# rebuild read the database
+# KEYS: rebuilt hash, users list, changes
+# ARGV: changes seen before reading the database
+_PUBLISH_USERS_LIST_SCRIPT = """
+if (redis.call('GET', KEYS[3]) or '0') ~= ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('RENAME', KEYS[1], KEYS[2])
+else
+    redis.call('DEL', KEYS[2])
+end
+return 1
+"""
+
+# Keyset pages of the user pickers
+USER_PAGE_SIZE = 50
+USER_MAX_PAGE_SIZE = 100
+
+# Matched by the user search, each has a trigram index on PostgreSQL
+USER_SEARCH_FIELDS = ("first_name", "last_name", "email")
+
+logger = logging.getLogger(__name__)
 
 
 def build_user_data(user):
@@ -46,19 +117,16 @@ def build_user_data(user):
     }
 
     # Add assignment information
-    if (
-        user.is_client
-        and hasattr(user, "assigned_moderator")
-        and user.assigned_moderator
-    ):
+    if user.is_client and user.assigned_moderator_id:
         data["assigned_moderator"] = user.assigned_moderator.full_name
-        data["assigned_moderator_id"] = user.assigned_moderator.id
+        data["assigned_moderator_id"] = user.assigned_moderator_id
     else:
         data["assigned_moderator"] = None
         data["assigned_moderator_id"] = None
 
     if user.is_moderator:
-        assigned_cms = user.assigned_communitymanagers.all()
+        # Evaluated once, served from the prefetch cache when there is one
+        assigned_cms = list(user.assigned_communitymanagers.all())
         data["assigned_communitymanagers"] = (
             ", ".join([cm.full_name for cm in assigned_cms]) if assigned_cms else None
         )
@@ -74,6 +142,22 @@ def build_user_data(user):
     return data
 
 
+def users_list_queryset():
+    """
+    Users with everything ``build_user_data`` needs: the assigned moderator
+    is joined in and the community managers are prefetched, so building the
+    list takes a fixed number of queries.
+    """
+    from .models import User
+
+    return User.objects.select_related("assigned_moderator").prefetch_related(
+        Prefetch(
+            "assigned_communitymanagers",
+            queryset=User.objects.only("id", "first_name", "last_name"),
+        )
+    )
+
+
 def get_cached_user_data(user, force_refresh=False):
     """
     Get user data with caching to improve performance
@@ -101,10 +185,50 @@ def get_cached_user_data(user, force_refresh=False):
     return user_data
 
 
+def _build_users_list():
+    # Build the list in chunks, each with its own two prefetch queries
+    return [
+        build_user_data(user)
+        for user in users_list_queryset().iterator(chunk_size=USERS_LIST_CHUNK_SIZE)
+    ]
+
+
+def _store_users_list(redis_conn, users_data, changes):
+    """
+    Replace the users list hash in one step, unless a user changed since
+    ``changes`` was read. A stale list is left out, the next read rebuilds.
+    """
+    # Written under a temporary key and renamed, readers never see it half built
+    building_key = f"{USERS_LIST_KEY}:building:{uuid.uuid4().hex}"
+    pipe = redis_conn.pipeline()
+    for i in range(0, len(users_data), USERS_LIST_CHUNK_SIZE):
+        pipe.hset(
+            building_key,
+            mapping={
+                user["id"]: json.dumps(user)
+                for user in users_data[i : i + USERS_LIST_CHUNK_SIZE]
+            },
+        )
+    if users_data:
+        pipe.expire(building_key, USERS_LIST_CACHE_TIMEOUT)
+    pipe.eval(
+        _PUBLISH_USERS_LIST_SCRIPT,
+        3,
+        building_key,
+        USERS_LIST_KEY,
+        USERS_LIST_CHANGES_KEY,
+        changes,
+    )
+    pipe.execute()
+
+
 def get_cached_users_list(force_refresh=False, bypass_cache=False):
     """
     Get all users list with caching
 
+    The list is kept as a Redis hash with one record per user, updated in
+    place by the user signals, so it is read back with a single HGETALL.
+
     Args:
         force_refresh: If True, bypass the cache and get fresh data
         bypass_cache: Alternative parameter name for consistency with frontend
@@ -113,26 +237,137 @@ def get_cached_users_list(force_refresh=False, bypass_cache=False):
         list: List of user data dictionaries
     """
     should_refresh = force_refresh or bypass_cache
-    cache_key = "all_users_list"
-    cached_data = None if should_refresh else cache.get(cache_key)
 
-    if cached_data is not None:
-        return cached_data
+    try:
+        redis_conn = get_redis()
+        if not should_refresh:
+            records = redis_conn.hgetall(USERS_LIST_KEY)
+            if records:
+                return sorted(
+                    (json.loads(record) for record in records.values()),
+                    key=lambda user: user["id"],
+                )
+        # Read before the database, so changes committed meanwhile are seen
+        changes = redis_conn.get(USERS_LIST_CHANGES_KEY) or b"0"
+    except Exception as e:
+        logger.warning(f"Error reading users list cache: {e}")
+        return _build_users_list()
 
-    # Import here to avoid circular imports
+    users_data = _build_users_list()
+    try:
+        _store_users_list(redis_conn, users_data, changes)
+    except Exception as e:
+        logger.warning(f"Error caching users list: {e}")
+
+    return users_data
+
+
+def update_users_list(user_ids):
+    """
+    Refresh the users list records of ``user_ids`` in place.
+
+    Users that no longer exist are dropped from the list. Their individual
+    caches are cleared too, since they hold the same record.
+    """
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+
+    cache.delete_many(
+        [f"user_data:{user_id}" for user_id in user_ids]
+        + [f"user_by_id:{user_id}" for user_id in user_ids]
+    )
+
+    records = {
+        user.id: json.dumps(build_user_data(user))
+        for user in users_list_queryset().filter(id__in=user_ids)
+    }
+    removed = user_ids - records.keys()
+
+    try:
+        pipe = get_redis().pipeline()
+        pipe.incr(USERS_LIST_CHANGES_KEY)
+        if records:
+            pipe.eval(
+                _UPSERT_USERS_LIST_SCRIPT,
+                1,
+                USERS_LIST_KEY,
+                *(item for pair in records.items() for item in pair),
+            )
+        if removed:
+            pipe.hdel(USERS_LIST_KEY, *removed)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Error updating users list cache: {e}")
+        invalidate_users_list()
+
+
+def invalidate_users_list():
+    """Drop the users list, the next read rebuilds it"""
+    try:
+        pipe = get_redis().pipeline()
+        pipe.incr(USERS_LIST_CHANGES_KEY)
+        pipe.delete(USERS_LIST_KEY)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Error invalidating users list cache: {e}")
+
+
+def users_list_dependents(user_id):
+    """
+    Ids of the users whose record embeds ``user_id``'s name: the clients it
+    moderates and the moderators it is a community manager of.
+    """
     from .models import User
 
-    # Get all users and build data
-    users = User.objects.all()
-    users_data = []
+    clients = User.objects.filter(assigned_moderator_id=user_id).values_list(
+        "id", flat=True
+    )
+    moderators = User.assigned_communitymanagers.through.objects.filter(
+        to_user_id=user_id
+    ).values_list("from_user_id", flat=True)
+    return set(clients) | set(moderators)
 
-    for user in users:
-        users_data.append(build_user_data(user))
 
-    # Cache the data
-    cache.set(cache_key, users_data, USERS_LIST_CACHE_TIMEOUT)
+def search_users(queryset, query):
+    """
+    Filter users by name or email.
 
-    return users_data
+    On PostgreSQL a user matches when a field starts with ``query`` or is
+    trigram-similar to it, both served by the ``UPPER(field)`` trigram
+    indexes. Other databases fall back to a substring match.
+    """
+    query = (query or "").strip()
+    if not query:
+        return queryset
+
+    if connections[queryset.db].vendor != "postgresql":
+        condition = Q()
+        for field in USER_SEARCH_FIELDS:
+            condition |= Q(**{f"{field}__icontains": query})
+        return queryset.filter(condition)
+
+    from django.contrib.postgres.lookups import TrigramSimilar
+
+    term = query.upper()
+    condition = Q()
+    for field in USER_SEARCH_FIELDS:
+        condition |= Q(StartsWith(Upper(field), term))
+        condition |= Q(TrigramSimilar(Upper(field), term))
+    return queryset.filter(condition)
+
+
+def paginate_users(queryset, cursor=None, limit=USER_PAGE_SIZE):
+    """
+    Return a page of users after the id ``cursor`` and the cursor of the
+    next page, ``None`` on the last page.
+    """
+    if cursor is not None:
+        queryset = queryset.filter(id__gt=cursor)
+    page = list(queryset.order_by("id")[: limit + 1])
+    if len(page) > limit:
+        return page[:limit], page[limit - 1].id
+    return page, None
 
 
 def get_cached_user_by_id(user_id, force_refresh=False, bypass_cache=False):
@@ -158,7 +393,7 @@ def get_cached_user_by_id(user_id, force_refresh=False, bypass_cache=False):
     from .models import User
 
     try:
-        user = User.objects.get(pk=user_id)
+        user = users_list_queryset().get(pk=user_id)
         user_data = build_user_data(user)
 
         # Cache the data
@@ -183,72 +418,7 @@ def clear_user_cache(user_id):
     cache.delete(f"user_fullname:{user_id}")
     cache.delete(f"user_profile:{user_id}")
     cache.delete(f"user_stats:{user_id}")
-    cache.delete(f"user_notifications:{user_id}")
-    cache.delete(f"user_unread_count:{user_id}")
-
-    # Clear users list cache since it contains this user
-    cache.delete("all_users_list")
-
-    # Also clear Redis cache if available
-    try:
-        from django_redis import get_redis_connection
-
-        redis_conn = get_redis_connection("default")
-
-        # Clear cache patterns related to the user
-        cache_patterns = [
-            f"*:user:{user_id}:*",
-            f"*:user_data:{user_id}*",
-            f"*:user_by_id:{user_id}*",
-            f"*:views.decorators.cache.cache_page.*user*{user_id}*",
-            f"*:current-user*",
-            f"*:all_users_list*",
-        ]
-
-        for pattern in cache_patterns:
-            keys = redis_conn.keys(pattern)
-            if keys:
-                for key in keys:
-                    redis_conn.delete(key)
-    except Exception as e:
-        # Log the error but continue
-        import logging
-
-        logger = logging.getLogger(__name__)
-        logger.warning(f"Error clearing Redis cache: {str(e)}")
-
-
-def clear_all_users_cache():
-    """
-    Clear all user-related cache entries
-    """
-    try:
-        # Clear main lists cache
-        cache.delete("all_users_list")
-
-        # Clear Redis cache patterns
-        from django_redis import get_redis_connection
-
-        redis_conn = get_redis_connection("default")
-
-        cache_patterns = [
-            "*:user_data:*",
-            "*:user_by_id:*",
-            "*:all_users_list*",
-            "*:user:*",
-        ]
-
-        for pattern in cache_patterns:
-            keys = redis_conn.keys(pattern)
-            if keys:
-                for key in keys:
-                    redis_conn.delete(key)
-
-    except Exception as e:
-        import logging
-
-        logger = logging.getLogger(__name__)
-        logger.warning(f"Error clearing all users cache: {str(e)}")
+    invalidate_principal(user_id)
 
 
 # WebSocket notification functions
@@ -307,7 +477,6 @@ def notify_assignment_changed(
     # Clear cache for both users involved
     clear_user_cache(user_id)
     clear_user_cache(target_id)
-    clear_all_users_cache()  # Since assignments affect the users list view
 
     # Send notification to WebSocket group
     async_to_sync(channel_layer.group_send)(
@@ -338,9 +507,8 @@ def notify_user_deleted(user_id, deleted_by_id, user_data=None):
     if channel_layer is None:
         return
 
-    # Clear all caches since user is deleted
+    # Clear caches of the deleted user
     clear_user_cache(user_id)
-    clear_all_users_cache()
 
     # Send notification to WebSocket group
     async_to_sync(channel_layer.group_send)(
@@ -368,9 +536,6 @@ def notify_user_created(user_id, created_by_id, user_data=None):
     if channel_layer is None:
         return
 
-    # Clear users list cache since new user was added
-    clear_all_users_cache()
-
     # Send notification to WebSocket group
     async_to_sync(channel_layer.group_send)(
         "user_data_updates",
@@ -401,7 +566,6 @@ def notify_role_changed(user_id, old_roles, new_roles, updated_by_id, user_data=
 
     # Clear cache for the user whose role changed
     clear_user_cache(user_id)
-    clear_all_users_cache()
 
     # Send notification to WebSocket group
     async_to_sync(channel_layer.group_send)(
@@ -1,45 +1,25 @@
 # apps/accounts/signals.py
 import logging
-from django.db import models
-from django.db.models.signals import post_save, m2m_changed
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, m2m_changed
 from django.dispatch import receiver
+from apps.accounts import assignments, services
 from apps.accounts.models import User
 
 logger = logging.getLogger(__name__)
 
 
-def create_dm_room(user1, user2):
+def create_dm_rooms(user, other_ids):
     """
-    Create a direct message room between two users if it doesn't exist.
-    Returns the room if created or already exists.
+    Create the missing direct message rooms between ``user`` and each of
+    ``other_ids``, in bulk.
     """
-    from apps.collaboration.models import ChatRoom
-    
-    if not user1 or not user2 or user1 == user2:
-        return None
-    
-    # Check if DM already exists between these users
-    existing_room = ChatRoom.objects.filter(
-        room_type="direct",
-        members=user1
-    ).filter(members=user2).first()
-    
-    if existing_room:
-        logger.info(f"DM room already exists between {user1.email} and {user2.email}")
-        return existing_room
-    
-    # Create new DM room
+    from apps.collaboration.services import provision_direct_rooms
+
     try:
-        room = ChatRoom.objects.create(
-            room_type="direct",
-            created_by=user1
-        )
-        room.members.add(user1, user2)
-        logger.info(f"Created DM room between {user1.email} and {user2.email}")
-        return room
+        provision_direct_rooms(user, other_ids)
     except Exception as e:
-        logger.error(f"Error creating DM room: {e}")
-        return None
+        logger.error(f"Error creating DM rooms for {user.email}: {e}")
 
 
 @receiver(post_save, sender=User)
@@ -51,32 +31,29 @@ def user_created_handler(sender, instance, created, **kwargs):
     """
     if created:
         logger.info(f"New user created: {instance.email}")
-        
-        # Create DM with all administrators
-        admins = User.objects.filter(
-            is_active=True
-        ).filter(
-            models.Q(is_administrator=True)
+
+        other_ids = list(
+            User.objects.filter(is_active=True, is_administrator=True).values_list(
+                "id", flat=True
+            )
         )
-        
-        for admin in admins:
-            if admin != instance:
-                create_dm_room(instance, admin)
-        
-        # If client and has assigned moderator, create DM
-        if instance.is_client and instance.assigned_moderator:
-            create_dm_room(instance, instance.assigned_moderator)
+        if instance.is_client:
+            other_ids.append(instance.assigned_moderator_id)
+
+        create_dm_rooms(instance, other_ids)
 
 
 @receiver(post_save, sender=User)
-def handle_moderator_assignment(sender, instance, created, **kwargs):
+def handle_moderator_assignment(
+    sender, instance, created, update_fields=None, **kwargs
+):
     """
     When a client's assigned_moderator is updated, create DM room.
     """
-    if not created and instance.is_client:
-        # Check if assigned_moderator field was updated
-        if instance.assigned_moderator:
-            create_dm_room(instance, instance.assigned_moderator)
+    if update_fields and "assigned_moderator" not in update_fields:
+        return
+    if not created and instance.is_client and instance.assigned_moderator_id:
+        create_dm_rooms(instance, [instance.assigned_moderator_id])
 
 
 @receiver(m2m_changed, sender=User.assigned_communitymanagers.through)
@@ -85,12 +62,7 @@ def handle_cm_to_moderator_assignment(sender, instance, action, pk_set, **kwargs
     When CMs are assigned to a Moderator, create DM rooms.
     """
     if action == "post_add" and pk_set:
-        for cm_id in pk_set:
-            try:
-                cm = User.objects.get(pk=cm_id)
-                create_dm_room(instance, cm)
-            except User.DoesNotExist:
-                logger.error(f"CM with id {cm_id} not found")
+        create_dm_rooms(instance, pk_set)
 
 
 @receiver(m2m_changed, sender=User.assigned_communitymanagerstoclient.through)
@@ -99,9 +71,106 @@ def handle_cm_to_client_assignment(sender, instance, action, pk_set, **kwargs):
     When CMs are assigned to a Client, create DM rooms.
     """
     if action == "post_add" and pk_set:
-        for cm_id in pk_set:
-            try:
-                cm = User.objects.get(pk=cm_id)
-                create_dm_room(instance, cm)
-            except User.DoesNotExist:
-                logger.error(f"CM with id {cm_id} not found")
+        create_dm_rooms(instance, pk_set)
+
+
+def _update_assignment_graph(relation, instance, action, reverse, pk_set):
+    """
+    Mirror an M2M assignment change into the assignment graph once the
+    transaction commits. ``reverse`` changes come from the CM's side, so
+    ``pk_set`` holds owners rather than community managers.
+    """
+    if action == "post_clear":
+        if reverse:
+            transaction.on_commit(assignments.invalidate_assignment_graph)
+        else:
+            transaction.on_commit(
+                lambda: assignments.clear_assignments(relation, instance.pk)
+            )
+        return
+
+    if action == "post_add":
+        apply = assignments.add_assignments
+    elif action == "post_remove":
+        apply = assignments.remove_assignments
+    else:
+        return
+
+    pk_set = set(pk_set or ())
+
+    def update():
+        if reverse:
+            for owner_id in pk_set:
+                apply(relation, owner_id, [instance.pk])
+        else:
+            apply(relation, instance.pk, pk_set)
+
+    transaction.on_commit(update)
+
+
+@receiver(m2m_changed, sender=User.assigned_communitymanagers.through)
+def update_moderator_cms_graph(sender, instance, action, reverse, pk_set, **kwargs):
+    _update_assignment_graph(
+        assignments.MODERATOR_CMS, instance, action, reverse, pk_set
+    )
+
+
+@receiver(m2m_changed, sender=User.assigned_communitymanagerstoclient.through)
+def update_client_cms_graph(sender, instance, action, reverse, pk_set, **kwargs):
+    _update_assignment_graph(assignments.CLIENT_CMS, instance, action, reverse, pk_set)
+
+
+@receiver(post_save, sender=User)
+def update_client_moderator_graph(sender, instance, created, **kwargs):
+    if created and instance.assigned_moderator_id is None:
+        return
+    transaction.on_commit(
+        lambda: assignments.set_assigned_moderator(
+            instance.pk, instance.assigned_moderator_id
+        )
+    )
+
+
+@receiver(post_delete, sender=User)
+def drop_deleted_user_from_graph(sender, instance, **kwargs):
+    # Cascaded M2M rows and SET_NULL moderators send no signals of their own
+    transaction.on_commit(assignments.invalidate_assignment_graph)
+
+
+@receiver(post_save, sender=User)
+def update_users_list_record(sender, instance, created, update_fields=None, **kwargs):
+    # Saves such as the last_login update on sign in change nothing listed
+    if update_fields and not services.USERS_LIST_FIELDS.intersection(update_fields):
+        return
+
+    user_id = instance.pk
+
+    def update():
+        user_ids = {user_id}
+        if not created:
+            user_ids |= services.users_list_dependents(user_id)
+        services.update_users_list(user_ids)
+
+    transaction.on_commit(update)
+
+
+@receiver(m2m_changed, sender=User.assigned_communitymanagers.through)
+def update_users_list_assignments(sender, instance, action, reverse, pk_set, **kwargs):
+    # Moderator records list their community managers
+    if action == "post_clear" and reverse:
+        transaction.on_commit(services.invalidate_users_list)
+    elif action in ("post_add", "post_remove", "post_clear"):
+        moderator_ids = set(pk_set or ()) if reverse else {instance.pk}
+        transaction.on_commit(lambda: services.update_users_list(moderator_ids))
+
+
+@receiver(pre_delete, sender=User)
+def collect_users_list_dependents(sender, instance, **kwargs):
+    # The relations are gone by post_delete, SET_NULL sends no signals
+    instance._users_list_dependents = services.users_list_dependents(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def drop_deleted_user_from_users_list(sender, instance, **kwargs):
+    user_ids = {instance.pk} | getattr(instance, "_users_list_dependents", set())
+    transaction.on_commit(lambda: services.update_users_list(user_ids))
@@ -1,14 +1,16 @@
 from celery import shared_task
-from django.core.mail import send_mail
-from planit import settings
+from apps.accounts import email_queue
 
 
 @shared_task
 def send_celery_email(subject, message, recipient_list, fail_silently=False):
-    send_mail(
-        subject,
-        message,
-        settings.EMAIL_HOST_USER,
-        recipient_list,
-        fail_silently=fail_silently,
+    """Queue an email, it is sent by ``deliver_queued_emails`` in a batch"""
+    email_queue.queue_email(
+        subject, message, recipient_list, fail_silently=fail_silently
     )
+
+
+@shared_task
+def deliver_queued_emails():
+    """Send queued emails in batches over a shared SMTP connection"""
+    return email_queue.deliver_queued_emails()
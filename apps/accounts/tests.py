@@ -1,8 +1,31 @@
+import time
+from smtplib import SMTPException
+from unittest.mock import patch
+
 from django.test import TestCase
 from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.mail import get_connection
+from apps.accounts import assignments, email_queue, services
+from apps.accounts.assignments import (
+    invalidate_assignment_graph,
+    is_assigned_to_user,
+    is_client_community_manager,
+)
 from apps.accounts.tasks import send_celery_email
-from rest_framework.test import APIClient
+from rest_framework.test import APIClient, APIRequestFactory
 from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+from apps.accounts.authentication import JWTHeaderAuthentication
+from apps.accounts.services import (
+    USERS_LIST_KEY,
+    get_cached_users_list,
+    invalidate_users_list,
+)
+from asgiref.sync import async_to_sync
+from planit.redis_client import get_redis
+from planit.websocket_auth import TokenAuthMiddleware
 
 User = get_user_model()
 
@@ -85,3 +108,413 @@ class CeleryTaskTestCase(TestCase):
             recipient_list=["recipient@example.com"],
         )
         self.assertTrue(result.id)  # Check if the task was queued
+
+
+class EmailQueueTestCase(TestCase):
+    """Test cases for batched email delivery"""
+
+    def setUp(self):
+        self._clear_queue()
+
+    def tearDown(self):
+        self._clear_queue()
+
+    def _clear_queue(self):
+        from django_redis import get_redis_connection
+
+        get_redis_connection("default").delete(
+            email_queue.EMAIL_QUEUE_KEY,
+            email_queue.EMAIL_FAILED_KEY,
+            email_queue.EMAIL_METRICS_KEY,
+            email_queue.EMAIL_SCHEDULED_KEY,
+            email_queue.EMAIL_RETRY_KEY,
+            email_queue.EMAIL_PROCESSING_KEY,
+        )
+
+    def _queue(self, count):
+        for i in range(count):
+            email_queue.queue_email(
+                f"Subject {i}", "Body", [f"user{i}@example.com"], schedule=False
+            )
+
+    def test_batch_is_sent_over_one_connection(self):
+        """Test queued emails are delivered in one batch"""
+        self._queue(3)
+
+        with patch("django.core.mail.backends.locmem.EmailBackend.open") as mock_open:
+            self.assertEqual(email_queue.deliver_email_batch(), 3)
+
+        mock_open.assert_called_once()
+        self.assertEqual(len(mail.outbox), 3)
+        metrics = email_queue.get_email_metrics()
+        self.assertEqual(metrics["sent"], 3)
+        self.assertEqual(metrics["queued"], 0)
+
+    def test_failed_message_is_retried(self):
+        """Test a failing message is retried with backoff, then dead-lettered"""
+        self._queue(2)
+        connection = get_connection()
+
+        with patch.object(
+            connection, "send_messages", side_effect=[SMTPException("boom"), 1]
+        ):
+            email_queue.deliver_email_batch(connection=connection)
+
+        metrics = email_queue.get_email_metrics()
+        self.assertEqual(metrics["sent"], 1)
+        self.assertEqual(metrics["retried"], 1)
+        self.assertEqual(metrics["retrying"], 1)
+        self.assertEqual(metrics["queued"], 0)
+
+        # Not retried before its backoff delay
+        self.assertEqual(email_queue.requeue_due_emails(), 0)
+
+        with patch.object(
+            connection, "send_messages", side_effect=SMTPException("boom")
+        ):
+            for _ in range(email_queue.EMAIL_MAX_ATTEMPTS):
+                email_queue.requeue_due_emails(now=time.time() + 86400)
+                email_queue.deliver_email_batch(connection=connection)
+
+        metrics = email_queue.get_email_metrics()
+        self.assertEqual(metrics["failed"], 1)
+        self.assertEqual(metrics["queued"], 0)
+        self.assertEqual(metrics["retrying"], 0)
+        self.assertEqual(metrics["dead_lettered"], 1)
+
+        self.assertEqual(email_queue.redrive_failed_emails(), 1)
+        self.assertEqual(email_queue.deliver_email_batch(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(email_queue.get_email_metrics()["dead_lettered"], 0)
+
+    def test_abandoned_batch_is_requeued(self):
+        """Test messages of a worker that died mid-batch are delivered later"""
+        self._queue(2)
+        connection = get_connection()
+
+        with patch.object(connection, "send_messages", side_effect=SystemExit):
+            with self.assertRaises(SystemExit):
+                email_queue.deliver_email_batch(connection=connection)
+        self.assertEqual(email_queue.get_email_metrics()["queued"], 0)
+
+        requeued = email_queue.requeue_due_emails(
+            now=time.time() + email_queue.EMAIL_PROCESSING_TIMEOUT + 1
+        )
+
+        self.assertEqual(requeued, 2)
+        self.assertEqual(email_queue.deliver_email_batch(), 2)
+        self.assertEqual(len(mail.outbox), 2)
+
+
+class PrincipalCacheTestCase(TestCase):
+    """Test cases for the authenticated user cache"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="principal@example.com",
+            password="testpass123",
+        )
+        self.token = AccessToken.for_user(self.user)
+        self.request = APIRequestFactory().get(
+            "/", HTTP_AUTHORIZATION=f"Bearer {self.token}"
+        )
+
+    def test_cached_user_needs_no_query(self):
+        """Test a repeated authentication is served from the cache"""
+        JWTHeaderAuthentication().authenticate(self.request)
+
+        with self.assertNumQueries(0):
+            user, _ = JWTHeaderAuthentication().authenticate(self.request)
+        self.assertEqual(user.id, self.user.id)
+
+    def test_save_invalidates_cached_user(self):
+        """Test saving the user drops the cached principal"""
+        JWTHeaderAuthentication().authenticate(self.request)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            JWTHeaderAuthentication().authenticate(self.request)
+
+    def test_cached_user_is_dropped_on_commit(self):
+        """Test the principal is only invalidated once the save commits"""
+        JWTHeaderAuthentication().authenticate(self.request)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.user.save()
+            with self.assertNumQueries(0):
+                JWTHeaderAuthentication().authenticate(self.request)
+
+        for callback in callbacks:
+            callback()
+        with self.assertNumQueries(1):
+            JWTHeaderAuthentication().authenticate(self.request)
+
+    def test_websocket_middleware_uses_cache(self):
+        """Test socket authentication reuses the cached principal"""
+
+        async def inner(scope, receive, send):
+            return scope["user"]
+
+        middleware = TokenAuthMiddleware(inner)
+        scope = {"type": "websocket", "query_string": f"token={self.token}".encode()}
+
+        user = async_to_sync(middleware)(dict(scope), None, None)
+        self.assertEqual(user.id, self.user.id)
+
+        with self.assertNumQueries(0):
+            user = async_to_sync(middleware)(dict(scope), None, None)
+        self.assertEqual(user.id, self.user.id)
+
+
+class AssignmentGraphTestCase(TestCase):
+    """Test cases for the cached assignment graph"""
+
+    def setUp(self):
+        invalidate_assignment_graph()
+        self.moderator = User.objects.create_user(
+            email="graph-mod@example.com", password="testpass123", is_moderator=True
+        )
+        self.cm = User.objects.create_user(
+            email="graph-cm@example.com",
+            password="testpass123",
+            is_community_manager=True,
+        )
+        self.client_user = User.objects.create_user(
+            email="graph-client@example.com", password="testpass123", is_client=True
+        )
+
+    def tearDown(self):
+        invalidate_assignment_graph()
+
+    def test_graph_follows_assignment_changes(self):
+        """Test the graph is updated incrementally from M2M signals"""
+        self.assertFalse(is_client_community_manager(self.client_user.id, self.cm.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client_user.assigned_communitymanagerstoclient.add(self.cm)
+        self.assertTrue(is_client_community_manager(self.client_user.id, self.cm.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cm.clients.remove(self.client_user)
+        self.assertFalse(is_client_community_manager(self.client_user.id, self.cm.id))
+
+    def test_lookups_need_no_queries(self):
+        """Test permission lookups are served from the graph"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.moderator.assigned_communitymanagers.add(self.cm)
+            self.client_user.assigned_moderator = self.moderator
+            self.client_user.save()
+        is_assigned_to_user(self.cm, self.moderator.id)
+
+        with self.assertNumQueries(0):
+            # CM of the owner, moderator of the owner, moderator of a CM owner
+            self.assertTrue(is_assigned_to_user(self.cm, self.moderator.id))
+            self.assertTrue(is_assigned_to_user(self.moderator, self.client_user.id))
+            self.assertTrue(is_assigned_to_user(self.moderator, self.cm.id))
+            self.assertFalse(is_assigned_to_user(self.cm, self.client_user.id))
+
+    def test_change_during_rebuild_is_not_lost(self):
+        """Test a rebuild isn't published if an assignment changed meanwhile"""
+        set_key = assignments._set_key
+        changed = []
+
+        def change_during_rebuild(*args):
+            if not changed:
+                changed.append(True)
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.client_user.assigned_communitymanagerstoclient.add(self.cm)
+            return set_key(*args)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.moderator.assigned_communitymanagers.add(self.cm)
+        with patch.object(assignments, "_set_key", change_during_rebuild):
+            self.assertIsNone(assignments.rebuild_assignment_graph())
+
+        # The next lookup rebuilds a graph that has the change
+        self.assertTrue(is_client_community_manager(self.client_user.id, self.cm.id))
+        with self.assertNumQueries(0):
+            self.assertTrue(
+                is_client_community_manager(self.client_user.id, self.cm.id)
+            )
+
+    def test_one_rebuild_at_a_time(self):
+        """Test lookups query the database while another rebuild runs"""
+        get_redis().set(assignments._REBUILD_LOCK_KEY, "other")
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client_user.assigned_communitymanagerstoclient.add(self.cm)
+
+            self.assertTrue(
+                is_client_community_manager(self.client_user.id, self.cm.id)
+            )
+            self.assertIsNone(get_redis().get(assignments._VERSION_KEY))
+        finally:
+            get_redis().delete(assignments._REBUILD_LOCK_KEY)
+
+
+class UsersListTestCase(TestCase):
+    """Test cases for the cached users list"""
+
+    def setUp(self):
+        invalidate_users_list()
+
+    def tearDown(self):
+        invalidate_users_list()
+
+    def test_users_list_query_count_is_fixed(self):
+        """Test building the users list does not query per user"""
+        moderator = User.objects.create_user(
+            email="list-mod@example.com", password="testpass123", is_moderator=True
+        )
+        for i in range(3):
+            cm = User.objects.create_user(
+                email=f"list-cm{i}@example.com",
+                password="testpass123",
+                first_name=f"CM{i}",
+                is_community_manager=True,
+            )
+            moderator.assigned_communitymanagers.add(cm)
+            User.objects.create_user(
+                email=f"list-client{i}@example.com",
+                password="testpass123",
+                is_client=True,
+                assigned_moderator=moderator,
+            )
+
+        with self.assertNumQueries(2):
+            users = get_cached_users_list(force_refresh=True)
+
+        by_email = {user["email"]: user for user in users}
+        self.assertEqual(
+            len(by_email["list-mod@example.com"]["assigned_communitymanagers_list"]),
+            3,
+        )
+        self.assertEqual(
+            by_email["list-client0@example.com"]["assigned_moderator_id"], moderator.id
+        )
+
+    def test_users_list_is_updated_in_place(self):
+        """Test a profile edit rewrites only the affected records"""
+        moderator = User.objects.create_user(
+            email="hash-mod@example.com", password="testpass123", is_moderator=True
+        )
+        cm = User.objects.create_user(
+            email="hash-cm@example.com",
+            password="testpass123",
+            first_name="Old",
+            is_community_manager=True,
+        )
+        moderator.assigned_communitymanagers.add(cm)
+        other = User.objects.create_user(
+            email="hash-other@example.com", password="testpass123"
+        )
+        get_cached_users_list(force_refresh=True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cm.first_name = "New"
+            cm.save()
+
+        with self.assertNumQueries(0):
+            users = get_cached_users_list()
+
+        by_email = {user["email"]: user for user in users}
+        self.assertEqual(len(users), 3)
+        self.assertEqual(by_email["hash-cm@example.com"]["first_name"], "New")
+        self.assertEqual(
+            by_email["hash-mod@example.com"]["assigned_communitymanagers"], "New"
+        )
+        self.assertEqual(by_email["hash-other@example.com"]["id"], other.id)
+
+    def test_change_during_rebuild_is_not_overwritten(self):
+        """Test a rebuild that raced a user change isn't cached"""
+        user = User.objects.create_user(
+            email="race@example.com", password="testpass123", first_name="Old"
+        )
+        build_users_list = services._build_users_list
+
+        def build_then_change():
+            users_data = build_users_list()
+            with self.captureOnCommitCallbacks(execute=True):
+                user.first_name = "New"
+                user.save()
+            return users_data
+
+        with patch.object(services, "_build_users_list", build_then_change):
+            get_cached_users_list(force_refresh=True)
+
+        (record,) = get_cached_users_list()
+        self.assertEqual(record["first_name"], "New")
+
+    def test_deleted_user_is_dropped_from_users_list(self):
+        """Test deleting a moderator removes it and clears its clients"""
+        moderator = User.objects.create_user(
+            email="gone-mod@example.com", password="testpass123", is_moderator=True
+        )
+        client = User.objects.create_user(
+            email="gone-client@example.com",
+            password="testpass123",
+            is_client=True,
+            assigned_moderator=moderator,
+        )
+        get_cached_users_list(force_refresh=True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            moderator.delete()
+
+        from django_redis import get_redis_connection
+
+        self.assertEqual(get_redis_connection("default").hlen(USERS_LIST_KEY), 1)
+        (record,) = get_cached_users_list()
+        self.assertEqual(record["id"], client.id)
+        self.assertIsNone(record["assigned_moderator_id"])
+
+
+class UserSearchTestCase(TestCase):
+    """Test cases for the searchable, paginated user pickers"""
+
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            email="search-admin@example.com",
+            password="testpass123",
+            is_administrator=True,
+        )
+        for name in ("Alice", "Albert", "Bob", "Alina"):
+            User.objects.create_user(
+                email=f"{name.lower()}@example.com",
+                password="testpass123",
+                first_name=name,
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.admin)
+
+    def test_chat_users_search_is_paginated_by_id(self):
+        """Test chat users are filtered by search and paged with a cursor"""
+        response = self.client.get("/api/users/chat/", {"search": "al", "limit": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first_page = [user["first_name"] for user in response.data["results"]]
+        self.assertEqual(first_page, ["Alice", "Albert"])
+
+        response = self.client.get(
+            "/api/users/chat/",
+            {"search": "al", "limit": 2, "cursor": response.data["next_cursor"]},
+        )
+        self.assertEqual(
+            [user["first_name"] for user in response.data["results"]], ["Alina"]
+        )
+        self.assertIsNone(response.data["next_cursor"])
+
+    def test_list_users_search(self):
+        """Test the admin users list can be searched by email"""
+        response = self.client.get("/api/users/", {"search": "bob@"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [user["email"] for user in response.data["results"]], ["bob@example.com"]
+        )
+
+    def test_invalid_cursor(self):
+        """Test a malformed cursor is rejected"""
+        response = self.client.get("/api/users/chat/", {"cursor": "abc"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -34,6 +34,9 @@ from .serializers import (
 )
 
 from .services import (
+    USER_MAX_PAGE_SIZE,
+    USER_PAGE_SIZE,
+    build_user_data,
     get_cached_user_data,
     get_cached_user_by_id,
     get_cached_users_list,
@@ -41,6 +44,9 @@ from .services import (
     notify_assignment_changed,
     notify_user_deleted,
     notify_user_created,
+    paginate_users,
+    search_users,
+    users_list_queryset,
 )  # Import the caching service
 from apps.notifications.services import notify_user  # Import the notification service
 
@@ -571,27 +577,6 @@ class LogoutUserView(APIView):
 
             clear_user_cache(user_id)
 
-            # Also clear any Redis cache patterns for extra safety
-            try:
-                from django_redis import get_redis_connection
-
-                redis_conn = get_redis_connection("default")
-
-                # Clear cache patterns related to the user
-                cache_patterns = [
-                    f"*:user:{user_id}:*",
-                    f"*:user_data:{user_id}*",
-                    f"*:views.decorators.cache.cache_page.*user*{user_id}*",
-                    f"*:current-user*",
-                ]
-
-                for pattern in cache_patterns:
-                    for key in redis_conn.keys(pattern):
-                        redis_conn.delete(key)
-            except Exception as e:
-                # Log but don't interrupt logout process
-                print(f"Error clearing Redis cache during logout: {str(e)}")
-
         response = Response(
             {"message": "Successfully logged out"}, status=status.HTTP_200_OK
         )
@@ -1135,12 +1120,52 @@ class AssignedClientsView(APIView):
         return Response(client_data, status=status.HTTP_200_OK)
 
 
+def get_user_page_params(request):
+    """
+    Read the ``search``, ``cursor`` and ``limit`` parameters of a user
+    picker. Returns ``None`` when none are given, for the unpaginated list.
+    Raises ``ValueError`` if the cursor or limit is not a number.
+    """
+    params = request.query_params
+    if not {"search", "cursor", "limit"}.intersection(params):
+        return None
+
+    cursor = params.get("cursor")
+    limit = int(params.get("limit", USER_PAGE_SIZE))
+    return (
+        params.get("search", ""),
+        int(cursor) if cursor else None,
+        max(1, min(limit, USER_MAX_PAGE_SIZE)),
+    )
+
+
 class ListUsers(APIView):
     permission_classes = [
         IsAdminOrSuperAdmin
     ]  # Only authenticated users can access this view
 
     def get(self, request):
+        try:
+            page_params = get_user_page_params(request)
+        except ValueError:
+            return Response(
+                {"error": "cursor and limit must be integers"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if page_params is not None:
+            search, cursor, limit = page_params
+            users, next_cursor = paginate_users(
+                search_users(users_list_queryset(), search), cursor, limit
+            )
+            return Response(
+                {
+                    "results": [build_user_data(user) for user in users],
+                    "next_cursor": next_cursor,
+                },
+                status=status.HTTP_200_OK,
+            )
+
         # Check for bypass_cache parameter
         bypass_cache = (
             request.query_params.get("bypassCache", "false").lower() == "true"
@@ -1657,9 +1682,28 @@ class ChatUsersView(APIView):
     permission_classes = [IsAuthenticated]  # Allow any authenticated user
 
     def get(self, request):
+        try:
+            page_params = get_user_page_params(request)
+        except ValueError:
+            return Response(
+                {"error": "cursor and limit must be integers"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
         # Get all active users except the current user
         users = User.objects.filter(is_active=True).exclude(id=request.user.id)
 
+        if page_params is not None:
+            search, cursor, limit = page_params
+            users, next_cursor = paginate_users(
+                search_users(users, search), cursor, limit
+            )
+            serializer = GetUserSerializer(users, many=True)
+            return Response(
+                {"results": serializer.data, "next_cursor": next_cursor},
+                status=status.HTTP_200_OK,
+            )
+
         # Serialize the users
         serializer = GetUserSerializer(users, many=True)
 
@@ -1,41 +1,48 @@
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
 from django.utils import timezone
-from .models import ChatRoom, Message
+from . import presence
+from .ephemeral import SignalBuffer, parse_signal
+from .membership import ais_room_member
+from .message_buffer import message_buffer
 
 
 class CollaborationConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.group_name = "collaboration_group"
         self.user_id = self.scope["user"].id  # Assuming user is authenticated
+        self.present = False
 
         # Join the collaboration group
         await self.channel_layer.group_add(self.group_name, self.channel_name)
 
-        # Add user to the list of connected users
-        if not hasattr(self.channel_layer, "connected_users"):
-            self.channel_layer.connected_users = {}
-        self.channel_layer.connected_users[self.user_id] = self.channel_name
-
         await self.accept()
 
+        # Mark the user online, shared with every other worker
+        if self.user_id:
+            await presence.aconnect(self.user_id, self.channel_name)
+            self.present = True
+
     async def disconnect(self, close_code):
         # Leave the collaboration group
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
-
-        # Remove user from the list of connected users
-        if hasattr(self.channel_layer, "connected_users"):
-            self.channel_layer.connected_users.pop(self.user_id, None)
+        await self.leave_presence()
 
     async def receive(self, text_data):
         data = json.loads(text_data)
         action = data.get("action")
 
-        if action == "leave_calendar":
+        if action == "heartbeat" and self.present:
+            await presence.aheartbeat(self.user_id, self.channel_name)
+
+        elif action == "leave_calendar":
             # Handle user leaving the calendar
-            if hasattr(self.channel_layer, "connected_users"):
-                self.channel_layer.connected_users.pop(self.user_id, None)
+            await self.leave_presence()
+
+    async def leave_presence(self):
+        if self.present:
+            self.present = False
+            await presence.adisconnect(self.user_id, self.channel_name)
 
     async def user_activity_event(self, event):
         # Placeholder for future Kanban board functionality
@@ -47,12 +54,14 @@ class GeneralChatConsumer(AsyncWebsocketConsumer):
         self.user = self.scope["user"]
         self.current_room_id = None
         self.room_group_name = None
+        self.signals = SignalBuffer(self.channel_layer, self.channel_name, self.user.id)
 
         await self.accept()
 
     async def disconnect(self, close_code):
         # Leave current room if connected
         if self.room_group_name:
+            await self.signals.close(self.current_room_id)
             await self.channel_layer.group_discard(
                 self.room_group_name, self.channel_name
             )
@@ -76,15 +85,21 @@ class GeneralChatConsumer(AsyncWebsocketConsumer):
             if message_content and self.current_room_id:
                 await self.send_message(message_content)
 
+        elif action == "signal":
+            signal = parse_signal(data)
+            if signal and self.current_room_id:
+                self.signals.add(self.current_room_id, *signal)
+
     async def join_room(self, room_id):
         # Leave current room if connected to another
         if self.room_group_name:
+            await self.signals.close(self.current_room_id)
             await self.channel_layer.group_discard(
                 self.room_group_name, self.channel_name
             )
 
         # Check if user is member of the room
-        if await self.is_room_member(room_id, self.user.id):
+        if await ais_room_member(room_id, self.user.id):
             self.current_room_id = room_id
             self.room_group_name = f"chat_{room_id}"
 
@@ -104,6 +119,7 @@ class GeneralChatConsumer(AsyncWebsocketConsumer):
 
     async def leave_room(self, room_id):
         if self.current_room_id == room_id and self.room_group_name:
+            await self.signals.close(room_id)
             await self.channel_layer.group_discard(
                 self.room_group_name, self.channel_name
             )
@@ -115,8 +131,8 @@ class GeneralChatConsumer(AsyncWebsocketConsumer):
             )
 
     async def send_message(self, message_content):
-        # Save message to database
-        message = await self.save_message(
+        # Broadcast right away, the buffer writes the message shortly after
+        message = await message_buffer.add(
             self.current_room_id, self.user.id, message_content
         )
 
@@ -144,19 +160,19 @@ class GeneralChatConsumer(AsyncWebsocketConsumer):
         # Send message to WebSocket
         await self.send(text_data=json.dumps({"type": "message", "message": message}))
 
-    @database_sync_to_async
-    def is_room_member(self, room_id, user_id):
-        try:
-            room = ChatRoom.objects.get(id=room_id, is_active=True)
-            return room.members.filter(id=user_id).exists()
-        except ChatRoom.DoesNotExist:
-            return False
-
-    @database_sync_to_async
-    def save_message(self, room_id, user_id, content):
-        room = ChatRoom.objects.get(id=room_id)
-        message = Message.objects.create(room=room, sender_id=user_id, content=content)
-        return message
+    async def chat_signals(self, event):
+        # Relay the other connections' signals
+        if self.channel_name != event["sender_channel_name"]:
+            await self.send(
+                text_data=json.dumps(
+                    {
+                        "type": "signals",
+                        "room_id": event["room_id"],
+                        "user_id": event["user_id"],
+                        "signals": event["signals"],
+                    }
+                )
+            )
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
@@ -164,9 +180,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.room_id = self.scope["url_route"]["kwargs"]["room_id"]
         self.room_group_name = f"chat_{self.room_id}"
         self.user = self.scope["user"]
+        self.signals = SignalBuffer(self.channel_layer, self.channel_name, self.user.id)
 
         # Check if user is member of the room
-        if await self.is_room_member(self.room_id, self.user.id):
+        if await ais_room_member(self.room_id, self.user.id):
             # Join room group
             await self.channel_layer.group_add(self.room_group_name, self.channel_name)
             await self.accept()
@@ -175,6 +192,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     async def disconnect(self, close_code):
         # Leave room group
+        await self.signals.close(self.room_id)
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
     async def receive(self, text_data):
@@ -184,8 +202,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
         if action == "send_message":
             message_content = data.get("message")
             if message_content:
-                # Save message to database
-                message = await self.save_message(
+                # Broadcast right away, the buffer writes the message shortly after
+                message = await message_buffer.add(
                     self.room_id, self.user.id, message_content
                 )
 
@@ -207,22 +225,27 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     },
                 )
 
+        elif action == "signal":
+            signal = parse_signal(data)
+            if signal:
+                self.signals.add(self.room_id, *signal)
+
     async def chat_message(self, event):
         message = event["message"]
 
         # Send message to WebSocket
         await self.send(text_data=json.dumps({"type": "message", "message": message}))
 
-    @database_sync_to_async
-    def is_room_member(self, room_id, user_id):
-        try:
-            room = ChatRoom.objects.get(id=room_id, is_active=True)
-            return room.members.filter(id=user_id).exists()
-        except ChatRoom.DoesNotExist:
-            return False
-
-    @database_sync_to_async
-    def save_message(self, room_id, user_id, content):
-        room = ChatRoom.objects.get(id=room_id)
-        message = Message.objects.create(room=room, sender_id=user_id, content=content)
-        return message
+    async def chat_signals(self, event):
+        # Relay the other connections' signals
+        if self.channel_name != event["sender_channel_name"]:
+            await self.send(
+                text_data=json.dumps(
+                    {
+                        "type": "signals",
+                        "room_id": event["room_id"],
+                        "user_id": event["user_id"],
+                        "signals": event["signals"],
+                    }
+                )
+            )
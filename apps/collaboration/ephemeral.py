@@ -0,0 +1,128 @@
+"""
+Ephemeral chat signals: typing, viewing a room and read positions.
+
+Signals are only relayed to the other connections in the room, they never
+touch the database. Each connection keeps the latest value of every signal
+per room and sends what changed as one ``chat_signals`` event every
+``CHAT_SIGNAL_INTERVAL`` seconds, so a burst of keystrokes costs a single
+channel layer message. Connections get ``CHAT_SIGNAL_BURST`` signals up
+front and ``CHAT_SIGNAL_RATE`` more per second, the rest are dropped.
+"""
+
+import asyncio
+import time
+
+from django.conf import settings
+
+SIGNAL_INTERVAL = getattr(settings, "CHAT_SIGNAL_INTERVAL", 0.5)
+SIGNAL_RATE = getattr(settings, "CHAT_SIGNAL_RATE", 5)
+SIGNAL_BURST = getattr(settings, "CHAT_SIGNAL_BURST", 20)
+
+TYPING = "typing"
+VIEWING = "viewing"
+READ_POSITION = "read_position"
+
+
+def parse_signal(data):
+    """
+    The ``(kind, value)`` of a signal sent by a client, or ``None`` if it
+    is malformed. Typing and viewing carry a boolean ``active``, read
+    positions a ``message_id``.
+    """
+    kind = data.get("kind")
+    if kind in (TYPING, VIEWING):
+        active = data.get("active")
+        if isinstance(active, bool):
+            return kind, active
+    elif kind == READ_POSITION:
+        message_id = data.get("message_id")
+        if isinstance(message_id, int) and not isinstance(message_id, bool):
+            return kind, message_id
+    return None
+
+
+class SignalBuffer:
+    """The pending signals of one connection"""
+
+    def __init__(self, channel_layer, channel_name, user_id):
+        self.channel_layer = channel_layer
+        self.channel_name = channel_name
+        self.user_id = user_id
+        self._pending = {}
+        self._active = set()
+        self._flush_handle = None
+        self._tokens = SIGNAL_BURST
+        self._refilled_at = time.monotonic()
+
+    def _take_token(self):
+        now = time.monotonic()
+        self._tokens = min(
+            SIGNAL_BURST, self._tokens + (now - self._refilled_at) * SIGNAL_RATE
+        )
+        self._refilled_at = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def add(self, room_id, kind, value):
+        """
+        Queue a signal for the room, replacing an unsent one of the same
+        kind. Returns ``False`` if the connection is over its rate.
+        """
+        if not self._take_token():
+            return False
+
+        room_id = int(room_id)
+        if kind in (TYPING, VIEWING):
+            if value:
+                self._active.add((room_id, kind))
+            else:
+                self._active.discard((room_id, kind))
+
+        previous = self._pending.get((room_id, kind))
+        if kind == READ_POSITION and previous is not None:
+            # Read positions only move forward
+            value = max(value, previous)
+        self._pending[(room_id, kind)] = value
+
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(
+                SIGNAL_INTERVAL, lambda: loop.create_task(self.flush())
+            )
+        return True
+
+    async def flush(self):
+        """Send the pending signals, one event per room"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, {}
+
+        rooms = {}
+        for (room_id, kind), value in pending.items():
+            rooms.setdefault(room_id, {})[kind] = value
+        for room_id, signals in rooms.items():
+            await self.channel_layer.group_send(
+                f"chat_{room_id}",
+                {
+                    "type": "chat_signals",
+                    "room_id": room_id,
+                    "user_id": self.user_id,
+                    "signals": signals,
+                    "sender_channel_name": self.channel_name,
+                },
+            )
+
+    async def close(self, room_id=None):
+        """
+        Send what is pending, ending typing and viewing in ``room_id`` for
+        a connection that leaves it
+        """
+        if room_id is not None:
+            for kind in (TYPING, VIEWING):
+                if (int(room_id), kind) in self._active:
+                    self._active.discard((int(room_id), kind))
+                    self._pending[(int(room_id), kind)] = False
+        await self.flush()
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from apps.collaboration.services import backfill_direct_room_keys
+
+
+class Command(BaseCommand):
+    help = (
+        "Set the (min_user, max_user) pair key on direct message rooms that "
+        "don't have one, so they are found by the pair key lookups. Pairs "
+        "with more than one room are reported and left for manual cleanup."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what would be keyed without saving",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        keyed, duplicates = backfill_direct_room_keys(
+            dry_run=options["dry_run"], batch_size=options["batch_size"]
+        )
+
+        verb = "Would key" if options["dry_run"] else "Keyed"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {keyed} direct rooms"))
+        if duplicates:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"{len(duplicates)} duplicate direct rooms left unkeyed: "
+                    f"{', '.join(str(room_id) for room_id in duplicates)}"
+                )
+            )
@@ -0,0 +1,198 @@
+"""
+Chat room membership cache used by the chat consumers.
+
+Each active room's member ids are mirrored in a Redis set, so checking a
+user on connect or when switching rooms is a single round-trip. A set is
+loaded from the database on first use and kept up to date from the
+``ChatRoom.members`` signals in ``apps.collaboration.signals``. It always
+holds a marker entry, so a room without members is cached too. If Redis is
+unavailable checks fall back to a query.
+
+Every change bumps the room's generation, and a load only writes the set
+if the generation is the one it saw before querying, so a member removed
+while the set was being loaded isn't cached back in.
+"""
+
+import logging
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+
+from planit.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Seconds a room's members are cached before they are reloaded
+ROOM_MEMBERS_TIMEOUT = 24 * 3600
+
+_LOADED = "loaded"
+
+# Only write the set if no change was made since the generation was read
+# KEYS: members, generation
+# ARGV: generation read before the query, timeout, marker and member ids
+_STORE_MEMBERS_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('SADD', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+# Only change sets that are loaded, so a partial set is never cached
+# KEYS: members, generation
+# ARGV: timeout, member ids
+_ADD_MEMBERS_SCRIPT = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('SADD', KEYS[1], unpack(ARGV, 2))
+return 1
+"""
+
+
+def _members_key(room_id):
+    return f"chat_room_members:{room_id}"
+
+
+def _generation_key(room_id):
+    return f"chat_room_members_generation:{room_id}"
+
+
+def _queue_generation_bump(pipe, room_id):
+    pipe.incr(_generation_key(room_id))
+    pipe.expire(_generation_key(room_id), ROOM_MEMBERS_TIMEOUT)
+
+
+def _query_members(room_id):
+    from .models import ChatRoom
+
+    return set(
+        ChatRoom.members.through.objects.filter(
+            chatroom_id=room_id, chatroom__is_active=True
+        ).values_list("user_id", flat=True)
+    )
+
+
+def _load_members(room_id, redis_conn):
+    """Cache the members of an active room and return their ids"""
+    generation = redis_conn.get(_generation_key(room_id)) or b""
+    member_ids = _query_members(room_id)
+    # Left uncached if the members changed meanwhile, the next check reloads
+    redis_conn.eval(
+        _STORE_MEMBERS_SCRIPT,
+        2,
+        _members_key(room_id),
+        _generation_key(room_id),
+        generation,
+        ROOM_MEMBERS_TIMEOUT,
+        _LOADED,
+        *member_ids,
+    )
+    return member_ids
+
+
+def _read_cached_membership(room_id, user_id):
+    """The cached answer, or ``None`` if the room isn't cached"""
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.sismember(_members_key(room_id), _LOADED)
+        pipe.sismember(_members_key(room_id), user_id)
+        loaded, member = pipe.execute()
+    except Exception as e:
+        logger.warning(f"Error reading room membership cache: {e}")
+        return None
+    return bool(member) if loaded else None
+
+
+def _check_membership(room_id, user_id):
+    from .models import ChatRoom
+
+    try:
+        return int(user_id) in _load_members(room_id, get_redis())
+    except Exception as e:
+        logger.warning(f"Error loading room membership cache: {e}")
+        return ChatRoom.objects.filter(
+            id=room_id, is_active=True, members=user_id
+        ).exists()
+
+
+def is_room_member(room_id, user_id):
+    """Whether the user is a member of the room and the room is active"""
+    member = _read_cached_membership(room_id, user_id)
+    if member is None:
+        member = _check_membership(room_id, user_id)
+    return member
+
+
+async def ais_room_member(room_id, user_id):
+    """
+    Async variant of ``is_room_member``. Cache hits don't go through the
+    thread that serializes database access.
+    """
+    member = await sync_to_async(_read_cached_membership, thread_sensitive=False)(
+        room_id, user_id
+    )
+    if member is None:
+        member = await database_sync_to_async(_check_membership)(room_id, user_id)
+    return member
+
+
+def get_room_members(room_id):
+    """Ids of the members of an active room"""
+    try:
+        redis_conn = get_redis()
+        members = redis_conn.smembers(_members_key(room_id))
+        if _LOADED.encode() not in members:
+            return _load_members(room_id, redis_conn)
+        return {int(member) for member in members if member != _LOADED.encode()}
+    except Exception as e:
+        logger.warning(f"Error reading room membership cache: {e}")
+        return _query_members(room_id)
+
+
+def add_members(room_id, user_ids):
+    if not user_ids:
+        return
+    try:
+        get_redis().eval(
+            _ADD_MEMBERS_SCRIPT,
+            2,
+            _members_key(room_id),
+            _generation_key(room_id),
+            ROOM_MEMBERS_TIMEOUT,
+            *user_ids,
+        )
+    except Exception as e:
+        logger.warning(f"Error updating room membership cache: {e}")
+        invalidate_rooms([room_id])
+
+
+def remove_members(room_id, user_ids):
+    if not user_ids:
+        return
+    try:
+        pipe = get_redis().pipeline()
+        pipe.srem(_members_key(room_id), *user_ids)
+        _queue_generation_bump(pipe, room_id)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Error updating room membership cache: {e}")
+        invalidate_rooms([room_id])
+
+
+def invalidate_rooms(room_ids):
+    """Drop the cached members of rooms, the next check reloads them"""
+    if not room_ids:
+        return
+    try:
+        pipe = get_redis().pipeline()
+        pipe.delete(*[_members_key(room_id) for room_id in room_ids])
+        for room_id in room_ids:
+            _queue_generation_bump(pipe, room_id)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Error invalidating room membership cache: {e}")
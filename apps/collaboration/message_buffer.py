@@ -0,0 +1,190 @@
+"""
+Write-behind persistence of chat messages sent over WebSockets.
+
+Consumers hand messages to ``message_buffer`` and broadcast them right away
+with their application-assigned id, without waiting for the database. The
+buffer collects messages per room and writes them with one ``bulk_create``
+every ``CHAT_FLUSH_INTERVAL`` seconds, or as soon as a room has
+``CHAT_FLUSH_BATCH_SIZE`` pending messages. Whatever is left when the
+process exits is written by an ``atexit`` hook.
+
+Messages were seen by users already, so they are never given up on: a room
+whose write fails keeps its messages pending and is retried with an
+exponential backoff, up to ``CHAT_FLUSH_MAX_RETRY_DELAY`` seconds apart.
+Only a message the database rejects (a duplicate id or a deleted room) is
+logged and left out.
+"""
+
+import asyncio
+import atexit
+import logging
+import threading
+import time
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = getattr(settings, "CHAT_FLUSH_INTERVAL", 0.05)
+FLUSH_BATCH_SIZE = getattr(settings, "CHAT_FLUSH_BATCH_SIZE", 100)
+
+# Longest wait, in seconds, between retries of a room whose writes fail
+FLUSH_MAX_RETRY_DELAY = getattr(settings, "CHAT_FLUSH_MAX_RETRY_DELAY", 30)
+
+
+class MessageBuffer:
+    def __init__(self):
+        self._pending = {}
+        # room id -> failed writes in a row, and when to retry
+        self._attempts = {}
+        self._retry_at = {}
+        self._lock = threading.Lock()
+        self._flush_handle = None
+
+    def pending_count(self):
+        with self._lock:
+            return sum(len(messages) for messages in self._pending.values())
+
+    async def add(self, room_id, sender_id, content):
+        """
+        Buffer a new message and return it. It has its id and timestamp
+        already, and is written within ``FLUSH_INTERVAL`` seconds.
+        """
+        message = Message(
+            room_id=room_id,
+            sender_id=sender_id,
+            content=content,
+            created_at=timezone.now(),
+        )
+        with self._lock:
+            room_messages = self._pending.setdefault(room_id, [])
+            room_messages.append(message)
+            full = len(room_messages) >= FLUSH_BATCH_SIZE
+
+        if full:
+            await self.flush()
+        else:
+            self._schedule_flush()
+        return message
+
+    def _schedule_flush(self, delay=FLUSH_INTERVAL):
+        loop = asyncio.get_running_loop()
+        if self._flush_handle is not None:
+            if self._flush_handle.when() <= loop.time() + delay:
+                return
+            self._flush_handle.cancel()
+        self._flush_handle = loop.call_later(
+            delay, lambda: loop.create_task(self.flush())
+        )
+
+    async def flush(self):
+        """Write every pending message that isn't waiting for a retry"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        await database_sync_to_async(self.flush_sync)()
+
+        # Failed writes were put back, retry them once their backoff is over
+        with self._lock:
+            retry_at = [self._retry_at.get(room_id, 0) for room_id in self._pending]
+        if retry_at:
+            self._schedule_flush(max(min(retry_at) - time.monotonic(), FLUSH_INTERVAL))
+
+    def flush_sync(self, force=False):
+        """
+        Write the pending messages from synchronous code. Rooms waiting for
+        a retry are left for later, unless ``force``.
+        """
+        now = time.monotonic()
+        with self._lock:
+            pending = {
+                room_id: messages
+                for room_id, messages in self._pending.items()
+                if force or self._retry_at.get(room_id, 0) <= now
+            }
+            for room_id in pending:
+                del self._pending[room_id]
+        if not pending:
+            return
+
+        # Savepoints keep a failed write from breaking an enclosing transaction
+        try:
+            with transaction.atomic():
+                Message.objects.bulk_create(
+                    [message for messages in pending.values() for message in messages]
+                )
+        except Exception:
+            # Write room by room, so one bad room doesn't hold back the rest
+            for room_id, messages in pending.items():
+                self._write_room(room_id, messages)
+        else:
+            for room_id in pending:
+                self._written(room_id)
+
+    def _write_room(self, room_id, messages):
+        try:
+            with transaction.atomic():
+                Message.objects.bulk_create(messages)
+        except IntegrityError:
+            # Retrying won't help, save the messages that can be saved
+            self._write_messages(room_id, messages)
+        except Exception as e:
+            self._retry_later(room_id, messages, e)
+        else:
+            self._written(room_id)
+
+    def _write_messages(self, room_id, messages):
+        for index, message in enumerate(messages):
+            try:
+                with transaction.atomic():
+                    Message.objects.bulk_create([message])
+            except IntegrityError as e:
+                # Already broadcast, so it is reported rather than dropped
+                # silently: a duplicate id or a room that was deleted
+                logger.error(
+                    f"Could not save chat message {message.id} for room "
+                    f"{room_id}, it was broadcast but is lost: {e}"
+                )
+            except Exception as e:
+                self._retry_later(room_id, messages[index:], e)
+                return
+        self._written(room_id)
+
+    def _written(self, room_id):
+        with self._lock:
+            self._attempts.pop(room_id, None)
+            self._retry_at.pop(room_id, None)
+
+    def _retry_later(self, room_id, messages, error):
+        """Put a room's messages back, to be retried after a backoff"""
+        with self._lock:
+            attempts = self._attempts.get(room_id, 0) + 1
+            delay = min(FLUSH_INTERVAL * 2**attempts, FLUSH_MAX_RETRY_DELAY)
+            self._attempts[room_id] = attempts
+            self._retry_at[room_id] = time.monotonic() + delay
+            self._pending[room_id] = messages + self._pending.get(room_id, [])
+        logger.warning(
+            f"Error writing {len(messages)} chat messages for room {room_id} "
+            f"(attempt {attempts}), retrying in {delay:.2f}s: {error}"
+        )
+
+
+message_buffer = MessageBuffer()
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        message_buffer.flush_sync(force=True)
+    except Exception as e:
+        logger.error(f"Error writing chat messages on shutdown: {e}")
+    if message_buffer.pending_count():
+        logger.error(
+            f"{message_buffer.pending_count()} chat messages could not be "
+            "written on shutdown"
+        )
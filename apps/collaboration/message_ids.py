@@ -0,0 +1,203 @@
+"""
+Time-ordered chat message ids.
+
+Messages sent over WebSockets are broadcast before they are saved, so their
+id can't come from the database sequence. Ids are instead built from the
+time in milliseconds, a worker number and a per-millisecond counter::
+
+    (milliseconds since ID_EPOCH) << 12 | worker << 6 | counter
+
+and stay below 2**53 so JavaScript clients can hold them as numbers.
+
+Each process leases its worker number in Redis for ``WORKER_LEASE_TIMEOUT``
+seconds and renews the lease while it generates ids, so two live processes
+never share a number. A process that finds its lease gone takes a new one.
+
+Ids increase with time, but a process may write a message after another
+process wrote a later one: messages are buffered before they are saved and
+clocks differ slightly between hosts. Queries that resume from an id ("since
+id" deltas, read positions) only trust ids older than
+``CHAT_MESSAGE_SETTLE_LAG`` seconds, see ``settled_message_id``.
+"""
+
+import atexit
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+from planit.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# 2024-01-01T00:00:00Z in milliseconds
+ID_EPOCH = 1704067200000
+
+WORKER_BITS = 6
+COUNTER_BITS = 6
+
+# Seconds a worker number stays leased without being renewed
+WORKER_LEASE_TIMEOUT = 60
+
+# Renew well before the lease runs out
+_RENEW_INTERVAL = WORKER_LEASE_TIMEOUT / 3
+
+# Seconds after which every message with an older id is saved: above the
+# write-behind delay and retries of ``message_buffer``, plus clock skew
+SETTLE_LAG = getattr(settings, "CHAT_MESSAGE_SETTLE_LAG", 5)
+
+_WORKER_KEY = "chat_message_id_worker"
+
+# KEYS: one lease key per worker number
+# ARGV: token, lease timeout in milliseconds
+_ACQUIRE_SCRIPT = """
+for index, key in ipairs(KEYS) do
+    if redis.call('SET', key, ARGV[1], 'NX', 'PX', ARGV[2]) then
+        return index - 1
+    end
+end
+return -1
+"""
+
+# KEYS: lease
+# ARGV: token, lease timeout in milliseconds
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# KEYS: lease
+# ARGV: token
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_lock = threading.Lock()
+_last_ms = 0
+_counter = 0
+
+_lease_lock = threading.Lock()
+_worker = None
+_token = None
+_pid = None
+_renewed_at = 0.0
+
+
+def _lease_key(worker):
+    return f"{_WORKER_KEY}:{worker}"
+
+
+def _lease_worker():
+    """Renew this process's lease, or take the first free worker number"""
+    global _worker, _token, _pid
+
+    timeout_ms = WORKER_LEASE_TIMEOUT * 1000
+    redis_conn = get_redis()
+    # A forked process doesn't inherit its parent's lease
+    if (
+        _token is not None
+        and _pid == os.getpid()
+        and redis_conn.eval(_RENEW_SCRIPT, 1, _lease_key(_worker), _token, timeout_ms)
+    ):
+        return
+
+    token = uuid.uuid4().hex
+    keys = [_lease_key(worker) for worker in range(1 << WORKER_BITS)]
+    worker = redis_conn.eval(_ACQUIRE_SCRIPT, len(keys), *keys, token, timeout_ms)
+    if worker < 0:
+        raise RuntimeError("Every chat message id worker number is leased")
+    if _worker is not None and _pid == os.getpid():
+        logger.warning(f"Message id worker lease lost, now worker {worker}")
+    _worker, _token, _pid = worker, token, os.getpid()
+
+
+def _get_worker():
+    """This process's worker number, leased through Redis"""
+    global _worker, _token, _pid, _renewed_at
+
+    if (
+        _worker is not None
+        and _pid == os.getpid()
+        and time.monotonic() - _renewed_at < _RENEW_INTERVAL
+    ):
+        return _worker
+
+    with _lease_lock:
+        if (
+            _worker is None
+            or _pid != os.getpid()
+            or time.monotonic() - _renewed_at >= _RENEW_INTERVAL
+        ):
+            try:
+                _lease_worker()
+            except RuntimeError:
+                raise
+            except Exception as e:
+                # Ids stay unique unless another process draws the same
+                # number, a duplicate is reported when the message is saved
+                logger.warning(f"Error leasing message id worker: {e}")
+                if _pid != os.getpid() or _worker is None:
+                    _worker, _token, _pid = (
+                        random.randrange(1 << WORKER_BITS),
+                        None,
+                        os.getpid(),
+                    )
+            _renewed_at = time.monotonic()
+    return _worker
+
+
+@atexit.register
+def release_worker():
+    """Give up this process's worker number, e.g. on shutdown"""
+    global _worker, _token
+
+    if _token is None or _pid != os.getpid():
+        return
+    try:
+        get_redis().eval(_RELEASE_SCRIPT, 1, _lease_key(_worker), _token)
+    except Exception as e:
+        logger.warning(f"Error releasing message id worker: {e}")
+    _worker = _token = None
+
+
+def new_message_id():
+    """Return a new, unique message id"""
+    global _last_ms, _counter
+
+    worker = _get_worker()
+    with _lock:
+        now = max(int(time.time() * 1000), _last_ms)
+        if now == _last_ms:
+            _counter += 1
+            if _counter >= 1 << COUNTER_BITS:
+                # Out of ids for this millisecond, move on to the next one
+                now += 1
+                _counter = 0
+        else:
+            _counter = 0
+        _last_ms = now
+
+        return (
+            (now - ID_EPOCH) << (WORKER_BITS + COUNTER_BITS)
+            | worker << COUNTER_BITS
+            | _counter
+        )
+
+
+def settled_message_id(lag=None):
+    """
+    The highest id that could have been given out ``lag`` seconds ago
+    (``SETTLE_LAG`` by default). Every message up to it is saved.
+    """
+    lag = SETTLE_LAG if lag is None else lag
+    settled_ms = int((time.time() - lag) * 1000) - ID_EPOCH
+    return ((settled_ms + 1) << (WORKER_BITS + COUNTER_BITS)) - 1
@@ -0,0 +1,69 @@
+# Generated by Django 4.2.25 on 2026-10-19 07:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_direct_pair_keys(apps, schema_editor):
+    """
+    Key the existing two-member direct rooms. When a pair has several rooms
+    only the oldest is keyed, the others stay as they are.
+    """
+    ChatRoom = apps.get_model("collaboration", "ChatRoom")
+    Membership = ChatRoom.members.through
+
+    members = {}
+    for room_id, user_id in Membership.objects.filter(
+        chatroom__room_type="direct"
+    ).values_list("chatroom_id", "user_id"):
+        members.setdefault(room_id, []).append(user_id)
+
+    keyed = set()
+    rooms = []
+    for room in ChatRoom.objects.filter(
+        room_type="direct", id__in=list(members)
+    ).order_by("created_at", "id"):
+        pair = tuple(sorted(members[room.id]))
+        if len(pair) != 2 or pair in keyed:
+            continue
+        keyed.add(pair)
+        room.min_user_id, room.max_user_id = pair
+        rooms.append(room)
+
+    ChatRoom.objects.bulk_update(rooms, ["min_user", "max_user"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("collaboration", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatroom",
+            name="max_user",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatroom",
+            name="min_user",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.RunPython(set_direct_pair_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.25 on 2026-10-19 07:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Separate from the backfill: PostgreSQL can't alter a table with
+    # pending deferred foreign key checks in the same transaction
+    dependencies = [
+        ("collaboration", "0002_direct_room_pair_key"),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name="chatroom",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("room_type", "direct")),
+                fields=("min_user", "max_user"),
+                name="chatroom_direct_pair_unique",
+            ),
+        ),
+    ]
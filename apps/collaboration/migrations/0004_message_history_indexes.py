@@ -0,0 +1,51 @@
+# Generated by Django 4.2.25 on 2026-10-19 07:26
+
+from django.db import migrations, models
+
+INDEXES = [
+    models.Index(fields=["room", "created_at", "id"], name="message_room_created_idx"),
+    models.Index(fields=["room", "id"], name="message_room_id_idx"),
+]
+
+
+def add_indexes(apps, schema_editor):
+    model = apps.get_model("collaboration", "Message")
+    # PostgreSQL builds them without locking the table against writes,
+    # other databases (SQLite in tests) the plain way
+    concurrently = schema_editor.connection.vendor == "postgresql"
+    for index in INDEXES:
+        if concurrently:
+            schema_editor.add_index(model, index, concurrently=True)
+        else:
+            schema_editor.add_index(model, index)
+
+
+def remove_indexes(apps, schema_editor):
+    model = apps.get_model("collaboration", "Message")
+    concurrently = schema_editor.connection.vendor == "postgresql"
+    for index in INDEXES:
+        if concurrently:
+            schema_editor.remove_index(model, index, concurrently=True)
+        else:
+            schema_editor.remove_index(model, index)
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ("collaboration", "0003_direct_room_pair_unique"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(add_indexes, remove_indexes),
+            ],
+            state_operations=[
+                migrations.AddIndex(model_name="message", index=index)
+                for index in INDEXES
+            ],
+        ),
+    ]
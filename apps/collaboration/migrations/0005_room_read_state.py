@@ -0,0 +1,100 @@
+# Generated by Django 4.2.25 on 2026-10-19 07:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Max
+
+
+def create_read_states(apps, schema_editor):
+    """
+    Start every member at the newest message already flagged read in the
+    room, so existing conversations don't come back as unread.
+    """
+    ChatRoom = apps.get_model("collaboration", "ChatRoom")
+    Message = apps.get_model("collaboration", "Message")
+    RoomReadState = apps.get_model("collaboration", "RoomReadState")
+
+    last_read = dict(
+        Message.objects.filter(is_read=True)
+        .order_by()
+        .values("room")
+        .annotate(last_read=Max("id"))
+        .values_list("room", "last_read")
+    )
+    RoomReadState.objects.bulk_create(
+        (
+            RoomReadState(
+                room_id=room_id,
+                user_id=user_id,
+                last_read_message_id=last_read[room_id],
+                read_settled_message_id=last_read[room_id],
+            )
+            for room_id, user_id in ChatRoom.members.through.objects.filter(
+                chatroom_id__in=list(last_read)
+            ).values_list("chatroom_id", "user_id")
+        ),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("collaboration", "0004_message_history_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RoomReadState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("last_read_message_id", models.BigIntegerField(default=0)),
+                (
+                    "read_settled_message_id",
+                    models.BigIntegerField(
+                        default=0, help_text="Highest settled message id when last read"
+                    ),
+                ),
+                (
+                    "read_unsettled_count",
+                    models.IntegerField(
+                        default=0,
+                        help_text="Messages read after read_settled_message_id",
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "room",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="read_states",
+                        to="collaboration.chatroom",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="room_read_states",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="roomreadstate",
+            constraint=models.UniqueConstraint(
+                fields=("room", "user"), name="room_read_state_unique"
+            ),
+        ),
+        migrations.RunPython(create_read_states, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.25 on 2026-10-19 07:32
+
+import apps.collaboration.message_ids
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("collaboration", "0005_room_read_state"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="message",
+            name="id",
+            field=models.BigIntegerField(
+                default=apps.collaboration.message_ids.new_message_id,
+                editable=False,
+                primary_key=True,
+                serialize=False,
+            ),
+        ),
+    ]
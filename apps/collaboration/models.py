@@ -2,6 +2,8 @@ from django.db import models
 from django.conf import settings
 from django.utils import timezone
 
+from .message_ids import new_message_id
+
 
 class ChatRoom(models.Model):
     ROOM_TYPES = [
@@ -22,6 +24,25 @@ class ChatRoom(models.Model):
     )
     is_active = models.BooleanField(default=True)
 
+    # Direct rooms only: the two members ordered by id, so that the room of
+    # a pair is found (and kept unique) with one index probe
+    min_user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="+",
+    )
+    max_user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="+",
+    )
+
     def __str__(self):
         if self.name:
             return self.name
@@ -35,9 +56,26 @@ class ChatRoom(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["min_user", "max_user"],
+                condition=models.Q(room_type="direct"),
+                name="chatroom_direct_pair_unique",
+            ),
+        ]
+
+    @staticmethod
+    def direct_pair(user_id, other_id):
+        """The ``(min_user_id, max_user_id)`` key of a direct room"""
+        return (user_id, other_id) if user_id < other_id else (other_id, user_id)
 
 
 class Message(models.Model):
+    # Assigned by the application rather than the database, so WebSocket
+    # messages can be broadcast before they are written
+    id = models.BigIntegerField(
+        primary_key=True, default=new_message_id, editable=False
+    )
     room = models.ForeignKey(
         ChatRoom, on_delete=models.CASCADE, related_name="messages"
     )
@@ -56,9 +94,57 @@ class Message(models.Model):
 
     class Meta:
         ordering = ["created_at"]
+        indexes = [
+            # History pages walk (created_at, id) backwards from a cursor
+            models.Index(
+                fields=["room", "created_at", "id"], name="message_room_created_idx"
+            ),
+            # Reconnecting clients fetch the messages after an id
+            models.Index(fields=["room", "id"], name="message_room_id_idx"),
+        ]
 
     def mark_as_read(self):
         if not self.is_read:
             self.is_read = True
             self.read_at = timezone.now()
             self.save(update_fields=["is_read", "read_at"])
+
+
+class RoomReadState(models.Model):
+    """
+    How far a member has read a room: every message up to
+    ``last_read_message_id`` counts as read for them. Replaces the
+    ``Message.is_read`` flag shared by all members.
+
+    Messages are saved shortly after they are sent, so one may still be
+    saved below the position after it was read. The member's unread
+    messages are those after ``read_settled_message_id``, less the
+    ``read_unsettled_count`` of them that were read.
+    """
+
+    room = models.ForeignKey(
+        ChatRoom, on_delete=models.CASCADE, related_name="read_states"
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="room_read_states",
+    )
+    last_read_message_id = models.BigIntegerField(default=0)
+    read_settled_message_id = models.BigIntegerField(
+        default=0, help_text="Highest settled message id when last read"
+    )
+    read_unsettled_count = models.IntegerField(
+        default=0, help_text="Messages read after read_settled_message_id"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["room", "user"], name="room_read_state_unique"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} read room {self.room_id} up to {self.last_read_message_id}"
@@ -0,0 +1,297 @@
+"""
+User presence shared by every WebSocket worker.
+
+Each open connection heartbeats into a per-user Redis sorted set scored by
+its expiry time, and ``presence:online`` holds every online user scored by
+the latest expiry of their connections. A user is online while that score
+is in the future, so connections of a crashed worker expire on their own.
+
+Every worker heartbeats its open connections together every
+``PRESENCE_HEARTBEAT_INTERVAL`` seconds, so clients don't have to (a
+client ``heartbeat`` action is still accepted).
+
+Users who come online or go offline are collected in a set, and every
+``PRESENCE_BROADCAST_INTERVAL`` seconds one worker sends the changes as a
+single ``presence_diff`` event to the ``user_activity`` group, with the
+profiles of the users who came online. Consumers relay it to clients as
+the ``user-joined`` and ``user-left`` messages.
+"""
+
+import asyncio
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from planit.redis_client import get_redis
+
+from . import membership
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_HEARTBEAT_INTERVAL = getattr(settings, "PRESENCE_HEARTBEAT_INTERVAL", 30)
+PRESENCE_BROADCAST_INTERVAL = getattr(settings, "PRESENCE_BROADCAST_INTERVAL", 3)
+
+# Seconds without a heartbeat after which a connection counts as gone
+PRESENCE_TIMEOUT = 3 * PRESENCE_HEARTBEAT_INTERVAL
+
+PRESENCE_GROUP = "user_activity"
+
+_ONLINE_KEY = "presence:online"
+_CHANGED_KEY = "presence:changed"
+_BROADCAST_LOCK_KEY = "presence:broadcast_lock"
+
+# KEYS: connections, online, changed
+# ARGV: channel name, expires at, now, user id
+_HEARTBEAT_SCRIPT = """
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('EXPIREAT', KEYS[1], math.ceil(tonumber(ARGV[2])))
+local previous = redis.call('ZSCORE', KEYS[2], ARGV[4])
+if not previous or tonumber(previous) <= tonumber(ARGV[3]) then
+    redis.call('SADD', KEYS[3], ARGV[4])
+end
+if not previous or tonumber(previous) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[2], ARGV[2], ARGV[4])
+end
+return 1
+"""
+
+# KEYS: connections, online, changed
+# ARGV: channel name, now, user id
+_LEAVE_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+if redis.call('ZCARD', KEYS[1]) > 0 then
+    return 0
+end
+if redis.call('ZREM', KEYS[2], ARGV[3]) == 1 then
+    redis.call('SADD', KEYS[3], ARGV[3])
+end
+return 1
+"""
+
+# KEYS: online, changed
+# ARGV: now
+# Returns the changed users that are online, and the users who went offline
+_COLLECT_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if #expired > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+end
+local online = {}
+local offline = expired
+for _, user_id in ipairs(redis.call('SMEMBERS', KEYS[2])) do
+    if redis.call('ZSCORE', KEYS[1], user_id) then
+        table.insert(online, user_id)
+    else
+        table.insert(offline, user_id)
+    end
+end
+redis.call('DEL', KEYS[2])
+return {online, offline}
+"""
+
+
+def _connections_key(user_id):
+    return f"presence:connections:{user_id}"
+
+
+def heartbeat(user_id, channel_name):
+    """Mark a connection of the user as alive for ``PRESENCE_TIMEOUT``"""
+    heartbeat_many([(user_id, channel_name)])
+
+
+def heartbeat_many(connections):
+    """``heartbeat`` for ``(user_id, channel_name)`` pairs, in one round-trip"""
+    if not connections:
+        return
+    now = time.time()
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for user_id, channel_name in connections:
+            pipe.eval(
+                _HEARTBEAT_SCRIPT,
+                3,
+                _connections_key(user_id),
+                _ONLINE_KEY,
+                _CHANGED_KEY,
+                channel_name,
+                now + PRESENCE_TIMEOUT,
+                now,
+                user_id,
+            )
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Error recording presence heartbeat: {e}")
+
+
+def leave(user_id, channel_name):
+    """Drop a connection, the user goes offline with their last one"""
+    try:
+        get_redis().eval(
+            _LEAVE_SCRIPT,
+            3,
+            _connections_key(user_id),
+            _ONLINE_KEY,
+            _CHANGED_KEY,
+            channel_name,
+            time.time(),
+            user_id,
+        )
+    except Exception as e:
+        logger.warning(f"Error recording presence leave: {e}")
+
+
+def get_online_users(user_ids=None):
+    """
+    Ids of the online users among ``user_ids``, in one round-trip. Without
+    ``user_ids``, every online user.
+    """
+    now = time.time()
+    try:
+        redis_conn = get_redis()
+        if user_ids is None:
+            return {
+                int(user_id)
+                for user_id in redis_conn.zrangebyscore(_ONLINE_KEY, f"({now}", "+inf")
+            }
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+        scores = redis_conn.zmscore(_ONLINE_KEY, user_ids)
+    except Exception as e:
+        logger.warning(f"Error reading presence: {e}")
+        return set()
+    return {
+        int(user_id)
+        for user_id, score in zip(user_ids, scores)
+        if score is not None and score > now
+    }
+
+
+def get_room_presence(room_id):
+    """``{user_id: online}`` for the members of a room"""
+    members = membership.get_room_members(room_id)
+    online = get_online_users(members)
+    return {user_id: user_id in online for user_id in sorted(members)}
+
+
+def get_user_profiles(user_ids):
+    """The ``user-joined`` payloads of users, in one query"""
+    from django.contrib.auth import get_user_model
+
+    users = get_user_model().objects.filter(id__in=user_ids).order_by("id")
+    return [
+        {
+            "id": user.id,
+            "name": user.full_name or user.email,
+            "email": user.email,
+            "profilePicture": user.user_image.url if user.user_image else "",
+        }
+        for user in users.only("id", "email", "first_name", "last_name", "user_image")
+    ]
+
+
+def collect_presence_changes():
+    """
+    Take the presence changes since the last broadcast, as
+    ``{"online": [...], "offline": [...]}``. Returns ``None`` when there are
+    none, or another worker broadcast within the interval.
+    """
+    try:
+        redis_conn = get_redis()
+        if not redis_conn.set(
+            _BROADCAST_LOCK_KEY,
+            1,
+            nx=True,
+            px=int(PRESENCE_BROADCAST_INTERVAL * 1000),
+        ):
+            return None
+        online, offline = redis_conn.eval(
+            _COLLECT_SCRIPT, 2, _ONLINE_KEY, _CHANGED_KEY, time.time()
+        )
+    except Exception as e:
+        logger.warning(f"Error collecting presence changes: {e}")
+        return None
+
+    if not online and not offline:
+        return None
+    return {
+        "online": sorted({int(user_id) for user_id in online}),
+        "offline": sorted({int(user_id) for user_id in offline}),
+    }
+
+
+class PresenceBroadcaster:
+    """
+    Heartbeats this worker's open connections and sends the coalesced
+    presence changes while there are any. Every worker runs one, the
+    broadcast lock keeps them from sending the same changes twice.
+    """
+
+    def __init__(self):
+        # channel name -> user id
+        self._connections = {}
+        self._task = None
+
+    def start(self, user_id, channel_name):
+        self._connections[channel_name] = user_id
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self, channel_name):
+        self._connections.pop(channel_name, None)
+
+    async def _run(self):
+        try:
+            refreshed_at = time.monotonic()
+            while True:
+                await asyncio.sleep(PRESENCE_BROADCAST_INTERVAL)
+                if time.monotonic() - refreshed_at >= PRESENCE_HEARTBEAT_INTERVAL:
+                    refreshed_at = time.monotonic()
+                    await self.refresh()
+                await self.broadcast()
+                # The last leave is sent before stopping
+                if not self._connections:
+                    break
+        finally:
+            self._task = None
+
+    async def refresh(self):
+        connections = [
+            (user_id, channel_name)
+            for channel_name, user_id in self._connections.items()
+        ]
+        await sync_to_async(heartbeat_many, thread_sensitive=False)(connections)
+
+    async def broadcast(self):
+        changes = await sync_to_async(
+            collect_presence_changes, thread_sensitive=False
+        )()
+        if changes:
+            users = await database_sync_to_async(get_user_profiles)(changes["online"])
+            await get_channel_layer().group_send(
+                PRESENCE_GROUP,
+                {"type": "presence_diff", "users": users, **changes},
+            )
+
+
+presence_broadcaster = PresenceBroadcaster()
+
+
+async def aconnect(user_id, channel_name):
+    """Heartbeat a new connection and keep it alive while it's open"""
+    await sync_to_async(heartbeat, thread_sensitive=False)(user_id, channel_name)
+    presence_broadcaster.start(user_id, channel_name)
+
+
+async def aheartbeat(user_id, channel_name):
+    await sync_to_async(heartbeat, thread_sensitive=False)(user_id, channel_name)
+
+
+async def adisconnect(user_id, channel_name):
+    presence_broadcaster.stop(channel_name)
+    await sync_to_async(leave, thread_sensitive=False)(user_id, channel_name)
@@ -1,13 +1,15 @@
 from rest_framework import serializers
 from .models import ChatRoom, Message
+from .services import count_unread, get_read_positions
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
 
 class MessageSerializer(serializers.ModelSerializer):
-    sender_name = serializers.CharField(source="sender.get_full_name", read_only=True)
-    sender_email = serializers.EmailField(source="sender.email", read_only=True)
+    sender_name = serializers.SerializerMethodField()
+    sender_email = serializers.SerializerMethodField()
+    is_read = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
@@ -23,6 +25,40 @@ class MessageSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ["id", "sender", "created_at", "is_read", "read_at"]
 
+    def _sender_details(self, obj):
+        # Resolved for the whole page at once when the view provides them
+        senders = self.context.get("senders")
+        if senders is not None and obj.sender_id in senders:
+            return senders[obj.sender_id]
+        return {"name": obj.sender.get_full_name(), "email": obj.sender.email}
+
+    def get_sender_name(self, obj):
+        return self._sender_details(obj)["name"]
+
+    def get_sender_email(self, obj):
+        return self._sender_details(obj)["email"]
+
+    def _read_positions(self, obj, user):
+        # Given for the page's room by the view, else loaded once per room
+        positions = self.context.get("read_positions")
+        if positions is not None:
+            return positions
+        by_room = self.context.setdefault("read_positions_by_room", {})
+        if obj.room_id not in by_room:
+            by_room[obj.room_id] = get_read_positions(obj.room_id, user.id)
+        return by_room[obj.room_id]
+
+    def get_is_read(self, obj):
+        # Read by the viewer for others' messages, and by another member
+        # for the viewer's own messages
+        request = self.context.get("request")
+        if request is None or not request.user.is_authenticated:
+            return False
+        own, others = self._read_positions(obj, request.user)
+        if obj.sender_id == request.user.id:
+            return obj.id <= others
+        return obj.id <= own
+
 
 class ChatRoomSerializer(serializers.ModelSerializer):
     members = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), many=True)
@@ -50,22 +86,35 @@ class ChatRoomSerializer(serializers.ModelSerializer):
         return [
             {
                 "id": member.id,
-                "name": member.get_full_name() or member.email,
+                "name": member.full_name or member.email,
                 "email": member.email,
             }
             for member in obj.members.all()
         ]
 
     def get_last_message(self, obj):
-        last_msg = obj.messages.order_by("-created_at").first()
-        if last_msg:
-            return MessageSerializer(last_msg).data
-        return None
+        # Prefetched by with_room_summaries when listing rooms
+        if hasattr(obj, "latest_messages"):
+            last_msg = obj.latest_messages[0] if obj.latest_messages else None
+        else:
+            last_msg = obj.messages.order_by("-created_at").first()
+        if not last_msg:
+            return None
+        context = dict(self.context)
+        # Annotated by with_room_summaries when listing rooms
+        if hasattr(obj, "own_read_position"):
+            context["read_positions"] = (
+                obj.own_read_position,
+                obj.others_read_position,
+            )
+        return MessageSerializer(last_msg, context=context).data
 
     def get_unread_count(self, obj):
+        if hasattr(obj, "unread_count"):
+            return obj.unread_count
         user = self.context.get("request").user
         if user.is_authenticated:
-            return obj.messages.filter(is_read=False).exclude(sender=user).count()
+            return count_unread(obj.id, user.id)
         return 0
 
 
@@ -0,0 +1,372 @@
+import base64
+import logging
+from datetime import datetime
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, OuterRef, Prefetch, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from . import membership
+from .message_ids import settled_message_id
+from .models import ChatRoom, Message, RoomReadState
+
+logger = logging.getLogger(__name__)
+
+# Messages per page of room history and of a "since" delta
+MESSAGE_PAGE_SIZE = 50
+MESSAGE_MAX_PAGE_SIZE = 200
+
+
+def _direct_rooms_between(user_id, partner_ids):
+    """Direct rooms of ``user_id`` with any of ``partner_ids``, by pair key"""
+    return ChatRoom.objects.filter(room_type="direct").filter(
+        Q(min_user_id=user_id, max_user_id__in=partner_ids)
+        | Q(max_user_id=user_id, min_user_id__in=partner_ids)
+    )
+
+
+def provision_direct_rooms(user, other_ids):
+    """
+    Make sure ``user`` has a direct room with each of the users in
+    ``other_ids``.
+
+    One query over the pair key finds the rooms that already exist, the
+    missing rooms and their membership rows are then created in bulk.
+    Conflicts with rooms created concurrently are ignored, so it is safe to
+    call repeatedly. Returns the number of rooms created.
+    """
+    pairs = {
+        ChatRoom.direct_pair(user.pk, other_id)
+        for other_id in other_ids
+        if other_id is not None and other_id != user.pk
+    }
+    if not pairs:
+        return 0
+
+    partners = [low if high == user.pk else high for low, high in pairs]
+    existing = set(
+        _direct_rooms_between(user.pk, partners).values_list(
+            "min_user_id", "max_user_id"
+        )
+    )
+    missing = pairs - existing
+    if not missing:
+        return 0
+
+    # Ids of rows skipped on conflict aren't returned, so the new rooms are
+    # read back by their key before adding the members
+    ChatRoom.objects.bulk_create(
+        [
+            ChatRoom(
+                room_type="direct",
+                created_by=user,
+                min_user_id=low,
+                max_user_id=high,
+            )
+            for low, high in missing
+        ],
+        ignore_conflicts=True,
+    )
+    created = [
+        (room_id, low, high)
+        for room_id, low, high in _direct_rooms_between(user.pk, partners).values_list(
+            "id", "min_user_id", "max_user_id"
+        )
+        if (low, high) in missing
+    ]
+    Membership = ChatRoom.members.through
+    Membership.objects.bulk_create(
+        [
+            Membership(chatroom_id=room_id, user_id=member_id)
+            for room_id, low, high in created
+            for member_id in (low, high)
+        ],
+        ignore_conflicts=True,
+    )
+    # Bulk inserts skip the m2m signals that keep the members cache current
+    room_ids = [room_id for room_id, _, _ in created]
+    transaction.on_commit(lambda: membership.invalidate_rooms(room_ids))
+
+    logger.info(f"Created {len(missing)} DM rooms for {user.email}")
+    return len(missing)
+
+
+def get_direct_room(user_id, other_id):
+    """The direct room between two users, found by its pair key, or ``None``"""
+    low, high = ChatRoom.direct_pair(int(user_id), int(other_id))
+    return ChatRoom.objects.filter(
+        room_type="direct", min_user_id=low, max_user_id=high
+    ).first()
+
+
+def backfill_direct_room_keys(dry_run=False, batch_size=500):
+    """
+    Key the two-member direct rooms that have no pair key yet, such as rooms
+    made before the key existed or outside ``provision_direct_rooms``. A pair
+    that already has a keyed room is left alone and reported as a duplicate.
+
+    Returns ``(keyed, duplicates)``: the number of rooms keyed and the ids of
+    the duplicate rooms.
+    """
+    Membership = ChatRoom.members.through
+
+    unkeyed = ChatRoom.objects.filter(room_type="direct", min_user__isnull=True)
+    members = {}
+    for room_id, user_id in Membership.objects.filter(chatroom__in=unkeyed).values_list(
+        "chatroom_id", "user_id"
+    ):
+        members.setdefault(room_id, []).append(user_id)
+    pairs = {
+        room_id: tuple(sorted(user_ids))
+        for room_id, user_ids in members.items()
+        if len(user_ids) == 2
+    }
+
+    keyed = set(
+        ChatRoom.objects.filter(room_type="direct", min_user__isnull=False).values_list(
+            "min_user_id", "max_user_id"
+        )
+    )
+    rooms = []
+    duplicates = []
+    for room in unkeyed.filter(id__in=list(pairs)).order_by("created_at", "id"):
+        pair = pairs[room.id]
+        if pair in keyed:
+            duplicates.append(room.id)
+            continue
+        keyed.add(pair)
+        room.min_user_id, room.max_user_id = pair
+        rooms.append(room)
+
+    if not dry_run:
+        ChatRoom.objects.bulk_update(
+            rooms, ["min_user", "max_user"], batch_size=batch_size
+        )
+    return len(rooms), duplicates
+
+
+def with_room_summaries(queryset, user):
+    """
+    Load what ``ChatRoomSerializer`` shows for each room in a fixed number of
+    queries, however many rooms are listed: the unread count and the read
+    positions as subqueries, the latest message through a sliced prefetch
+    (never the full history) and the members' names through one prefetch.
+    """
+    User = get_user_model()
+
+    settled_read = RoomReadState.objects.filter(
+        room=OuterRef(OuterRef("pk")), user=user
+    ).values("read_settled_message_id")[:1]
+    own_state = RoomReadState.objects.filter(room=OuterRef("pk"), user=user)
+    own_read = own_state.values("last_read_message_id")[:1]
+    unsettled_read = own_state.values("read_unsettled_count")[:1]
+    others_read = (
+        RoomReadState.objects.filter(room=OuterRef("pk"))
+        .exclude(user=user)
+        .order_by("-last_read_message_id")
+        .values("last_read_message_id")[:1]
+    )
+    unread = (
+        Message.objects.filter(
+            room=OuterRef("pk"), id__gt=Coalesce(Subquery(settled_read), 0)
+        )
+        .exclude(sender=user)
+        .order_by()
+        .values("room")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    return queryset.annotate(
+        unread_count=Greatest(
+            Coalesce(Subquery(unread), 0) - Coalesce(Subquery(unsettled_read), 0), 0
+        ),
+        own_read_position=Coalesce(Subquery(own_read), 0),
+        others_read_position=Coalesce(Subquery(others_read), 0),
+    ).prefetch_related(
+        Prefetch(
+            "members",
+            queryset=User.objects.only("id", "first_name", "last_name", "email"),
+        ),
+        Prefetch(
+            "messages",
+            queryset=Message.objects.select_related("sender").order_by(
+                "-created_at", "-id"
+            )[:1],
+            to_attr="latest_messages",
+        ),
+    )
+
+
+def encode_message_cursor(message):
+    """Opaque cursor pointing at ``message`` in its room history"""
+    raw = f"{message.created_at.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_message_cursor(cursor):
+    """
+    Return the ``(created_at, id)`` of a cursor. Raises ``ValueError`` if
+    the cursor is malformed.
+    """
+    try:
+        created_at, message_id = (
+            base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        )
+        return datetime.fromisoformat(created_at), int(message_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def get_history_page(room, cursor=None, limit=MESSAGE_PAGE_SIZE):
+    """
+    Return a page of the room's messages, oldest first, and the cursor of
+    the page before it (``None`` when the start of the history is reached).
+
+    Without a cursor the latest messages are returned. Pages are keyed on
+    ``(created_at, id)`` so opening a room costs the same however long its
+    history is.
+    """
+    messages = room.messages.order_by("-created_at", "-id")
+    if cursor:
+        created_at, message_id = decode_message_cursor(cursor)
+        messages = messages.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id)
+        )
+
+    page = list(messages[: limit + 1])
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_message_cursor(page[-1])
+    page.reverse()
+    return page, next_cursor
+
+
+def get_messages_since(room, message_id, limit=MESSAGE_PAGE_SIZE):
+    """
+    Return the messages posted after ``message_id``, oldest first, and
+    whether there are more after them.
+
+    Only settled messages are returned (see ``settled_message_id``), so a
+    client resuming from the last id it got can't skip a message that was
+    saved after a later one. Newer messages come with the next delta, or
+    over the WebSocket.
+    """
+    messages = room.messages.filter(id__gt=message_id, id__lte=settled_message_id())
+    page = list(messages.order_by("id")[: limit + 1])
+    return page[:limit], len(page) > limit
+
+
+def resolve_senders(messages):
+    """
+    Map the sender ids of ``messages`` to their name and email, with one
+    query for all the senders. Passed to ``MessageSerializer`` as the
+    ``senders`` context.
+    """
+    User = get_user_model()
+
+    sender_ids = {message.sender_id for message in messages}
+    return {
+        user.id: {"name": user.full_name, "email": user.email}
+        for user in User.objects.filter(id__in=sender_ids).only(
+            "id", "first_name", "last_name", "email"
+        )
+    }
+
+
+def mark_room_read(room_id, user_id, message_id=None):
+    """
+    Move the user's read position in a room up to ``message_id``, the
+    room's latest message by default. The position never moves back.
+
+    Messages after the settled ids (see ``settled_message_id``) may still be
+    saved below the position. The ones read are counted, so one saved late
+    is unread until read, however low its id.
+
+    A single-row update in the common case, whatever the length of the
+    history. Returns the message id read up to.
+    """
+    if message_id is None:
+        message_id = (
+            Message.objects.filter(room_id=room_id)
+            .order_by("-id")
+            .values_list("id", flat=True)
+            .first()
+        )
+        if message_id is None:
+            return 0
+
+    settled = min(settled_message_id(), message_id)
+    unsettled_read = Message.objects.filter(
+        room_id=room_id, id__gt=settled, id__lte=message_id
+    ).exclude(sender_id=user_id)
+
+    behind = RoomReadState.objects.filter(
+        room_id=room_id, user_id=user_id, last_read_message_id__lt=message_id
+    )
+    updated = behind.update(
+        last_read_message_id=message_id,
+        read_settled_message_id=settled,
+        read_unsettled_count=Coalesce(
+            Subquery(
+                unsettled_read.order_by()
+                .values("room")
+                .annotate(count=Count("id"))
+                .values("count")
+            ),
+            0,
+        ),
+        updated_at=timezone.now(),
+    )
+    if not updated:
+        # First read of the room, or already read further
+        RoomReadState.objects.bulk_create(
+            [
+                RoomReadState(
+                    room_id=room_id,
+                    user_id=user_id,
+                    last_read_message_id=message_id,
+                    read_settled_message_id=settled,
+                    read_unsettled_count=unsettled_read.count(),
+                )
+            ],
+            ignore_conflicts=True,
+        )
+    return message_id
+
+
+def count_unread(room_id, user_id):
+    """
+    Messages from others in the room after the user's read position, or
+    saved below it after it was read
+    """
+    settled, unsettled_read = (
+        RoomReadState.objects.filter(room_id=room_id, user_id=user_id)
+        .values_list("read_settled_message_id", "read_unsettled_count")
+        .first()
+    ) or (0, 0)
+    unread = (
+        Message.objects.filter(room_id=room_id, id__gt=settled)
+        .exclude(sender_id=user_id)
+        .count()
+    )
+    return max(unread - unsettled_read, 0)
+
+
+def get_read_positions(room_id, user_id):
+    """
+    Return ``(own, others)``: how far the user has read the room, and how
+    far the furthest of the other members has. Passed to
+    ``MessageSerializer`` as the ``read_positions`` context.
+    """
+    own = others = 0
+    for member_id, last_read in RoomReadState.objects.filter(
+        room_id=room_id
+    ).values_list("user_id", "last_read_message_id"):
+        if member_id == user_id:
+            own = last_read
+        else:
+            others = max(others, last_read)
+    return own, others
@@ -0,0 +1,57 @@
+# apps/collaboration/signals.py
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from apps.collaboration import membership
+from apps.collaboration.models import ChatRoom
+
+
+def _on_commit_for_rooms(update, room_ids, user_ids):
+    def apply():
+        for room_id in room_ids:
+            update(room_id, user_ids)
+
+    transaction.on_commit(apply)
+
+
+def _invalidate_on_commit(room_id):
+    transaction.on_commit(lambda: membership.invalidate_rooms([room_id]))
+
+
+@receiver(m2m_changed, sender=ChatRoom.members.through)
+def update_room_members_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Mirror membership changes into the room members cache once they are
+    committed. Changes made through ``user.chat_rooms`` are ``reverse``,
+    their ``pk_set`` holds room ids.
+    """
+    if reverse:
+        if action == "pre_clear":
+            # The user's rooms aren't known anymore after the clear
+            room_ids = list(instance.chat_rooms.values_list("id", flat=True))
+            _on_commit_for_rooms(membership.remove_members, room_ids, [instance.pk])
+        elif action == "post_add" and pk_set:
+            _on_commit_for_rooms(membership.add_members, pk_set, [instance.pk])
+        elif action == "post_remove" and pk_set:
+            _on_commit_for_rooms(membership.remove_members, pk_set, [instance.pk])
+        return
+
+    if action == "post_clear":
+        _invalidate_on_commit(instance.pk)
+    elif action == "post_add" and pk_set:
+        _on_commit_for_rooms(membership.add_members, [instance.pk], list(pk_set))
+    elif action == "post_remove" and pk_set:
+        _on_commit_for_rooms(membership.remove_members, [instance.pk], list(pk_set))
+
+
+@receiver(post_save, sender=ChatRoom)
+def invalidate_saved_room_members(sender, instance, created, **kwargs):
+    # A deactivated room must stop admitting its members
+    if not created:
+        _invalidate_on_commit(instance.pk)
+
+
+@receiver(post_delete, sender=ChatRoom)
+def invalidate_deleted_room_members(sender, instance, **kwargs):
+    _invalidate_on_commit(instance.pk)
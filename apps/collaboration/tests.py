@@ -1,7 +1,32 @@
+import asyncio
+import json
+import time
+from unittest.mock import AsyncMock, patch
+
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer
+from django.db import OperationalError
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from django.utils import timezone
+from apps.accounts.consumers import UserActivityConsumer
+from apps.collaboration import membership, message_ids, presence
+from apps.collaboration.ephemeral import SignalBuffer, parse_signal
+from apps.collaboration.message_buffer import MessageBuffer
+from apps.collaboration.message_ids import new_message_id
 from apps.collaboration.models import ChatRoom, Message
+from apps.collaboration.services import (
+    backfill_direct_room_keys,
+    count_unread,
+    get_direct_room,
+    get_messages_since,
+    get_read_positions,
+    mark_room_read,
+    provision_direct_rooms,
+)
+from rest_framework import status
+from rest_framework.test import APIClient
+from planit.redis_client import get_redis
 
 User = get_user_model()
 
@@ -139,3 +164,663 @@ class MessageModelTestCase(TestCase):
         )
         self.assertIn("Sender User", str(message))
         self.assertIn("This is a test message", str(message))
+
+
+class DirectRoomProvisioningTestCase(TestCase):
+    """Test cases for bulk direct message room provisioning"""
+
+    def setUp(self):
+        self.admins = [
+            User.objects.create_user(
+                email=f"dm-admin{i}@example.com",
+                password="testpass123",
+                is_administrator=True,
+            )
+            for i in range(3)
+        ]
+
+    def test_new_user_gets_a_room_with_each_admin(self):
+        """Test signup creates one keyed DM room per administrator"""
+        user = User.objects.create_user(email="dm-new@example.com", password="x")
+
+        rooms = ChatRoom.objects.filter(room_type="direct", members=user)
+        self.assertEqual(rooms.count(), 3)
+        for admin in self.admins:
+            room = rooms.get(members=admin)
+            self.assertEqual(
+                (room.min_user_id, room.max_user_id),
+                ChatRoom.direct_pair(user.id, admin.id),
+            )
+            self.assertEqual(room.members.count(), 2)
+
+    def test_provisioning_is_idempotent(self):
+        """Test existing rooms are found with one query and not duplicated"""
+        user = User.objects.create_user(email="dm-again@example.com", password="x")
+        admin_ids = [admin.id for admin in self.admins]
+
+        with self.assertNumQueries(1):
+            created = provision_direct_rooms(user, admin_ids)
+
+        self.assertEqual(created, 0)
+        self.assertEqual(
+            ChatRoom.objects.filter(room_type="direct", members=user).count(), 3
+        )
+
+
+class DirectRoomKeyTestCase(TestCase):
+    """Test cases for direct room lookups by pair key"""
+
+    def setUp(self):
+        self.user1 = User.objects.create_user(email="key1@example.com", password="x")
+        self.user2 = User.objects.create_user(email="key2@example.com", password="x")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user1)
+
+    def test_create_direct_room_reuses_existing_room(self):
+        """Test creating a direct room twice returns the same keyed room"""
+        data = {"room_type": "direct", "members": [self.user2.id]}
+        first = self.client.post("/api/collaboration/chat-rooms/", data)
+        second = self.client.post("/api/collaboration/chat-rooms/", data)
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        room = get_direct_room(self.user1.id, self.user2.id)
+        self.assertEqual(set(room.members.all()), {self.user1, self.user2})
+        self.assertEqual(
+            ChatRoom.objects.filter(room_type="direct", members=self.user1).count(),
+            1,
+        )
+
+    def test_backfill_keys_unkeyed_rooms(self):
+        """Test the backfill keys legacy rooms and reports duplicates"""
+        rooms = []
+        for _ in range(2):
+            room = ChatRoom.objects.create(room_type="direct", created_by=self.user1)
+            room.members.add(self.user1, self.user2)
+            rooms.append(room)
+
+        keyed, duplicates = backfill_direct_room_keys()
+
+        self.assertEqual(keyed, 1)
+        self.assertEqual(duplicates, [rooms[1].id])
+        self.assertEqual(get_direct_room(self.user2.id, self.user1.id), rooms[0])
+
+
+@patch("apps.collaboration.message_ids.SETTLE_LAG", 0)
+class ChatRoomListTestCase(TestCase):
+    """Test cases for listing chat rooms"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="lister@example.com", password="x", first_name="Lister"
+        )
+        self.other = User.objects.create_user(
+            email="other@example.com", password="x", first_name="Other"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def create_rooms(self, count):
+        for i in range(count):
+            room = ChatRoom.objects.create(
+                name=f"Room {i}", room_type="team", created_by=self.user
+            )
+            room.members.add(self.user, self.other)
+            for j in range(3):
+                Message.objects.create(
+                    room=room, sender=self.other, content=f"Message {j}"
+                )
+
+    def test_room_list_query_count_is_fixed(self):
+        """Test listing rooms does not query per room"""
+        self.create_rooms(5)
+
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/collaboration/chat-rooms/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 5)
+        for room in response.data:
+            self.assertEqual(room["unread_count"], 3)
+            self.assertEqual(room["last_message"]["content"], "Message 2")
+            self.assertFalse(room["last_message"]["is_read"])
+            self.assertEqual(
+                {member["name"] for member in room["member_details"]},
+                {"Lister", "Other"},
+            )
+
+    def test_last_message_read_state_is_per_member(self):
+        """Test the last message is read or not from the viewer's position"""
+        self.create_rooms(1)
+        room = ChatRoom.objects.get()
+        mark_room_read(room.id, self.user.id)
+
+        response = self.client.get("/api/collaboration/chat-rooms/")
+        self.assertTrue(response.data[0]["last_message"]["is_read"])
+
+        # The other member's own message, which the viewer has read
+        self.client.force_authenticate(user=self.other)
+        response = self.client.get("/api/collaboration/chat-rooms/")
+        self.assertTrue(response.data[0]["last_message"]["is_read"])
+
+        response = self.client.post(
+            "/api/collaboration/send-message/",
+            {"room_id": room.id, "content": "Unread reply"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(response.data["is_read"])
+
+
+@patch("apps.collaboration.message_ids.SETTLE_LAG", 0)
+class RoomHistoryTestCase(TestCase):
+    """Test cases for paginated room history"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="history@example.com", password="x")
+        self.other = User.objects.create_user(
+            email="poster@example.com", password="x", first_name="Poster"
+        )
+        self.room = ChatRoom.objects.create(room_type="team", created_by=self.user)
+        self.room.members.add(self.user, self.other)
+        self.messages = [
+            Message.objects.create(
+                room=self.room, sender=self.other, content=f"Message {i}"
+            )
+            for i in range(5)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.url = f"/api/collaboration/room-messages/{self.room.id}/"
+
+    def test_history_is_paged_backwards_with_a_cursor(self):
+        """Test the latest page comes first and the cursor walks back"""
+        response = self.client.get(self.url, {"limit": 2})
+        self.assertEqual(
+            [m["content"] for m in response.data["results"]],
+            ["Message 3", "Message 4"],
+        )
+        self.assertEqual(response.data["results"][0]["sender_name"], "Poster")
+
+        contents = []
+        cursor = response.data["next_cursor"]
+        while cursor:
+            response = self.client.get(self.url, {"limit": 2, "cursor": cursor})
+            contents = [m["content"] for m in response.data["results"]] + contents
+            cursor = response.data["next_cursor"]
+        self.assertEqual(contents, ["Message 0", "Message 1", "Message 2"])
+
+    def test_opening_a_room_marks_messages_read(self):
+        """Test the first page moves the reader's position to the newest message"""
+        self.assertEqual(count_unread(self.room.id, self.user.id), 5)
+
+        response = self.client.get(self.url, {"limit": 2})
+
+        self.assertEqual(count_unread(self.room.id, self.user.id), 0)
+        self.assertEqual(count_unread(self.room.id, self.other.id), 0)
+        self.assertTrue(all(m["is_read"] for m in response.data["results"]))
+
+    def test_read_position_is_per_member(self):
+        """Test read receipts are tracked per member and never move back"""
+        mark_room_read(self.room.id, self.user.id, self.messages[1].id)
+        with self.assertNumQueries(1):
+            mark_room_read(self.room.id, self.user.id, self.messages[3].id)
+        mark_room_read(self.room.id, self.user.id, self.messages[2].id)
+
+        self.assertEqual(count_unread(self.room.id, self.user.id), 1)
+        self.assertEqual(
+            get_read_positions(self.room.id, self.other.id),
+            (0, self.messages[3].id),
+        )
+
+    def test_messages_since(self):
+        """Test the delta endpoint returns the messages after an id"""
+        response = self.client.get(
+            f"{self.url}since/", {"after_id": self.messages[2].id, "limit": 1}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [m["id"] for m in response.data["results"]], [self.messages[3].id]
+        )
+        self.assertTrue(response.data["has_more"])
+
+    def test_unsettled_messages_are_held_back(self):
+        """Test deltas stop before messages that may still be saved below them"""
+        with patch("apps.collaboration.message_ids.SETTLE_LAG", 5):
+            messages, has_more = get_messages_since(self.room, 0)
+
+        self.assertEqual(messages, [])
+        self.assertFalse(has_more)
+
+    def test_message_saved_late_is_unread(self):
+        """Test a message saved below the read position after reading is unread"""
+        with patch("apps.collaboration.message_ids.SETTLE_LAG", 5):
+            mark_room_read(self.room.id, self.user.id)
+            self.assertEqual(count_unread(self.room.id, self.user.id), 0)
+
+            Message.objects.create(
+                id=self.messages[0].id - 1,
+                room=self.room,
+                sender=self.other,
+                content="Saved late",
+            )
+
+            self.assertEqual(count_unread(self.room.id, self.user.id), 1)
+            response = self.client.get("/api/collaboration/chat-rooms/")
+            self.assertEqual(response.data[0]["unread_count"], 1)
+
+    def test_invalid_cursor(self):
+        """Test a malformed cursor is rejected"""
+        response = self.client.get(self.url, {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MessageBufferTestCase(TestCase):
+    """Test cases for write-behind chat message persistence"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email="buffer@example.com", password="x")
+        self.room = ChatRoom.objects.create(room_type="team", created_by=self.user)
+        self.room.members.add(self.user)
+        self.buffer = MessageBuffer()
+
+    def test_messages_are_written_on_flush(self):
+        """Test buffered messages have ids at once and are written in one batch"""
+
+        async def send():
+            first = await self.buffer.add(self.room.id, self.user.id, "First")
+            second = await self.buffer.add(self.room.id, self.user.id, "Second")
+            return first, second
+
+        first, second = async_to_sync(send)()
+        self.assertFalse(self.room.messages.exists())
+
+        async_to_sync(self.buffer.flush)()
+
+        self.assertLess(first.id, second.id)
+        self.assertEqual(
+            list(self.room.messages.values_list("id", "content")),
+            [(first.id, "First"), (second.id, "Second")],
+        )
+        self.assertEqual(self.buffer.pending_count(), 0)
+
+    @patch("apps.collaboration.message_buffer.FLUSH_BATCH_SIZE", 2)
+    def test_full_room_is_flushed_immediately(self):
+        """Test reaching the batch size writes without waiting for the timer"""
+
+        async def send():
+            for i in range(2):
+                await self.buffer.add(self.room.id, self.user.id, f"Message {i}")
+
+        async_to_sync(send)()
+
+        self.assertEqual(self.room.messages.count(), 2)
+
+    def test_duplicate_message_id_is_reported(self):
+        """Test a message with a taken id is logged and the others are saved"""
+        taken = Message.objects.create(room=self.room, sender=self.user, content="Old")
+
+        async def send():
+            first = await self.buffer.add(self.room.id, self.user.id, "First")
+            second = await self.buffer.add(self.room.id, self.user.id, "Second")
+            return first, second
+
+        first, second = async_to_sync(send)()
+        first.id = taken.id
+
+        with self.assertLogs("apps.collaboration.message_buffer", "ERROR") as logs:
+            async_to_sync(self.buffer.flush)()
+
+        self.assertIn(str(taken.id), logs.output[0])
+        self.assertEqual(
+            list(self.room.messages.values_list("content", flat=True)),
+            ["Old", "Second"],
+        )
+
+    def test_failed_writes_are_retried_with_backoff(self):
+        """Test messages stay pending while the database is down, however long"""
+
+        async def send():
+            return await self.buffer.add(self.room.id, self.user.id, "Kept")
+
+        message = async_to_sync(send)()
+        now = time.monotonic()
+        with patch.object(
+            Message.objects, "bulk_create", side_effect=OperationalError("down")
+        ):
+            for attempt in range(10):
+                with patch(
+                    "apps.collaboration.message_buffer.time.monotonic",
+                    return_value=now + 60 * attempt,
+                ):
+                    self.buffer.flush_sync()
+        self.assertEqual(self.buffer.pending_count(), 1)
+        self.assertEqual(self.buffer._attempts[self.room.id], 10)
+
+        # Still backing off
+        with patch(
+            "apps.collaboration.message_buffer.time.monotonic", return_value=now + 540
+        ):
+            self.buffer.flush_sync()
+        self.assertFalse(self.room.messages.exists())
+
+        self.buffer.flush_sync(force=True)
+        self.assertEqual(list(self.room.messages.all()), [message])
+        self.assertEqual(self.buffer.pending_count(), 0)
+
+    def test_worker_numbers_are_leased(self):
+        """Test two processes never share a worker number"""
+        fresh = {"_worker": None, "_token": None, "_pid": None, "_renewed_at": 0.0}
+        with patch.multiple(message_ids, **fresh):
+            worker = message_ids._get_worker()
+            message_ids._renewed_at = 0.0
+            self.assertEqual(message_ids._get_worker(), worker)
+
+            with patch.multiple(message_ids, **fresh):
+                self.assertNotEqual(message_ids._get_worker(), worker)
+                message_ids.release_worker()
+            message_ids.release_worker()
+
+    def test_message_ids_increase(self):
+        """Test application-assigned ids are unique and increasing"""
+        ids = [new_message_id() for _ in range(1000)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertLess(ids[-1], 2**53)
+
+
+class MembershipCacheTestCase(TestCase):
+    """Test cases for the chat room membership cache"""
+
+    def setUp(self):
+        self.member = User.objects.create_user(email="member@example.com", password="x")
+        self.other = User.objects.create_user(email="other@example.com", password="x")
+        self.room = ChatRoom.objects.create(room_type="team", created_by=self.member)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.room.members.add(self.member)
+        membership.invalidate_rooms([self.room.id])
+
+    def tearDown(self):
+        membership.invalidate_rooms([self.room.id])
+
+    def test_checks_after_the_first_are_served_from_the_cache(self):
+        """Test a room's members are loaded once and then checked without queries"""
+        self.assertTrue(membership.is_room_member(self.room.id, self.member.id))
+
+        with self.assertNumQueries(0):
+            self.assertTrue(membership.is_room_member(self.room.id, self.member.id))
+            self.assertFalse(membership.is_room_member(self.room.id, self.other.id))
+            self.assertTrue(
+                async_to_sync(membership.ais_room_member)(self.room.id, self.member.id)
+            )
+
+    def test_member_changes_update_the_cache(self):
+        """Test adding and removing members is reflected once committed"""
+        membership.is_room_member(self.room.id, self.member.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.room.members.add(self.other)
+        with self.assertNumQueries(0):
+            self.assertTrue(membership.is_room_member(self.room.id, self.other.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.chat_rooms.remove(self.room)
+        with self.assertNumQueries(0):
+            self.assertFalse(membership.is_room_member(self.room.id, self.other.id))
+
+    def test_removal_during_a_load_is_not_cached_back(self):
+        """Test a member removed while the set is loaded isn't re-admitted"""
+        query_members = membership._query_members
+
+        def query_then_remove(room_id):
+            member_ids = query_members(room_id)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.member.chat_rooms.remove(self.room)
+            return member_ids
+
+        with patch.object(membership, "_query_members", query_then_remove):
+            membership.is_room_member(self.room.id, self.member.id)
+
+        self.assertFalse(membership.is_room_member(self.room.id, self.member.id))
+
+    def test_inactive_room_admits_nobody(self):
+        """Test deactivating a room drops its cached members"""
+        membership.is_room_member(self.room.id, self.member.id)
+
+        self.room.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.room.save()
+
+        self.assertFalse(membership.is_room_member(self.room.id, self.member.id))
+
+
+class PresenceTestCase(TestCase):
+    """Test cases for Redis-backed user presence"""
+
+    def setUp(self):
+        self.alice = User.objects.create_user(email="alice@example.com", password="x")
+        self.bob = User.objects.create_user(email="bob@example.com", password="x")
+        self.room = ChatRoom.objects.create(room_type="team", created_by=self.alice)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.room.members.add(self.alice, self.bob)
+        self.clear_presence()
+
+    def tearDown(self):
+        self.clear_presence()
+        membership.invalidate_rooms([self.room.id])
+
+    def clear_presence(self):
+        redis_conn = get_redis()
+        keys = redis_conn.keys("presence:*")
+        if keys:
+            redis_conn.delete(*keys)
+
+    def collect(self):
+        get_redis().delete(presence._BROADCAST_LOCK_KEY)
+        return presence.collect_presence_changes()
+
+    def test_user_is_online_until_their_last_connection_leaves(self):
+        """Test presence follows the user's connections"""
+        presence.heartbeat(self.alice.id, "channel-1")
+        presence.heartbeat(self.alice.id, "channel-2")
+        self.assertEqual(
+            presence.get_online_users([self.alice.id, self.bob.id]), {self.alice.id}
+        )
+
+        presence.leave(self.alice.id, "channel-1")
+        self.assertEqual(presence.get_online_users(), {self.alice.id})
+
+        presence.leave(self.alice.id, "channel-2")
+        self.assertEqual(presence.get_online_users(), set())
+
+    def test_changes_are_coalesced_into_one_diff(self):
+        """Test joins and leaves between broadcasts are sent once, as a diff"""
+        presence.heartbeat(self.alice.id, "channel-1")
+        presence.heartbeat(self.bob.id, "channel-2")
+        presence.heartbeat(self.alice.id, "channel-1")
+        presence.leave(self.bob.id, "channel-2")
+
+        self.assertEqual(
+            self.collect(), {"online": [self.alice.id], "offline": [self.bob.id]}
+        )
+        self.assertIsNone(self.collect())
+
+        # Another worker broadcast within the interval
+        presence.heartbeat(self.bob.id, "channel-2")
+        self.assertIsNone(presence.collect_presence_changes())
+
+    def test_connections_without_heartbeat_expire(self):
+        """Test a user whose heartbeats stop is reported offline"""
+        presence.heartbeat(self.alice.id, "channel-1")
+        self.collect()
+
+        later = time.time() + presence.PRESENCE_TIMEOUT + 1
+        with patch("apps.collaboration.presence.time.time", return_value=later):
+            self.assertEqual(presence.get_online_users([self.alice.id]), set())
+            self.assertEqual(self.collect(), {"online": [], "offline": [self.alice.id]})
+
+    def test_room_presence(self):
+        """Test room presence lists every member without querying the database"""
+        presence.heartbeat(self.bob.id, "channel-1")
+        client = APIClient()
+        client.force_authenticate(user=self.alice)
+        url = f"/api/collaboration/room-presence/{self.room.id}/"
+        client.get(url)
+
+        with self.assertNumQueries(0):
+            response = client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data,
+            [
+                {"user_id": self.alice.id, "online": False},
+                {"user_id": self.bob.id, "online": True},
+            ],
+        )
+
+    def test_open_connections_are_kept_alive_by_the_worker(self):
+        """Test a connection stays online without client heartbeats"""
+        presence.heartbeat(self.alice.id, "channel-1")
+        broadcaster = presence.PresenceBroadcaster()
+        broadcaster._connections = {"channel-1": self.alice.id}
+
+        now = time.time()
+        with patch(
+            "apps.collaboration.presence.time.time",
+            return_value=now + presence.PRESENCE_TIMEOUT - 1,
+        ):
+            async_to_sync(broadcaster.refresh)()
+        with patch(
+            "apps.collaboration.presence.time.time",
+            return_value=now + presence.PRESENCE_TIMEOUT + 1,
+        ):
+            self.assertEqual(presence.get_online_users(), {self.alice.id})
+
+    def test_diff_is_relayed_as_user_joined_and_left(self):
+        """Test clients get the user-joined and user-left messages with profiles"""
+        self.alice.first_name = "Alice"
+        self.alice.save()
+        presence.heartbeat(self.alice.id, "channel-1")
+        presence.heartbeat(self.bob.id, "channel-2")
+        presence.leave(self.bob.id, "channel-2")
+        layer = InMemoryChannelLayer()
+        consumer = UserActivityConsumer()
+        # A third user's connection
+        consumer.user_id = 0
+        consumer.send = AsyncMock()
+
+        async def broadcast():
+            channel = await layer.new_channel()
+            await layer.group_add(presence.PRESENCE_GROUP, channel)
+            get_redis().delete(presence._BROADCAST_LOCK_KEY)
+            with patch.object(presence, "get_channel_layer", return_value=layer):
+                await presence.PresenceBroadcaster().broadcast()
+            await consumer.presence_diff(await layer.receive(channel))
+
+        async_to_sync(broadcast)()
+
+        self.assertEqual(
+            [
+                json.loads(call.kwargs["text_data"])
+                for call in consumer.send.call_args_list
+            ],
+            [
+                {
+                    "type": "user-joined",
+                    "user": {
+                        "id": self.alice.id,
+                        "name": "Alice",
+                        "email": "alice@example.com",
+                        "profilePicture": "",
+                    },
+                },
+                {"type": "user-left", "userId": self.bob.id},
+            ],
+        )
+
+
+class EphemeralSignalTestCase(TestCase):
+    """Test cases for typing, viewing and read position signals"""
+
+    def setUp(self):
+        self.layer = InMemoryChannelLayer()
+
+    def relay(self, send):
+        """Run ``send(buffer)`` and return the events the room received"""
+
+        async def run():
+            channel = await self.layer.new_channel()
+            await self.layer.group_add("chat_7", channel)
+            buffer = SignalBuffer(self.layer, "sender-channel", 3)
+            await send(buffer)
+            events = []
+            while True:
+                try:
+                    events.append(
+                        await asyncio.wait_for(self.layer.receive(channel), 0.05)
+                    )
+                except asyncio.TimeoutError:
+                    return events
+
+        with self.assertNumQueries(0):
+            return async_to_sync(run)()
+
+    def test_signals_are_coalesced(self):
+        """Test a burst of signals reaches the room as one event"""
+
+        async def send(buffer):
+            for message_id in (10, 12, 11):
+                buffer.add(7, "read_position", message_id)
+            buffer.add("7", "typing", True)
+            buffer.add(7, "typing", False)
+            await buffer.flush()
+
+        events = self.relay(send)
+
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]["type"], "chat_signals")
+        self.assertEqual(events[0]["user_id"], 3)
+        self.assertEqual(events[0]["signals"], {"read_position": 12, "typing": False})
+
+    @patch("apps.collaboration.ephemeral.SIGNAL_BURST", 3)
+    @patch("apps.collaboration.ephemeral.SIGNAL_RATE", 0)
+    def test_signals_over_the_rate_are_dropped(self):
+        """Test a connection can't send more signals than its rate allows"""
+        accepted = []
+
+        async def send(buffer):
+            for _ in range(5):
+                accepted.append(buffer.add(7, "viewing", True))
+            await buffer.flush()
+
+        self.relay(send)
+
+        self.assertEqual(accepted, [True, True, True, False, False])
+
+    def test_leaving_ends_typing_and_viewing(self):
+        """Test closing a connection tells the room it stopped typing"""
+
+        async def send(buffer):
+            buffer.add(7, "typing", True)
+            buffer.add(7, "viewing", True)
+            await buffer.flush()
+            await buffer.close(7)
+
+        events = self.relay(send)
+
+        self.assertEqual(
+            [event["signals"] for event in events],
+            [{"typing": True, "viewing": True}, {"typing": False, "viewing": False}],
+        )
+
+    def test_malformed_signals_are_rejected(self):
+        """Test only known signals with a valid value are accepted"""
+        self.assertEqual(
+            parse_signal({"kind": "typing", "active": True}), ("typing", True)
+        )
+        self.assertEqual(
+            parse_signal({"kind": "read_position", "message_id": 5}),
+            ("read_position", 5),
+        )
+        self.assertIsNone(parse_signal({"kind": "typing", "active": "yes"}))
+        self.assertIsNone(parse_signal({"kind": "read_position", "message_id": True}))
+        self.assertIsNone(parse_signal({"kind": "shout"}))
@@ -3,8 +3,12 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     ChatRoomViewSet,
     GetDirectMessageView,
+    GetRoomMessagesSinceView,
     GetRoomMessagesView,
+    MarkRoomReadView,
     MessageViewSet,
+    PresenceView,
+    RoomPresenceView,
     SendMessageView,
 )
 
@@ -20,5 +24,21 @@ urlpatterns = [
         GetRoomMessagesView.as_view(),
         name="room-messages",
     ),
+    path(
+        "room-messages/<int:room_id>/since/",
+        GetRoomMessagesSinceView.as_view(),
+        name="room-messages-since",
+    ),
+    path(
+        "room-messages/<int:room_id>/read/",
+        MarkRoomReadView.as_view(),
+        name="room-messages-read",
+    ),
+    path(
+        "room-presence/<int:room_id>/",
+        RoomPresenceView.as_view(),
+        name="room-presence",
+    ),
+    path("presence/", PresenceView.as_view(), name="presence"),
     path("direct-message/", GetDirectMessageView.as_view(), name="direct-message"),
 ]
@@ -2,11 +2,42 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Count
+from .membership import is_room_member
 from .models import ChatRoom, Message
+from .presence import get_online_users, get_room_presence
+from .services import (
+    MESSAGE_MAX_PAGE_SIZE,
+    MESSAGE_PAGE_SIZE,
+    get_direct_room,
+    get_history_page,
+    get_messages_since,
+    get_read_positions,
+    mark_room_read,
+    provision_direct_rooms,
+    resolve_senders,
+    with_room_summaries,
+)
 from .serializers import ChatRoomSerializer, MessageSerializer, ChatRoomCreateSerializer
 from rest_framework.views import APIView
 
+# Users a single presence query may ask about
+PRESENCE_MAX_USERS = 500
+
+
+def parse_message_limit(request):
+    """The page size asked for, capped. Raises ``ValueError`` if malformed"""
+    limit = int(request.query_params.get("limit", MESSAGE_PAGE_SIZE))
+    return max(1, min(limit, MESSAGE_MAX_PAGE_SIZE))
+
+
+def message_context(request, room, messages):
+    """Serializer context resolving senders and read state for a page"""
+    return {
+        "request": request,
+        "senders": resolve_senders(messages),
+        "read_positions": get_read_positions(room.id, request.user.id),
+    }
+
 
 class ChatRoomViewSet(viewsets.ModelViewSet):
     queryset = ChatRoom.objects.all()
@@ -14,9 +45,10 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return ChatRoom.objects.filter(
-            members=self.request.user, is_active=True
-        ).prefetch_related("members", "messages")
+        return with_room_summaries(
+            ChatRoom.objects.filter(members=self.request.user, is_active=True),
+            self.request.user,
+        )
 
     def get_serializer_class(self):
         if self.action == "create":
@@ -33,26 +65,33 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        # For direct messages, check if a room already exists between the two users
+        # Direct rooms are unique per pair: reuse the existing room, or
+        # create it keyed so that concurrent requests can't duplicate it
         if serializer.validated_data.get("room_type") == "direct":
             members = serializer.validated_data.get("members", [])
             if len(members) == 1:  # Should be one other user
                 other_user = members[0]
-                # Check for existing direct room between current user and other_user
-                existing_room = (
-                    ChatRoom.objects.filter(
-                        room_type="direct", members=request.user, is_active=True
+                created = provision_direct_rooms(request.user, [other_user.id])
+                room = get_direct_room(request.user.id, other_user.id)
+
+                if room:
+                    updated_fields = []
+                    if not room.is_active:
+                        room.is_active = True
+                        updated_fields.append("is_active")
+                    if created and serializer.validated_data.get("name"):
+                        room.name = serializer.validated_data["name"]
+                        updated_fields.append("name")
+                    if updated_fields:
+                        room.save(update_fields=updated_fields)
+
+                    serializer = self.get_serializer(room)
+                    return Response(
+                        serializer.data,
+                        status=(
+                            status.HTTP_201_CREATED if created else status.HTTP_200_OK
+                        ),
                     )
-                    .filter(members=other_user)
-                    .annotate(member_count=Count("members"))
-                    .filter(member_count=2)
-                    .first()
-                )
-
-                if existing_room:
-                    # Return the existing room instead of creating a new one
-                    serializer = self.get_serializer(existing_room)
-                    return Response(serializer.data, status=status.HTTP_200_OK)
 
         # Proceed with normal creation
         return super().create(request, *args, **kwargs)
@@ -105,7 +144,7 @@ class SendMessageView(APIView):
             room=room, sender=request.user, content=content
         )
 
-        serializer = MessageSerializer(message)
+        serializer = MessageSerializer(message, context={"request": request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
@@ -123,13 +162,130 @@ class GetRoomMessagesView(APIView):
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        messages = room.messages.all().order_by("created_at")
+        try:
+            limit = parse_message_limit(request)
+            messages, next_cursor = get_history_page(
+                room, request.query_params.get("cursor"), limit
+            )
+        except ValueError:
+            return Response(
+                {"error": "Invalid cursor or limit"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # Opening the room reads it up to the newest message returned
+        if not request.query_params.get("cursor") and messages:
+            mark_room_read(room.id, request.user.id, messages[-1].id)
+
+        serializer = MessageSerializer(
+            messages, many=True, context=message_context(request, room, messages)
+        )
+        return Response({"results": serializer.data, "next_cursor": next_cursor})
+
+
+class GetRoomMessagesSinceView(APIView):
+    """Messages posted after ``after_id``, for clients catching up"""
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, room_id):
+        try:
+            room = ChatRoom.objects.get(
+                id=room_id, members=request.user, is_active=True
+            )
+        except ChatRoom.DoesNotExist:
+            return Response(
+                {"error": "Chat room not found or access denied"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        try:
+            after_id = int(request.query_params["after_id"])
+            limit = parse_message_limit(request)
+        except (KeyError, ValueError):
+            return Response(
+                {"error": "after_id and limit must be integers"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        messages, has_more = get_messages_since(room, after_id, limit)
+        serializer = MessageSerializer(
+            messages, many=True, context=message_context(request, room, messages)
+        )
+        return Response({"results": serializer.data, "has_more": has_more})
 
-        # Mark messages as read for current user
-        messages.filter(is_read=False).exclude(sender=request.user).update(is_read=True)
 
-        serializer = MessageSerializer(messages, many=True)
-        return Response(serializer.data)
+class MarkRoomReadView(APIView):
+    """Move the user's read position up to ``message_id``, or the latest"""
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, room_id):
+        if not ChatRoom.objects.filter(
+            id=room_id, members=request.user, is_active=True
+        ).exists():
+            return Response(
+                {"error": "Chat room not found or access denied"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        message_id = request.data.get("message_id")
+        try:
+            message_id = int(message_id) if message_id is not None else None
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "message_id must be an integer"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        last_read = mark_room_read(room_id, request.user.id, message_id)
+        return Response({"last_read_message_id": last_read})
+
+
+class PresenceView(APIView):
+    """Which of ``user_ids`` (comma separated) are online"""
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            user_ids = [
+                int(user_id)
+                for user_id in request.query_params.get("user_ids", "").split(",")
+                if user_id
+            ]
+        except ValueError:
+            return Response(
+                {"error": "user_ids must be comma separated integers"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(user_ids) > PRESENCE_MAX_USERS:
+            return Response(
+                {"error": f"At most {PRESENCE_MAX_USERS} user_ids are allowed"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        return Response({"online": sorted(get_online_users(user_ids))})
+
+
+class RoomPresenceView(APIView):
+    """Online status of every member of a room"""
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, room_id):
+        if not is_room_member(room_id, request.user.id):
+            return Response(
+                {"error": "Chat room not found or access denied"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        return Response(
+            [
+                {"user_id": user_id, "online": online}
+                for user_id, online in get_room_presence(room_id).items()
+            ]
+        )
 
 
 class GetDirectMessageView(APIView):
@@ -145,15 +301,9 @@ class GetDirectMessageView(APIView):
 
         try:
             # Find existing direct message room between users
-            room = (
-                ChatRoom.objects.filter(
-                    room_type="direct", members=request.user, is_active=True
-                )
-                .filter(members=other_user_id)
-                .annotate(member_count=Count("members"))
-                .filter(member_count=2)
-                .first()
-            )
+            room = get_direct_room(request.user.id, other_user_id)
+            if room and not room.is_active:
+                room = None
 
             if room:
                 serializer = ChatRoomSerializer(room)
@@ -2,11 +2,11 @@ from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import reverse, path
 from django.utils import timezone
-from django.db.models import Count, Q, Avg, F
+from django.db.models import Count, Q, Avg, F, Sum
 from django.template.response import TemplateResponse
 from django.shortcuts import render
 from datetime import timedelta
-from .models import Post, Media
+from .models import DailyPageAnalytics, Post, Media
 
 
 class ContentAdminSite(admin.ModelAdmin):
@@ -119,6 +119,18 @@ class ContentAdminSite(admin.ModelAdmin):
             Q(scheduled_for__lt=now) & Q(status="scheduled")
         ).count()
 
+        # Engagement per platform, read from the daily rollups
+        platform_engagement = (
+            DailyPageAnalytics.objects.filter(date__gte=last_30_days.date())
+            .values("platform")
+            .annotate(
+                post_count=Sum("posts"),
+                engagement=Sum(F("likes") + F("comments") + F("shares")),
+                reach=Sum("reach"),
+            )
+            .order_by("-engagement")
+        )
+
         context = {
             "title": "Content Statistics Dashboard",
             "total_posts": total_posts,
@@ -137,6 +149,7 @@ class ContentAdminSite(admin.ModelAdmin):
             "recent_posts": recent_posts,
             "posts_needing_attention": posts_needing_attention,
             "overdue_posts": overdue_posts,
+            "platform_engagement": platform_engagement,
             "approved_posts": approved_posts,
             "validated_posts": validated_posts,
             "rejected_posts": rejected_posts,
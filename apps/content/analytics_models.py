@@ -1,4 +1,6 @@
 from django.db import models
+from apps.accounts.models import User
+from apps.social_media.models import SocialPage
 from .models import Post
 
 
@@ -80,3 +82,121 @@ class PostAnalytics(models.Model):
         """Auto-calculate engagement rate before saving"""
         self.calculate_engagement_rate()
         super().save(*args, **kwargs)
+
+
+class DailyPageAnalytics(models.Model):
+    """
+    Analytics of a page's published posts summed per day, so reports read
+    one row per day instead of every post. Kept up to date from the
+    ``Post``/``PostAnalytics`` signals by ``apps.content.rollups``.
+    """
+
+    client = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="daily_analytics"
+    )
+    page = models.ForeignKey(
+        SocialPage, on_delete=models.CASCADE, related_name="daily_analytics"
+    )
+    platform = models.CharField(max_length=20)
+    date = models.DateField(help_text="Day the posts were published on")
+
+    posts = models.IntegerField(default=0, help_text="Published posts")
+    analytics_posts = models.IntegerField(
+        default=0, help_text="Published posts with analytics"
+    )
+    likes = models.BigIntegerField(default=0)
+    comments = models.BigIntegerField(default=0)
+    shares = models.BigIntegerField(default=0)
+    reach = models.BigIntegerField(default=0)
+    impressions = models.BigIntegerField(default=0)
+    clicks = models.BigIntegerField(default=0)
+    # Averages over several days are weighted by analytics_posts
+    engagement_rate_sum = models.FloatField(default=0.0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Daily Page Analytics"
+        verbose_name_plural = "Daily Page Analytics"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["client", "page", "platform", "date"],
+                name="daily_page_analytics_unique",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["date", "platform"], name="daily_analytics_date_idx"),
+        ]
+
+    def __str__(self):
+        return f"Analytics for page {self.page_id} on {self.date}"
+
+
+class ReportBatch(models.Model):
+    """
+    Reports for many clients and periods, generated in the background by
+    ``apps.content.report_batches`` and kept for download.
+    """
+
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("running", "Running"),
+        ("completed", "Completed"),
+        ("failed", "Failed"),
+    ]
+
+    requested_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name="report_batches",
+    )
+    report_type = models.CharField(max_length=10, help_text="'week' or 'month'")
+    periods = models.JSONField(default=list, help_text="Periods to report on")
+    client_ids = models.JSONField(
+        default=list, blank=True, help_text="Clients to report on, all when empty"
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
+    total_clients = models.IntegerField(default=0)
+    processed_clients = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.report_type} reports for {', '.join(self.periods)}"
+
+    @property
+    def progress(self):
+        """Percentage of the clients processed so far"""
+        if self.status == "completed":
+            return 100
+        if not self.total_clients:
+            return 0
+        return int(self.processed_clients * 100 / self.total_clients)
+
+
+class ReportBatchChunk(models.Model):
+    """The reports of one chunk of a batch's clients, saved as it is done"""
+
+    batch = models.ForeignKey(
+        ReportBatch, on_delete=models.CASCADE, related_name="chunks"
+    )
+    index = models.IntegerField(help_text="Position of the chunk in the batch")
+    reports = models.JSONField(
+        default=list, help_text="One entry per client and period"
+    )
+
+    class Meta:
+        ordering = ["batch", "index"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["batch", "index"], name="report_batch_chunk_unique"
+            ),
+        ]
+
+    def __str__(self):
+        return f"Chunk {self.index} of report batch {self.batch_id}"
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from apps.content.rollups import rebuild_daily_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the daily analytics rollups read by reports from the "
+        "posts and their analytics, e.g. after a bulk analytics import that "
+        "bypassed the model signals."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rows = rebuild_daily_rollups(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} daily rollups"))
@@ -0,0 +1,132 @@
+# Generated by Django 4.2.25 on 2026-10-19 07:46
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce, TruncDate
+
+
+def build_daily_rollups(apps, schema_editor):
+    """Sum the analytics of the existing published posts per page and day"""
+    Post = apps.get_model("content", "Post")
+    DailyPageAnalytics = apps.get_model("content", "DailyPageAnalytics")
+
+    rows = (
+        Post.objects.filter(
+            status="published",
+            client__isnull=False,
+            platform_page__isnull=False,
+            published_at__isnull=False,
+        )
+        .annotate(day=TruncDate("published_at"))
+        .values("client_id", "platform_page_id", "platform_page__platform", "day")
+        .annotate(
+            post_count=Count("id"),
+            analytics_posts=Count("id", filter=Q(analytics__isnull=False)),
+            likes=Coalesce(Sum("analytics__likes"), 0),
+            comments=Coalesce(Sum("analytics__comments"), 0),
+            shares=Coalesce(Sum("analytics__shares"), 0),
+            reach=Coalesce(Sum("analytics__reach"), 0),
+            impressions=Coalesce(Sum("analytics__impressions"), 0),
+            clicks=Coalesce(Sum("analytics__clicks"), 0),
+            engagement_rate_sum=Coalesce(Sum("analytics__engagement_rate"), 0.0),
+        )
+        .order_by()
+    )
+    DailyPageAnalytics.objects.bulk_create(
+        (
+            DailyPageAnalytics(
+                client_id=row["client_id"],
+                page_id=row["platform_page_id"],
+                platform=row["platform_page__platform"],
+                date=row["day"],
+                posts=row["post_count"],
+                analytics_posts=row["analytics_posts"],
+                likes=row["likes"],
+                comments=row["comments"],
+                shares=row["shares"],
+                reach=row["reach"],
+                impressions=row["impressions"],
+                clicks=row["clicks"],
+                engagement_rate_sum=row["engagement_rate_sum"],
+            )
+            for row in rows
+        ),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("social_media", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("content", "0005_postanalytics"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyPageAnalytics",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("platform", models.CharField(max_length=20)),
+                ("date", models.DateField(help_text="Day the posts were published on")),
+                ("posts", models.IntegerField(default=0, help_text="Published posts")),
+                (
+                    "analytics_posts",
+                    models.IntegerField(
+                        default=0, help_text="Published posts with analytics"
+                    ),
+                ),
+                ("likes", models.BigIntegerField(default=0)),
+                ("comments", models.BigIntegerField(default=0)),
+                ("shares", models.BigIntegerField(default=0)),
+                ("reach", models.BigIntegerField(default=0)),
+                ("impressions", models.BigIntegerField(default=0)),
+                ("clicks", models.BigIntegerField(default=0)),
+                ("engagement_rate_sum", models.FloatField(default=0.0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "client",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_analytics",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "page",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_analytics",
+                        to="social_media.socialpage",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Daily Page Analytics",
+                "verbose_name_plural": "Daily Page Analytics",
+                "indexes": [
+                    models.Index(
+                        fields=["date", "platform"], name="daily_analytics_date_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="dailypageanalytics",
+            constraint=models.UniqueConstraint(
+                fields=("client", "page", "platform", "date"),
+                name="daily_page_analytics_unique",
+            ),
+        ),
+        migrations.RunPython(build_daily_rollups, migrations.RunPython.noop),
+    ]
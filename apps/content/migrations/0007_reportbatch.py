@@ -0,0 +1,116 @@
+# Generated by Django 4.2.25 on 2026-10-19 07:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("content", "0006_daily_page_analytics"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReportBatch",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "report_type",
+                    models.CharField(help_text="'week' or 'month'", max_length=10),
+                ),
+                (
+                    "periods",
+                    models.JSONField(default=list, help_text="Periods to report on"),
+                ),
+                (
+                    "client_ids",
+                    models.JSONField(
+                        blank=True,
+                        default=list,
+                        help_text="Clients to report on, all when empty",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("running", "Running"),
+                            ("completed", "Completed"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                    ),
+                ),
+                ("total_clients", models.IntegerField(default=0)),
+                ("processed_clients", models.IntegerField(default=0)),
+                ("error", models.TextField(blank=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("completed_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "requested_by",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="report_batches",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-created_at"],
+            },
+        ),
+        migrations.CreateModel(
+            name="ReportBatchChunk",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "index",
+                    models.IntegerField(help_text="Position of the chunk in the batch"),
+                ),
+                (
+                    "reports",
+                    models.JSONField(
+                        default=list, help_text="One entry per client and period"
+                    ),
+                ),
+                (
+                    "batch",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="chunks",
+                        to="content.reportbatch",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["batch", "index"],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="reportbatchchunk",
+            constraint=models.UniqueConstraint(
+                fields=("batch", "index"), name="report_batch_chunk_unique"
+            ),
+        ),
+    ]
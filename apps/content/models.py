@@ -122,16 +122,15 @@ class Post(models.Model):
         """
         Check if the given user is assigned to the post creator.
         """
-        if self.creator == user:
-            return True
-        if user in self.creator.assigned_communitymanagers.all():
-            return True
-        if user == self.creator.assigned_moderator:
-            return True
-        # Allow moderators to edit posts created by their assigned community managers
-        if user.is_moderator and self.creator in user.assigned_communitymanagers.all():
+        from apps.accounts.assignments import is_assigned_to_user
+
+        if self.creator_id is None:
+            return False
+        if self.creator_id == user.id:
             return True
-        return False
+        # CMs and moderator of the creator, and moderators of a creating CM,
+        # looked up in the assignment graph without loading the creator
+        return is_assigned_to_user(user, self.creator_id)
 
     def has_feedback(self):
         """
@@ -227,4 +226,9 @@ class Post(models.Model):
 
 
 # Import PostAnalytics to ensure Django recognizes the reverse relation
-from .analytics_models import PostAnalytics  # noqa: E402, F401
+from .analytics_models import (  # noqa: E402, F401
+    DailyPageAnalytics,
+    PostAnalytics,
+    ReportBatch,
+    ReportBatchChunk,
+)
@@ -0,0 +1,248 @@
+"""
+Batch generation of reports for many clients, pages and periods.
+
+Clients are processed in chunks of ``BATCH_CHUNK_SIZE``. Each chunk is one
+pass over the data: one query for the clients' pages, one over their daily
+rollups for every period, and one ranking the top posts per page and
+period. Every report of the chunk is then assembled in memory, along with
+a breakdown of each client's engagement across their platforms. The
+reports of a chunk are saved as a ``ReportBatchChunk`` and progress on the
+``ReportBatch``, so neither the task nor the download holds every report at
+once.
+
+Batches of moderators only cover the clients assigned to them, see
+``apps.accounts.assignments.get_assigned_owners``.
+"""
+
+import logging
+from collections import defaultdict
+
+from django.db.models import Case, CharField, F, Q, Value, When
+from django.utils import timezone
+
+from apps.accounts.assignments import get_assigned_owners
+from apps.accounts.models import User
+from apps.social_media.models import SocialPage
+
+from .models import DailyPageAnalytics, Post, ReportBatch, ReportBatchChunk
+from .reports_service import ReportGenerationService
+
+logger = logging.getLogger(__name__)
+
+# Clients whose reports are computed in one pass
+BATCH_CHUNK_SIZE = 50
+
+_ROLLUP_VALUES = [
+    "page_id",
+    "date",
+    "posts",
+    "analytics_posts",
+    "likes",
+    "comments",
+    "shares",
+    "reach",
+    "engagement_rate_sum",
+]
+
+
+def get_period_ranges(report_type, periods):
+    """
+    ``(period, start_datetime, end_datetime)`` of each period, in order.
+
+    Raises:
+        ValueError: If a period is invalid or periods overlap
+    """
+    ranges = sorted(
+        (
+            (period, *ReportGenerationService.get_period_range(report_type, period))
+            for period in periods
+        ),
+        key=lambda period_range: period_range[1],
+    )
+    if not ranges:
+        raise ValueError("At least one period is required")
+    for previous, current in zip(ranges, ranges[1:]):
+        if current[1] <= previous[2]:
+            raise ValueError(f"Periods {previous[0]} and {current[0]} overlap")
+    return ranges
+
+
+def _period_of(day, period_ranges):
+    for period, start_datetime, end_datetime in period_ranges:
+        if start_datetime.date() <= day <= end_datetime.date():
+            return period
+    return None
+
+
+def _platform_breakdown(pages, reports):
+    """Posts and engagement of a client's pages summed per platform"""
+    platforms = {}
+    for page in pages:
+        report = reports[page.id]
+        totals = platforms.setdefault(
+            page.platform,
+            {"platform": page.platform.capitalize(), "posts": 0, "engagement": 0},
+        )
+        totals["posts"] += report["totalPosts"]
+        totals["engagement"] += report["totalEngagement"]
+    return sorted(platforms.values(), key=lambda totals: -totals["engagement"])
+
+
+def generate_client_reports(client_ids, report_type, period_ranges):
+    """
+    Reports of every page of the clients, for every period, in one pass.
+
+    Returns:
+        List of ``{"clientId", "period", "platformBreakdown", "pages"}``, one
+        per client and period
+    """
+    pages = list(
+        SocialPage.objects.filter(client_id__in=client_ids).order_by("client_id", "id")
+    )
+    if not pages:
+        return []
+    page_ids = [page.id for page in pages]
+    first_day = period_ranges[0][1]
+    last_day = period_ranges[-1][2]
+
+    # Daily totals per (page, period)
+    daily_totals = defaultdict(list)
+    rollups = (
+        DailyPageAnalytics.objects.filter(
+            page_id__in=page_ids,
+            client_id=F("page__client_id"),
+            date__gte=first_day.date(),
+            date__lte=last_day.date(),
+        )
+        .values(*_ROLLUP_VALUES)
+        .order_by("date")
+    )
+    for row in rollups:
+        period = _period_of(row["date"], period_ranges)
+        if period is not None:
+            daily_totals[(row.pop("page_id"), period)].append(row)
+
+    # Top posts per (page, period), ranked by the database
+    in_period = Q()
+    whens = []
+    for period, start_datetime, end_datetime in period_ranges:
+        in_period |= Q(published_at__gte=start_datetime, published_at__lte=end_datetime)
+        whens.append(
+            When(
+                published_at__gte=start_datetime,
+                published_at__lte=end_datetime,
+                then=Value(period),
+            )
+        )
+    posts = Post.objects.filter(
+        in_period,
+        status="published",
+        platform_page_id__in=page_ids,
+        client_id=F("platform_page__client_id"),
+    ).annotate(period=Case(*whens, output_field=CharField()))
+    top_posts = defaultdict(list)
+    for post in ReportGenerationService.rank_top_posts(
+        posts, [F("platform_page"), F("period")]
+    ):
+        top_posts[(post.platform_page_id, post.period)].append(
+            ReportGenerationService.serialize_top_post(post)
+        )
+
+    client_pages = defaultdict(list)
+    for page in pages:
+        client_pages[page.client_id].append(page)
+
+    results = []
+    for client_id in client_ids:
+        for period, start_datetime, end_datetime in period_ranges:
+            reports = {
+                page.id: ReportGenerationService.build_report(
+                    page,
+                    report_type,
+                    start_datetime,
+                    end_datetime,
+                    daily_totals[(page.id, period)],
+                    top_posts[(page.id, period)],
+                )
+                for page in client_pages[client_id]
+            }
+            if not reports:
+                continue
+            results.append(
+                {
+                    "clientId": client_id,
+                    "period": period,
+                    "platformBreakdown": _platform_breakdown(
+                        client_pages[client_id], reports
+                    ),
+                    "pages": [
+                        {
+                            "pageId": page.id,
+                            "pageName": page.page_name,
+                            "platform": page.platform,
+                            "report": reports[page.id],
+                        }
+                        for page in client_pages[client_id]
+                    ],
+                }
+            )
+    return results
+
+
+def _get_client_ids(batch):
+    """Ids of the clients a batch reports on, limited to the requester's"""
+    clients = User.objects.filter(is_client=True)
+    if batch.client_ids:
+        clients = clients.filter(id__in=batch.client_ids)
+    client_ids = list(clients.order_by("id").values_list("id", flat=True))
+
+    requester = batch.requested_by
+    if requester is not None and requester.is_administrator:
+        return client_ids
+    assigned = get_assigned_owners(requester, client_ids) if requester else set()
+    return [client_id for client_id in client_ids if client_id in assigned]
+
+
+def run_report_batch(batch_id):
+    """Generate the reports of a batch, saving them as clients are done"""
+    batch = ReportBatch.objects.select_related("requested_by").get(id=batch_id)
+    batch.status = "running"
+    batch.processed_clients = 0
+    batch.save(update_fields=["status", "processed_clients"])
+    # Chunks of an earlier run
+    batch.chunks.all().delete()
+
+    try:
+        period_ranges = get_period_ranges(batch.report_type, batch.periods)
+
+        client_ids = _get_client_ids(batch)
+        batch.total_clients = len(client_ids)
+        batch.save(update_fields=["total_clients"])
+
+        for index, start in enumerate(range(0, len(client_ids), BATCH_CHUNK_SIZE)):
+            chunk = client_ids[start : start + BATCH_CHUNK_SIZE]
+            ReportBatchChunk.objects.create(
+                batch=batch,
+                index=index,
+                reports=generate_client_reports(
+                    chunk, batch.report_type, period_ranges
+                ),
+            )
+            batch.processed_clients += len(chunk)
+            batch.save(update_fields=["processed_clients"])
+    except Exception as e:
+        logger.error(f"Error generating report batch {batch.id}: {e}")
+        batch.status = "failed"
+        batch.error = str(e)
+    else:
+        batch.status = "completed"
+    batch.completed_at = timezone.now()
+    batch.save(update_fields=["status", "error", "completed_at"])
+    return batch
+
+
+def iter_batch_reports(batch):
+    """The reports of a batch in order, loading one chunk at a time"""
+    chunks = batch.chunks.order_by("index").values_list("reports", flat=True)
+    for reports in chunks.iterator(chunk_size=1):
+        yield from reports
@@ -0,0 +1,177 @@
+"""
+Cache of generated reports.
+
+A report is stored under its (client, page, report_type, period) along
+with the data version it was computed from. The version combines a
+counter per page, bumped when the page changes, and a counter per day of
+the period, bumped by ``apps.content.rollups`` when that day's analytics
+are refreshed. Reading a report fetches the versions and the cached entry
+in one Redis round-trip, so past periods that aren't re-synced never reach
+the database. When the version moved on the cached report is still
+returned, and recomputed in the background (stale-while-revalidate).
+"""
+
+import json
+import logging
+from datetime import timedelta
+
+from planit.redis_client import get_redis
+
+from .reports_service import ReportGenerationService
+
+logger = logging.getLogger(__name__)
+
+# Seconds a report is kept, whether or not it is read
+REPORT_CACHE_TIMEOUT = 30 * 24 * 3600
+
+# Outlive the reports, so a version never restarts under a cached report
+_VERSION_TIMEOUT = 2 * REPORT_CACHE_TIMEOUT
+
+# Seconds a report being recomputed isn't queued again
+_REVALIDATE_TIMEOUT = 5 * 60
+
+_GENERATION_KEY = "report_cache:generation"
+
+
+def _report_key(client_id, page_id, report_type, period):
+    return f"report_cache:report:{client_id}:{page_id}:{report_type}:{period}"
+
+
+def _page_version_key(page_id):
+    return f"report_cache:version:{page_id}"
+
+
+def _day_version_key(page_id, day):
+    return f"report_cache:version:{page_id}:{day.isoformat()}"
+
+
+def _version_keys(page_id, report_type, period):
+    start_date, end_date = ReportGenerationService.get_period_dates(report_type, period)
+    days = (end_date - start_date).days + 1
+    return [_GENERATION_KEY, _page_version_key(page_id)] + [
+        _day_version_key(page_id, start_date + timedelta(days=offset))
+        for offset in range(days)
+    ]
+
+
+def _data_version(versions):
+    return ",".join((version or b"0").decode() for version in versions)
+
+
+def _read(client_id, page_id, report_type, period):
+    """The current data version and the cached entry, in one round-trip"""
+    redis_conn = get_redis()
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.mget(_version_keys(page_id, report_type, period))
+    pipe.get(_report_key(client_id, page_id, report_type, period))
+    versions, entry = pipe.execute()
+    return _data_version(versions), json.loads(entry) if entry else None
+
+
+def _store(client_id, page_id, report_type, period, version, report):
+    get_redis().set(
+        _report_key(client_id, page_id, report_type, period),
+        json.dumps({"version": version, "report": report}),
+        ex=REPORT_CACHE_TIMEOUT,
+    )
+
+
+def get_report(client_id, page_id, report_type, period):
+    """
+    The report for the period, from the cache when there is one.
+
+    Raises:
+        ValueError: If parameters are invalid
+    """
+    try:
+        version, entry = _read(client_id, page_id, report_type, period)
+    except ValueError:
+        raise
+    except Exception as e:
+        logger.warning(f"Error reading report cache: {e}")
+        return ReportGenerationService.generate_report(
+            client_id, page_id, report_type, period
+        )
+
+    if entry is not None:
+        if entry["version"] != version:
+            schedule_revalidation(client_id, page_id, report_type, period)
+        return entry["report"]
+
+    report = ReportGenerationService.generate_report(
+        client_id, page_id, report_type, period
+    )
+    try:
+        _store(client_id, page_id, report_type, period, version, report)
+    except Exception as e:
+        logger.warning(f"Error writing report cache: {e}")
+    return report
+
+
+def refresh_report(client_id, page_id, report_type, period):
+    """Recompute a cached report, dropping it if it is no longer valid"""
+    redis_conn = get_redis()
+    report_key = _report_key(client_id, page_id, report_type, period)
+    try:
+        # Read before computing, a change made meanwhile is picked up next time
+        version, _ = _read(client_id, page_id, report_type, period)
+        report = ReportGenerationService.generate_report(
+            client_id, page_id, report_type, period
+        )
+    except ValueError:
+        # The client or page is gone
+        redis_conn.delete(report_key)
+        return
+    finally:
+        redis_conn.delete(f"{report_key}:revalidating")
+    _store(client_id, page_id, report_type, period, version, report)
+
+
+def schedule_revalidation(client_id, page_id, report_type, period):
+    """Queue a stale report for recomputation, unless it already is"""
+    from .tasks import refresh_report_cache
+
+    lock_key = f"{_report_key(client_id, page_id, report_type, period)}:revalidating"
+    try:
+        redis_conn = get_redis()
+        if redis_conn.set(lock_key, 1, nx=True, ex=_REVALIDATE_TIMEOUT):
+            refresh_report_cache.delay(client_id, page_id, report_type, period)
+    except Exception as e:
+        logger.warning(f"Error queueing report refresh: {e}")
+
+
+def bump_day_versions(keys):
+    """
+    Mark the reports covering the given ``(client_id, page_id, date)`` as
+    stale
+    """
+    keys = list(keys)
+    if not keys:
+        return
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for _, page_id, day in keys:
+            pipe.incr(_day_version_key(page_id, day))
+            pipe.expire(_day_version_key(page_id, day), _VERSION_TIMEOUT)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Error updating report cache versions: {e}")
+
+
+def bump_page_version(page_id):
+    """Mark every report of a page as stale"""
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.incr(_page_version_key(page_id))
+        pipe.expire(_page_version_key(page_id), _VERSION_TIMEOUT)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Error updating report cache versions: {e}")
+
+
+def invalidate_reports():
+    """Mark every cached report as stale"""
+    try:
+        get_redis().incr(_GENERATION_KEY)
+    except Exception as e:
+        logger.warning(f"Error invalidating report cache: {e}")
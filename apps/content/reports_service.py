@@ -3,13 +3,14 @@ Service module for generating social media reports.
 Handles all business logic for report generation, calculations, and data aggregation.
 """
 
-from django.db.models import Sum, Avg
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
 from django.utils import timezone
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from typing import Dict, List, Tuple
 
-from .models import Post
+from .models import DailyPageAnalytics, Post
 from apps.social_media.models import SocialPage
 from apps.accounts.models import User
 
@@ -17,6 +18,55 @@ from apps.accounts.models import User
 class ReportGenerationService:
     """Service class for generating social media performance reports."""
 
+    @staticmethod
+    def get_period_dates(report_type: str, period: str) -> Tuple[date, date]:
+        """
+        First and last day of a report period.
+
+        Raises:
+            ValueError: If report_type or period is invalid
+        """
+        try:
+            if report_type == "week":
+                # Period format: YYYY-MM-DD (start of week)
+                start_date = datetime.strptime(period, "%Y-%m-%d").date()
+                end_date = start_date + timedelta(days=6)
+            elif report_type == "month":
+                # Period format: YYYY-MM
+                start_date = datetime.strptime(period + "-01", "%Y-%m-%d").date()
+                # Get last day of month
+                next_month = start_date + relativedelta(months=1)
+                end_date = next_month - timedelta(days=1)
+            else:
+                raise ValueError(
+                    f"Invalid report_type: {report_type}. Must be 'week' or 'month'"
+                )
+        except ValueError as e:
+            raise ValueError(f"Invalid period format: {str(e)}")
+
+        return start_date, end_date
+
+    @classmethod
+    def get_period_range(
+        cls, report_type: str, period: str
+    ) -> Tuple[datetime, datetime]:
+        """
+        Start and end datetime of a report period, for queries.
+
+        Raises:
+            ValueError: If report_type or period is invalid
+        """
+        start_date, end_date = cls.get_period_dates(report_type, period)
+
+        # Convert to datetime for query
+        start_datetime = timezone.make_aware(
+            datetime.combine(start_date, datetime.min.time())
+        )
+        end_datetime = timezone.make_aware(
+            datetime.combine(end_date, datetime.max.time())
+        )
+        return start_datetime, end_datetime
+
     @staticmethod
     def validate_report_parameters(
         client_id: int, page_id: int, report_type: str, period: str
@@ -53,30 +103,8 @@ class ReportGenerationService:
             )
 
         # Calculate date range
-        try:
-            if report_type == "week":
-                # Period format: YYYY-MM-DD (start of week)
-                start_date = datetime.strptime(period, "%Y-%m-%d").date()
-                end_date = start_date + timedelta(days=6)
-            elif report_type == "month":
-                # Period format: YYYY-MM
-                start_date = datetime.strptime(period + "-01", "%Y-%m-%d").date()
-                # Get last day of month
-                next_month = start_date + relativedelta(months=1)
-                end_date = next_month - timedelta(days=1)
-            else:
-                raise ValueError(
-                    f"Invalid report_type: {report_type}. Must be 'week' or 'month'"
-                )
-        except ValueError as e:
-            raise ValueError(f"Invalid period format: {str(e)}")
-
-        # Convert to datetime for query
-        start_datetime = timezone.make_aware(
-            datetime.combine(start_date, datetime.min.time())
-        )
-        end_datetime = timezone.make_aware(
-            datetime.combine(end_date, datetime.max.time())
+        start_datetime, end_datetime = ReportGenerationService.get_period_range(
+            report_type, period
         )
 
         return client, page, start_datetime, end_datetime
@@ -91,59 +119,65 @@ class ReportGenerationService:
         Returns:
             QuerySet of Post objects
         """
-        return (
-            Post.objects.filter(
+        return Post.objects.filter(
+            client=client,
+            platform_page=page,
+            status="published",
+            published_at__gte=start_datetime,
+            published_at__lte=end_datetime,
+        )
+
+    @staticmethod
+    def get_daily_totals(
+        client: User, page: SocialPage, start_datetime: datetime, end_datetime: datetime
+    ) -> List[Dict]:
+        """
+        Read the daily analytics rollups of the page for the period.
+
+        Returns:
+            List of dictionaries with date, posts, analytics_posts, likes,
+            comments, shares, reach and engagement_rate_sum, ordered by date
+        """
+        return list(
+            DailyPageAnalytics.objects.filter(
                 client=client,
-                platform_page=page,
-                status="published",
-                published_at__gte=start_datetime,
-                published_at__lte=end_datetime,
+                page=page,
+                date__gte=start_datetime.date(),
+                date__lte=end_datetime.date(),
             )
-            .select_related("analytics")
-            .prefetch_related("media")
+            .values(
+                "date",
+                "posts",
+                "analytics_posts",
+                "likes",
+                "comments",
+                "shares",
+                "reach",
+                "engagement_rate_sum",
+            )
+            .order_by("date")
         )
 
     @staticmethod
-    def calculate_aggregate_metrics(posts) -> Dict:
+    def calculate_aggregate_metrics(daily_totals: List[Dict]) -> Dict:
         """
-        Calculate aggregate metrics from posts.
+        Calculate aggregate metrics from the daily totals.
 
         Returns:
             Dictionary with total_posts, total_engagement, total_reach, avg_engagement_rate
         """
-        total_posts = posts.count()
-
-        # Get analytics for posts that have them
-        posts_with_analytics = posts.filter(analytics__isnull=False)
-
-        if not posts_with_analytics.exists():
-            return {
-                "total_posts": total_posts,
-                "total_engagement": 0,
-                "total_reach": 0,
-                "avg_engagement_rate": 0.0,
-            }
-
-        # Calculate totals
-        analytics_data = posts_with_analytics.aggregate(
-            total_likes=Sum("analytics__likes"),
-            total_comments=Sum("analytics__comments"),
-            total_shares=Sum("analytics__shares"),
-            total_reach=Sum("analytics__reach"),
-            avg_engagement_rate=Avg("analytics__engagement_rate"),
-        )
-
-        total_engagement = (
-            (analytics_data["total_likes"] or 0)
-            + (analytics_data["total_comments"] or 0)
-            + (analytics_data["total_shares"] or 0)
-        )
+        analytics_posts = sum(day["analytics_posts"] for day in daily_totals)
+        engagement_rate_sum = sum(day["engagement_rate_sum"] for day in daily_totals)
 
         return {
-            "total_posts": total_posts,
-            "total_engagement": total_engagement,
-            "total_reach": analytics_data["total_reach"] or 0,
-            "avg_engagement_rate": round(analytics_data["avg_engagement_rate"] or 0, 1),
+            "total_posts": sum(day["posts"] for day in daily_totals),
+            "total_engagement": sum(
+                day["likes"] + day["comments"] + day["shares"] for day in daily_totals
+            ),
+            "total_reach": sum(day["reach"] for day in daily_totals),
+            "avg_engagement_rate": round(engagement_rate_sum / analytics_posts, 1)
+            if analytics_posts
+            else 0.0,
         }
 
     @staticmethod
@@ -160,142 +194,108 @@ class ReportGenerationService:
         ]
 
     @staticmethod
-    def get_top_posts(posts, limit: int = 3) -> List[Dict]:
+    def rank_top_posts(posts, partition_by: List, limit: int = 3):
         """
-        Get top performing posts sorted by engagement.
+        Rank posts by engagement within each partition, in the database.
 
         Args:
             posts: QuerySet of posts
-            limit: Number of top posts to return
+            partition_by: Expressions the ranking restarts for
+            limit: Number of top posts to keep per partition
 
         Returns:
-            List of post dictionaries
+            QuerySet of the top posts, ordered by partition and rank
         """
-        top_posts = []
-        posts_with_analytics = posts.filter(analytics__isnull=False)
-
-        # Sort by total engagement (likes + comments + shares)
-        sorted_posts = sorted(
-            posts_with_analytics,
-            key=lambda p: (
-                p.analytics.likes + p.analytics.comments + p.analytics.shares
-                if hasattr(p, "analytics")
-                else 0
-            ),
-            reverse=True,
-        )[:limit]
-
-        for post in sorted_posts:
-            top_posts.append(
-                {
-                    "id": post.id,
-                    "content": (post.description[:100] + "...")
-                    if len(post.description) > 100
-                    else post.description,
-                    "platform": post.platform_page.platform.capitalize()
-                    if post.platform_page
-                    else "Unknown",
-                    "likes": post.analytics.likes if hasattr(post, "analytics") else 0,
-                    "comments": post.analytics.comments
-                    if hasattr(post, "analytics")
-                    else 0,
-                    "shares": post.analytics.shares
-                    if hasattr(post, "analytics")
-                    else 0,
-                    "date": post.published_at.strftime("%Y-%m-%d")
-                    if post.published_at
-                    else "",
-                }
+        engagement = (
+            F("analytics__likes") + F("analytics__comments") + F("analytics__shares")
+        )
+        return (
+            posts.filter(analytics__isnull=False)
+            .annotate(
+                engagement=engagement,
+                rank=Window(
+                    RowNumber(),
+                    partition_by=partition_by,
+                    order_by=[engagement.desc(), F("id").asc()],
+                ),
             )
+            .filter(rank__lte=limit)
+            .select_related("analytics", "platform_page")
+            .order_by(*partition_by, "rank")
+        )
+
+    @staticmethod
+    def serialize_top_post(post) -> Dict:
+        """Top post entry of a report"""
+        return {
+            "id": post.id,
+            "content": (post.description[:100] + "...")
+            if len(post.description) > 100
+            else post.description,
+            "platform": post.platform_page.platform.capitalize()
+            if post.platform_page
+            else "Unknown",
+            "likes": post.analytics.likes,
+            "comments": post.analytics.comments,
+            "shares": post.analytics.shares,
+            "date": post.published_at.strftime("%Y-%m-%d") if post.published_at else "",
+        }
 
-        return top_posts
+    @classmethod
+    def get_top_posts(cls, posts, limit: int = 3) -> List[Dict]:
+        """
+        Get top performing posts sorted by engagement, ranked per page by the
+        database.
+
+        Args:
+            posts: QuerySet of posts
+            limit: Number of top posts to return per page
+
+        Returns:
+            List of post dictionaries
+        """
+        return [
+            cls.serialize_top_post(post)
+            for post in cls.rank_top_posts(posts, [F("platform_page")], limit)
+        ]
 
     @staticmethod
     def calculate_engagement_trend(
-        posts, report_type: str, start_date, end_date
+        daily_totals: List[Dict], report_type: str, start_date, end_date
     ) -> List[Dict]:
         """
-        Calculate engagement trend data.
+        Calculate engagement trend data from the daily totals.
 
         Args:
-            posts: QuerySet of posts
+            daily_totals: Result of get_daily_totals
             report_type: 'week' or 'month'
             start_date: Start date
             end_date: End date
 
         Returns:
-            List of engagement trend data points
+            List of engagement trend data points: one per day for a week, one
+            per 7 days from the 1st for a month (the last one holds days 29+)
         """
-        engagement_trend = []
-        posts_with_analytics = posts.filter(analytics__isnull=False)
+        first_day = start_date.date()
+        bucket_days = 1 if report_type == "week" else 7
+        bucket_count = (end_date.date() - first_day).days // bucket_days + 1
+
+        engagement = [0] * bucket_count
+        for day in daily_totals:
+            bucket = (day["date"] - first_day).days // bucket_days
+            engagement[bucket] += day["likes"] + day["comments"] + day["shares"]
 
         if report_type == "week":
             # Daily breakdown
-            days = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-
-            for i, day in enumerate(days):
-                day_date = start_date.date() + timedelta(days=i)
-                day_start = timezone.make_aware(
-                    datetime.combine(day_date, datetime.min.time())
-                )
-                day_end = timezone.make_aware(
-                    datetime.combine(day_date, datetime.max.time())
-                )
-
-                day_posts = posts_with_analytics.filter(
-                    published_at__gte=day_start, published_at__lte=day_end
-                )
-
-                day_data = day_posts.aggregate(
-                    total_likes=Sum("analytics__likes"),
-                    total_comments=Sum("analytics__comments"),
-                    total_shares=Sum("analytics__shares"),
-                )
-
-                day_engagement = (
-                    (day_data["total_likes"] or 0)
-                    + (day_data["total_comments"] or 0)
-                    + (day_data["total_shares"] or 0)
-                )
-
-                engagement_trend.append({"date": day, "engagement": day_engagement})
-
+            labels = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
         else:  # month
             # Weekly breakdown
-            for week_num in range(4):
-                week_start_date = start_date.date() + timedelta(days=week_num * 7)
-                week_end_date = min(
-                    week_start_date + timedelta(days=6), end_date.date()
-                )
-
-                week_start = timezone.make_aware(
-                    datetime.combine(week_start_date, datetime.min.time())
-                )
-                week_end = timezone.make_aware(
-                    datetime.combine(week_end_date, datetime.max.time())
-                )
-
-                week_posts = posts_with_analytics.filter(
-                    published_at__gte=week_start, published_at__lte=week_end
-                )
-
-                week_data = week_posts.aggregate(
-                    total_likes=Sum("analytics__likes"),
-                    total_comments=Sum("analytics__comments"),
-                    total_shares=Sum("analytics__shares"),
-                )
-
-                week_engagement = (
-                    (week_data["total_likes"] or 0)
-                    + (week_data["total_comments"] or 0)
-                    + (week_data["total_shares"] or 0)
-                )
-
-                engagement_trend.append(
-                    {"date": f"Week {week_num + 1}", "engagement": week_engagement}
-                )
+            labels = [f"Week {week_num + 1}" for week_num in range(bucket_count)]
 
-        return engagement_trend
+        return [
+            {"date": label, "engagement": bucket_engagement}
+            for label, bucket_engagement in zip(labels, engagement)
+        ]
 
     @classmethod
     def generate_report(
@@ -323,9 +323,37 @@ class ReportGenerationService:
 
         # Get published posts
         posts = cls.get_published_posts(client, page, start_datetime, end_datetime)
+        daily_totals = cls.get_daily_totals(client, page, start_datetime, end_datetime)
+
+        # Get top posts, when there are any posts
+        top_posts = cls.get_top_posts(posts) if daily_totals else []
+
+        return cls.build_report(
+            page, report_type, start_datetime, end_datetime, daily_totals, top_posts
+        )
+
+    @classmethod
+    def build_report(
+        cls,
+        page: SocialPage,
+        report_type: str,
+        start_datetime: datetime,
+        end_datetime: datetime,
+        daily_totals: List[Dict],
+        top_posts: List[Dict],
+        platform_breakdown: List[Dict] = None,
+    ) -> Dict:
+        """
+        Assemble a report from the page's daily totals and top posts.
+
+        Args:
+            platform_breakdown: Breakdown to report instead of the page's own
 
+        Returns:
+            Dictionary containing complete report data
+        """
         # If no posts found, return empty report
-        if not posts.exists():
+        if not daily_totals:
             return {
                 "message": "No published posts found for this period",
                 "totalPosts": 0,
@@ -335,25 +363,23 @@ class ReportGenerationService:
                 if isinstance(page.permissions, dict)
                 else 0,
                 "avgEngagementRate": 0,
-                "platformBreakdown": [],
+                "platformBreakdown": platform_breakdown or [],
                 "topPosts": [],
                 "engagementTrend": [],
             }
 
         # Calculate aggregate metrics
-        metrics = cls.calculate_aggregate_metrics(posts)
+        metrics = cls.calculate_aggregate_metrics(daily_totals)
 
         # Get platform breakdown
-        platform_breakdown = cls.get_platform_breakdown(
-            page, metrics["total_posts"], metrics["total_engagement"]
-        )
-
-        # Get top posts
-        top_posts = cls.get_top_posts(posts)
+        if platform_breakdown is None:
+            platform_breakdown = cls.get_platform_breakdown(
+                page, metrics["total_posts"], metrics["total_engagement"]
+            )
 
         # Calculate engagement trend
         engagement_trend = cls.calculate_engagement_trend(
-            posts, report_type, start_datetime, end_datetime
+            daily_totals, report_type, start_datetime, end_datetime
         )
 
         # Build and return complete report
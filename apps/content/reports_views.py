@@ -1,9 +1,20 @@
+import json
+
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 
-from .reports_service import ReportGenerationService
+from apps.accounts.assignments import get_assigned_owners
+from permissions.permissions import IsModeratorOrAdmin
+
+from . import report_cache
+from .models import ReportBatch
+from .report_batches import get_period_ranges, iter_batch_reports
+from .tasks import generate_report_batch
 
 
 class GenerateReportView(APIView):
@@ -33,8 +44,8 @@ class GenerateReportView(APIView):
             )
 
         try:
-            # Use service to generate report
-            report_data = ReportGenerationService.generate_report(
+            # Served from the report cache, computed on a miss
+            report_data = report_cache.get_report(
                 client_id=int(client_id),
                 page_id=int(page_id),
                 report_type=report_type,
@@ -50,3 +61,132 @@ class GenerateReportView(APIView):
                 {"error": f"An error occurred: {str(e)}"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
+
+
+def _serialize_batch(batch):
+    return {
+        "id": batch.id,
+        "reportType": batch.report_type,
+        "periods": batch.periods,
+        "clientIds": batch.client_ids,
+        "status": batch.status,
+        "progress": batch.progress,
+        "processedClients": batch.processed_clients,
+        "totalClients": batch.total_clients,
+        "error": batch.error,
+        "createdAt": batch.created_at,
+        "completedAt": batch.completed_at,
+    }
+
+
+def _visible_batches(user):
+    """Administrators see every batch, moderators the ones they requested"""
+    batches = ReportBatch.objects.all()
+    if not user.is_administrator:
+        batches = batches.filter(requested_by=user)
+    return batches
+
+
+class ReportBatchView(APIView):
+    """
+    Generate reports for many clients in the background.
+    POST body:
+    - report_type: 'week' or 'month'
+    - periods: List of periods, in the format of GenerateReportView
+    - client_ids: Clients to report on, every client when omitted.
+      Moderators only get reports of the clients assigned to them.
+    GET lists the batches requested by the user, every batch for administrators.
+    """
+
+    permission_classes = [IsModeratorOrAdmin]
+
+    def get(self, request):
+        batches = _visible_batches(request.user)
+        return Response(
+            [_serialize_batch(batch) for batch in batches], status=status.HTTP_200_OK
+        )
+
+    def post(self, request):
+        report_type = request.data.get("report_type", "month")
+        periods = request.data.get("periods")
+        client_ids = request.data.get("client_ids") or []
+
+        if not isinstance(periods, list) or not periods:
+            return Response(
+                {"error": "periods must be a non-empty list"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not isinstance(client_ids, list) or not all(
+            isinstance(client_id, int) for client_id in client_ids
+        ):
+            return Response(
+                {"error": "client_ids must be a list of ids"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if not request.user.is_administrator and (
+            set(client_ids) - get_assigned_owners(request.user, client_ids)
+        ):
+            return Response(
+                {"error": "Reports can only be requested for assigned clients"},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+
+        try:
+            get_period_ranges(report_type, periods)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        batch = ReportBatch.objects.create(
+            requested_by=request.user,
+            report_type=report_type,
+            periods=periods,
+            client_ids=client_ids,
+        )
+        transaction.on_commit(lambda: generate_report_batch.delay(batch.id))
+        return Response(_serialize_batch(batch), status=status.HTTP_202_ACCEPTED)
+
+
+class ReportBatchDetailView(APIView):
+    """Status and progress of a report batch"""
+
+    permission_classes = [IsModeratorOrAdmin]
+
+    def get(self, request, batch_id):
+        batch = get_object_or_404(_visible_batches(request.user), id=batch_id)
+        return Response(_serialize_batch(batch), status=status.HTTP_200_OK)
+
+
+def _stream_batch(batch):
+    """The JSON document of a batch's reports, a chunk at a time"""
+    periods = [
+        period for period, _, _ in get_period_ranges(batch.report_type, batch.periods)
+    ]
+    yield (
+        f'{{"reportType": {json.dumps(batch.report_type)}, '
+        f'"periods": {json.dumps(periods)}, "clients": ['
+    )
+    for index, report in enumerate(iter_batch_reports(batch)):
+        yield (", " if index else "") + json.dumps(report)
+    yield "]}"
+
+
+class ReportBatchDownloadView(APIView):
+    """The reports of a completed batch, streamed as a JSON attachment"""
+
+    permission_classes = [IsModeratorOrAdmin]
+
+    def get(self, request, batch_id):
+        batch = get_object_or_404(_visible_batches(request.user), id=batch_id)
+        if batch.status != "completed":
+            return Response(
+                {"error": f"Report batch is {batch.status}"},
+                status=status.HTTP_409_CONFLICT,
+            )
+        response = StreamingHttpResponse(
+            _stream_batch(batch), content_type="application/json"
+        )
+        response[
+            "Content-Disposition"
+        ] = f'attachment; filename="reports-{batch.id}.json"'
+        return response
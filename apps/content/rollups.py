@@ -0,0 +1,172 @@
+"""
+Daily analytics rollups read by reports and the admin dashboard.
+
+``DailyPageAnalytics`` holds the analytics of published posts summed per
+(client, page, platform, day). When a post or its analytics change, only
+the days they fall on are recomputed, with one grouped query over those
+days' posts. Code that changes analytics in bulk, without signals, calls
+``refresh_rollups_for_posts`` afterwards. Refreshed days mark the cached
+reports covering them as stale.
+"""
+
+import logging
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from . import report_cache
+from .analytics_models import DailyPageAnalytics
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_FIELDS = [
+    "posts",
+    "analytics_posts",
+    "likes",
+    "comments",
+    "shares",
+    "reach",
+    "impressions",
+    "clicks",
+    "engagement_rate_sum",
+]
+
+
+def rollup_key(post):
+    """The ``(client_id, page_id, date)`` a post counts towards, or ``None``"""
+    if (
+        post.status != "published"
+        or post.published_at is None
+        or post.client_id is None
+        or post.platform_page_id is None
+    ):
+        return None
+    return (
+        post.client_id,
+        post.platform_page_id,
+        timezone.localtime(post.published_at).date(),
+    )
+
+
+def _day_range(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def summarize_posts(posts):
+    """Analytics of ``posts`` summed per client, page and day"""
+    has_analytics = Q(analytics__isnull=False)
+    return (
+        posts.filter(
+            status="published",
+            client__isnull=False,
+            platform_page__isnull=False,
+            published_at__isnull=False,
+        )
+        .annotate(day=TruncDate("published_at"))
+        .values("client_id", "platform_page_id", "platform_page__platform", "day")
+        .annotate(
+            posts=Count("id"),
+            analytics_posts=Count("id", filter=has_analytics),
+            likes=Coalesce(Sum("analytics__likes"), 0),
+            comments=Coalesce(Sum("analytics__comments"), 0),
+            shares=Coalesce(Sum("analytics__shares"), 0),
+            reach=Coalesce(Sum("analytics__reach"), 0),
+            impressions=Coalesce(Sum("analytics__impressions"), 0),
+            clicks=Coalesce(Sum("analytics__clicks"), 0),
+            engagement_rate_sum=Coalesce(Sum("analytics__engagement_rate"), 0.0),
+        )
+        .order_by()
+    )
+
+
+def _rollup_from_summary(row):
+    return DailyPageAnalytics(
+        client_id=row["client_id"],
+        page_id=row["platform_page_id"],
+        platform=row["platform_page__platform"],
+        date=row["day"],
+        **{field: row[field] for field in ROLLUP_FIELDS},
+    )
+
+
+def _save_rollups(rollups):
+    DailyPageAnalytics.objects.bulk_create(
+        rollups,
+        update_conflicts=True,
+        unique_fields=["client", "page", "platform", "date"],
+        update_fields=ROLLUP_FIELDS + ["updated_at"],
+    )
+
+
+def refresh_daily_rollups(keys):
+    """Recompute the rollups of the given ``(client_id, page_id, date)``"""
+    keys = {key for key in keys if key is not None}
+    if not keys:
+        return
+
+    days = Q()
+    for client_id, page_id, day in keys:
+        start, end = _day_range(day)
+        days |= Q(
+            client_id=client_id,
+            platform_page_id=page_id,
+            published_at__gte=start,
+            published_at__lt=end,
+        )
+    rollups = [
+        _rollup_from_summary(row) for row in summarize_posts(Post.objects.filter(days))
+    ]
+
+    # Days that no longer have published posts lose their row
+    emptied = keys - {(r.client_id, r.page_id, r.date) for r in rollups}
+    stale = Q()
+    for client_id, page_id, day in emptied:
+        stale |= Q(client_id=client_id, page_id=page_id, date=day)
+
+    with transaction.atomic():
+        if rollups:
+            _save_rollups(rollups)
+        if emptied:
+            DailyPageAnalytics.objects.filter(stale).delete()
+    # Once the new rows are visible, or a report could be recomputed from
+    # the old ones under the new version
+    transaction.on_commit(lambda: report_cache.bump_day_versions(keys))
+
+
+def refresh_rollups_for_posts(post_ids):
+    """Recompute the days the given posts count towards"""
+    posts = Post.objects.filter(id__in=post_ids).only(
+        "status", "published_at", "client_id", "platform_page_id"
+    )
+    refresh_daily_rollups(rollup_key(post) for post in posts)
+
+
+def rebuild_daily_rollups(batch_size=1000):
+    """Recompute every rollup from the posts. Returns the number of rows"""
+    rollups = [_rollup_from_summary(row) for row in summarize_posts(Post.objects.all())]
+    with transaction.atomic():
+        DailyPageAnalytics.objects.all().delete()
+        for start in range(0, len(rollups), batch_size):
+            _save_rollups(rollups[start : start + batch_size])
+    transaction.on_commit(report_cache.invalidate_reports)
+    return len(rollups)
+
+
+def schedule_rollup_refresh(keys):
+    """Refresh the rollups once the current transaction commits"""
+    keys = {key for key in keys if key is not None}
+    if not keys:
+        return
+
+    def refresh():
+        try:
+            refresh_daily_rollups(keys)
+        except Exception as e:
+            logger.error(f"Error refreshing analytics rollups {keys}: {e}")
+
+    transaction.on_commit(refresh)
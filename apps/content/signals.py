@@ -1,10 +1,14 @@
 import logging
+from django.db import transaction
 from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 import json
-from .models import Post
+from apps.social_media.models import SocialPage
+from . import report_cache
+from .models import Post, PostAnalytics
+from .rollups import rollup_key, schedule_rollup_refresh
 from .serializers import PostSerializer
 
 logger = logging.getLogger(__name__)
@@ -133,10 +137,13 @@ def store_old_status(sender, instance, **kwargs):
         try:
             old_instance = Post.objects.get(pk=instance.pk)
             instance._old_status = old_instance.status
+            instance._old_rollup_key = rollup_key(old_instance)
         except Post.DoesNotExist:
             instance._old_status = None
+            instance._old_rollup_key = None
     else:
         instance._old_status = None
+        instance._old_rollup_key = None
 
 
 @receiver(post_delete, sender=Post)
@@ -153,3 +160,42 @@ def handle_post_deleted(sender, instance, **kwargs):
     except Exception as e:
         # Log error but don't break the delete operation
         logger.error(f"Error sending WebSocket update for deleted post {instance.id}: {e}")
+
+
+@receiver(post_save, sender=Post)
+def update_post_rollups(sender, instance, **kwargs):
+    """
+    Refresh the daily rollups when a post is published, unpublished or
+    moved to another day or page
+    """
+    old_key = getattr(instance, "_old_rollup_key", None)
+    new_key = rollup_key(instance)
+    if old_key != new_key:
+        schedule_rollup_refresh([old_key, new_key])
+
+
+@receiver(post_delete, sender=Post)
+def remove_post_from_rollups(sender, instance, **kwargs):
+    schedule_rollup_refresh([rollup_key(instance)])
+
+
+@receiver(post_save, sender=PostAnalytics)
+@receiver(post_delete, sender=PostAnalytics)
+def update_analytics_rollups(sender, instance, **kwargs):
+    """Refresh the day of a post whose analytics were synced or removed"""
+    try:
+        post = Post.objects.only(
+            "status", "published_at", "client_id", "platform_page_id"
+        ).get(pk=instance.post_id)
+    except Post.DoesNotExist:
+        # Deleted along with its post, which refreshes its own day
+        return
+    schedule_rollup_refresh([rollup_key(post)])
+
+
+@receiver(post_save, sender=SocialPage)
+@receiver(post_delete, sender=SocialPage)
+def invalidate_page_reports(sender, instance, **kwargs):
+    """Reports include page details such as the follower count"""
+    page_id = instance.pk
+    transaction.on_commit(lambda: report_cache.bump_page_version(page_id))
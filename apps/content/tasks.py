@@ -0,0 +1,14 @@
+from celery import shared_task
+from apps.content import report_batches, report_cache
+
+
+@shared_task
+def refresh_report_cache(client_id, page_id, report_type, period):
+    """Recompute a stale cached report"""
+    report_cache.refresh_report(client_id, page_id, report_type, period)
+
+
+@shared_task
+def generate_report_batch(batch_id):
+    """Generate the reports of a ``ReportBatch``"""
+    report_batches.run_report_batch(batch_id)
@@ -1,9 +1,26 @@
+import json
+from unittest.mock import patch
+
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from rest_framework import status
-from apps.content.models import Post, Media
+from apps.content import report_cache
+from apps.content.models import (
+    DailyPageAnalytics,
+    Post,
+    Media,
+    PostAnalytics,
+    ReportBatch,
+)
+from apps.content.report_batches import iter_batch_reports, run_report_batch
+from apps.content.reports_service import ReportGenerationService
+from apps.content.rollups import rebuild_daily_rollups
+from apps.content.tasks import generate_report_batch, refresh_report_cache
+from apps.social_media.models import SocialPage
+from planit.redis_client import get_redis
 from django.utils import timezone
+from datetime import date, datetime
 
 User = get_user_model()
 
@@ -94,3 +111,372 @@ class MediaModelTestCase(TestCase):
         self.assertEqual(image.type, "image")
         self.assertEqual(video.type, "video")
         self.assertEqual(doc.type, "document")
+
+
+class ReportDataTestCase(TestCase):
+    """Client, page and published posts shared by the report test cases"""
+
+    def setUp(self):
+        self.client_user = User.objects.create_user(
+            email="reportclient@example.com", password="testpass123", is_client=True
+        )
+        self.page = SocialPage.objects.create(
+            client=self.client_user,
+            platform="facebook",
+            page_id="page-1",
+            page_name="Page",
+            access_token="token",
+        )
+
+    def create_post(self, day, likes=None, comments=0, shares=0, reach=100):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(
+                title=f"Post {day}",
+                description=f"Post published on day {day}",
+                status="published",
+                client=self.client_user,
+                platform_page=self.page,
+                published_at=timezone.make_aware(datetime(2024, 3, day, 12)),
+            )
+            if likes is not None:
+                PostAnalytics.objects.create(
+                    post=post, likes=likes, comments=comments, shares=shares, reach=reach
+                )
+        return post
+
+
+class ReportGenerationTestCase(ReportDataTestCase):
+    """Test cases for report generation"""
+
+    def test_monthly_report(self):
+        """Test a monthly report is computed in a fixed number of queries"""
+        first = self.create_post(1, likes=10, comments=5)
+        self.create_post(2, likes=1)
+        best = self.create_post(15, likes=50, shares=10)
+        late = self.create_post(31, likes=30)
+        self.create_post(20)
+
+        # Client and page lookups, daily rollups, top posts
+        with self.assertNumQueries(4):
+            report = ReportGenerationService.generate_report(
+                self.client_user.id, self.page.id, "month", "2024-03"
+            )
+
+        self.assertEqual(report["totalPosts"], 5)
+        self.assertEqual(report["totalEngagement"], 106)
+        self.assertEqual(report["totalReach"], 400)
+        self.assertEqual(
+            report["engagementTrend"],
+            [
+                {"date": "Week 1", "engagement": 16},
+                {"date": "Week 2", "engagement": 0},
+                {"date": "Week 3", "engagement": 60},
+                {"date": "Week 4", "engagement": 0},
+                {"date": "Week 5", "engagement": 30},
+            ],
+        )
+        self.assertEqual(
+            [post["id"] for post in report["topPosts"]], [best.id, late.id, first.id]
+        )
+
+    def test_weekly_trend(self):
+        """Test a weekly report has one trend point per day"""
+        self.create_post(4, likes=3)
+        self.create_post(10, likes=7)
+
+        report = ReportGenerationService.generate_report(
+            self.client_user.id, self.page.id, "week", "2024-03-04"
+        )
+
+        self.assertEqual(
+            [point["engagement"] for point in report["engagementTrend"]],
+            [3, 0, 0, 0, 0, 0, 7],
+        )
+
+
+class DailyRollupTestCase(ReportDataTestCase):
+    """Test cases for the daily analytics rollups"""
+
+    def rollups(self):
+        return list(
+            DailyPageAnalytics.objects.order_by("date").values_list(
+                "date", "posts", "analytics_posts", "likes"
+            )
+        )
+
+    def test_rollups_follow_analytics_and_posts(self):
+        """Test rollups are updated when analytics are synced and posts move"""
+        post = self.create_post(5, likes=10)
+        self.create_post(5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post.analytics.likes = 25
+            post.analytics.save()
+        self.assertEqual(self.rollups(), [(date(2024, 3, 5), 2, 1, 25)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post.published_at = timezone.make_aware(datetime(2024, 3, 6, 9))
+            post.save()
+        self.assertEqual(
+            self.rollups(),
+            [(date(2024, 3, 5), 1, 0, 0), (date(2024, 3, 6), 1, 1, 25)],
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+        self.assertEqual(self.rollups(), [(date(2024, 3, 5), 1, 0, 0)])
+
+    def test_rebuild_matches_incremental_rollups(self):
+        """Test a full rebuild gives the rows kept up to date incrementally"""
+        self.create_post(1, likes=4)
+        self.create_post(1, likes=6)
+        self.create_post(9)
+        incremental = self.rollups()
+
+        self.assertEqual(rebuild_daily_rollups(), 2)
+        self.assertEqual(self.rollups(), incremental)
+
+
+@patch("apps.content.tasks.refresh_report_cache.delay")
+class ReportCacheTestCase(ReportDataTestCase):
+    """Test cases for the report result cache"""
+
+    def setUp(self):
+        super().setUp()
+        self.clear_cache()
+
+    def tearDown(self):
+        self.clear_cache()
+
+    def clear_cache(self):
+        redis_conn = get_redis()
+        keys = redis_conn.keys("report_cache:*")
+        if keys:
+            redis_conn.delete(*keys)
+
+    def get_report(self, period="2024-03"):
+        return report_cache.get_report(
+            self.client_user.id, self.page.id, "month", period
+        )
+
+    def test_unchanged_period_is_served_from_cache(self, delay):
+        """Test a report is computed once while its analytics don't change"""
+        self.create_post(3, likes=5)
+        report = self.get_report()
+
+        # Analytics synced for another month
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Post.objects.create(
+                title="April",
+                status="published",
+                client=self.client_user,
+                platform_page=self.page,
+                published_at=timezone.make_aware(datetime(2024, 4, 2, 12)),
+            )
+            PostAnalytics.objects.create(post=other, likes=100)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_report(), report)
+        delay.assert_not_called()
+
+    def test_resynced_period_is_revalidated(self, delay):
+        """Test a stale report is returned while it is recomputed"""
+        post = self.create_post(3, likes=5)
+        self.get_report()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post.analytics.likes = 50
+            post.analytics.save()
+
+        self.assertEqual(self.get_report()["totalEngagement"], 5)
+        delay.assert_called_once_with(
+            self.client_user.id, self.page.id, "month", "2024-03"
+        )
+
+        # Queued once until the refresh runs
+        self.get_report()
+        self.assertEqual(delay.call_count, 1)
+
+        refresh_report_cache(*delay.call_args.args)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_report()["totalEngagement"], 50)
+
+
+class ReportBatchTestCase(ReportDataTestCase):
+    """Test cases for batch report generation"""
+
+    def setUp(self):
+        super().setUp()
+        self.instagram = SocialPage.objects.create(
+            client=self.client_user,
+            platform="instagram",
+            page_id="page-2",
+            page_name="Instagram Page",
+            access_token="token",
+        )
+        self.admin = User.objects.create_user(
+            email="reportadmin@example.com",
+            password="testpass123",
+            is_administrator=True,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.admin)
+
+    def publish(self, page, published_at, likes):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(
+                title=f"Post {published_at}",
+                status="published",
+                client=page.client,
+                platform_page=page,
+                published_at=timezone.make_aware(published_at),
+            )
+            PostAnalytics.objects.create(post=post, likes=likes)
+        return post
+
+    def test_batch_matches_single_reports(self):
+        """Test a batch holds every page and period, as generated one by one"""
+        self.create_post(3, likes=5)
+        self.publish(self.instagram, datetime(2024, 3, 10, 12), likes=20)
+        self.publish(self.instagram, datetime(2024, 2, 14, 12), likes=7)
+        batch = ReportBatch.objects.create(
+            requested_by=self.admin, report_type="month", periods=["2024-03", "2024-02"]
+        )
+
+        batch = run_report_batch(batch.id)
+
+        self.assertEqual(batch.status, "completed")
+        self.assertEqual(batch.progress, 100)
+        february, march = iter_batch_reports(batch)
+        self.assertEqual(march["clientId"], self.client_user.id)
+        self.assertEqual(
+            march["platformBreakdown"],
+            [
+                {"platform": "Instagram", "posts": 1, "engagement": 20},
+                {"platform": "Facebook", "posts": 1, "engagement": 5},
+            ],
+        )
+        self.assertEqual(
+            february["platformBreakdown"][0],
+            {"platform": "Instagram", "posts": 1, "engagement": 7},
+        )
+        for entry in (february, march):
+            for page in entry["pages"]:
+                self.assertEqual(
+                    page["report"],
+                    ReportGenerationService.generate_report(
+                        self.client_user.id, page["pageId"], "month", entry["period"]
+                    ),
+                )
+
+    def test_queries_do_not_grow_with_clients(self):
+        """Test a chunk of clients is reported on in a fixed number of queries"""
+        for index in range(3):
+            client = User.objects.create_user(
+                email=f"batchclient{index}@example.com",
+                password="testpass123",
+                is_client=True,
+            )
+            page = SocialPage.objects.create(
+                client=client,
+                platform="linkedin",
+                page_id=f"batch-{index}",
+                page_name=f"Batch {index}",
+                access_token="token",
+            )
+            self.publish(page, datetime(2024, 3, index + 1, 12), likes=index)
+        batch = ReportBatch.objects.create(
+            requested_by=self.admin, report_type="month", periods=["2024-02", "2024-03"]
+        )
+
+        # Batch, old chunks, clients, pages, rollups, top posts, the chunk
+        # and progress saves
+        with self.assertNumQueries(11):
+            batch = run_report_batch(batch.id)
+        self.assertEqual(batch.processed_clients, 4)
+        self.assertEqual(len(list(iter_batch_reports(batch))), 8)
+
+    def test_moderator_batch_covers_assigned_clients(self):
+        """Test a moderator's batch only reports on the clients assigned to them"""
+        moderator = User.objects.create_user(
+            email="batchmoderator@example.com",
+            password="testpass123",
+            is_moderator=True,
+        )
+        other_client = User.objects.create_user(
+            email="otherclient@example.com", password="testpass123", is_client=True
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client_user.assigned_moderator = moderator
+            self.client_user.save()
+        self.client.force_authenticate(user=moderator)
+
+        response = self.client.post(
+            "/api/content/reports/batches/",
+            {"periods": ["2024-03"], "client_ids": [other_client.id]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        batch = ReportBatch.objects.create(
+            requested_by=moderator, report_type="month", periods=["2024-03"]
+        )
+        batch = run_report_batch(batch.id)
+
+        self.assertEqual(batch.total_clients, 1)
+        self.assertEqual(
+            {report["clientId"] for report in iter_batch_reports(batch)},
+            {self.client_user.id},
+        )
+
+    def test_overlapping_periods_are_rejected(self):
+        """Test periods that overlap are refused before a batch is queued"""
+        response = self.client.post(
+            "/api/content/reports/batches/",
+            {"report_type": "week", "periods": ["2024-03-04", "2024-03-06"]},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ReportBatch.objects.exists())
+
+    def test_batch_is_generated_and_downloaded(self):
+        """Test a requested batch runs in the background and can be downloaded"""
+        self.create_post(3, likes=5)
+
+        with patch.object(
+            generate_report_batch, "delay", side_effect=generate_report_batch
+        ):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    "/api/content/reports/batches/",
+                    {"report_type": "month", "periods": ["2024-03"]},
+                    format="json",
+                )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data["status"], "pending")
+        batch_id = response.data["id"]
+
+        response = self.client.get(f"/api/content/reports/batches/{batch_id}/")
+        self.assertEqual(response.data["status"], "completed")
+        self.assertEqual(response.data["progress"], 100)
+
+        response = self.client.get(f"/api/content/reports/batches/{batch_id}/download/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response["Content-Disposition"],
+            f'attachment; filename="reports-{batch_id}.json"',
+        )
+        result = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(result["periods"], ["2024-03"])
+        self.assertEqual(result["clients"][0]["pages"][0]["report"]["totalPosts"], 1)
+
+    def test_unfinished_batch_cannot_be_downloaded(self):
+        """Test a batch is only downloadable once completed"""
+        batch = ReportBatch.objects.create(
+            requested_by=self.admin, report_type="month", periods=["2024-03"]
+        )
+
+        response = self.client.get(f"/api/content/reports/batches/{batch.id}/download/")
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
@@ -21,7 +21,12 @@ from .views import (
     CancelApprovalView,
     ModeratorValidatePostView,
 )
-from .reports_views import GenerateReportView
+from .reports_views import (
+    GenerateReportView,
+    ReportBatchView,
+    ReportBatchDetailView,
+    ReportBatchDownloadView,
+)
 
 urlpatterns = [
     path("posts/", ListPostsView.as_view(), name="list-posts"),
@@ -80,4 +85,15 @@ urlpatterns = [
     path("media/<int:pk>/", MediaDetailView.as_view(), name="media-detail"),
     # Reports
     path("reports/generate/", GenerateReportView.as_view(), name="generate-report"),
+    path("reports/batches/", ReportBatchView.as_view(), name="report-batches"),
+    path(
+        "reports/batches/<int:batch_id>/",
+        ReportBatchDetailView.as_view(),
+        name="report-batch-detail",
+    ),
+    path(
+        "reports/batches/<int:batch_id>/download/",
+        ReportBatchDownloadView.as_view(),
+        name="report-batch-download",
+    ),
 ]
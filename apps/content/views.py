@@ -8,8 +8,10 @@ from django.db import models
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 
+from apps.accounts.assignments import is_client_community_manager
 from apps.accounts.tasks import send_celery_email
-from apps.notifications.services import notify_user
+from apps.notifications.models import Notification
+from apps.notifications.services import notify_user, notify_users, send_notifications
 from permissions.permissions import (
     IsCommunityManager,
     IsModeratorOrCMOrAdmin,
@@ -121,15 +123,13 @@ class CreatePostView(APIView):
 
         # Permission Check
         if request.user.is_community_manager:
-            if not client.assigned_communitymanagerstoclient.filter(
-                id=request.user.id
-            ).exists():
+            if not is_client_community_manager(client.id, request.user.id):
                 return Response(
                     {"error": "Not assigned to this client."},
                     status=status.HTTP_403_FORBIDDEN,
                 )
         elif request.user.is_moderator:
-            if client.assigned_moderator != request.user:
+            if client.assigned_moderator_id != request.user.id:
                 return Response(
                     {"error": "Not assigned to this client."},
                     status=status.HTTP_403_FORBIDDEN,
@@ -171,21 +171,16 @@ class CreatePostView(APIView):
 
                 # Notify the client about the post creation for review (avoid self-notification)
                 if post.status == "pending" and client != request.user:
+                    # The email is sent along with the notification, so
+                    # bursts of new posts are collapsed into one digest
                     notify_user(
                         user=client,
                         title="Post Pending Your Approval",
                         message=f"A post '{post.title}' has been created and is pending your approval. Please review and approve or reject it.",
                         type="post_pending_approval",
+                        email=f'Hello {client.full_name or client.email}, A post titled "{post.title}" has been created and is pending your approval. Please log in to review and approve or reject this post. Scheduled for: {scheduled_for}',
                     )
                     print(f"Approval notification sent to {client}")
-
-                    # Send email asynchronously using Celery for approval
-                    send_celery_email.delay(
-                        "Post Pending Your Approval",
-                        f'Hello {client.full_name or client.email}, A post titled "{post.title}" has been created and is pending your approval. Please log in to review and approve or reject this post. Scheduled for: {scheduled_for}',
-                        [client.email],
-                        fail_silently=False,
-                    )
                 elif post.status != "pending" and client != request.user:
                     # Original notification for drafts or other statuses (avoid self-notification)
                     notify_user(
@@ -481,16 +476,7 @@ class UpdatePostView(APIView):
                             title="Updated Post Pending Your Approval",
                             message=f"The post '{post.title}' has been updated and is now pending your approval.",
                             type="post_pending_approval",
-                        )
-
-                        # Send email notification
-                        from apps.accounts.tasks import send_celery_email
-
-                        send_celery_email.delay(
-                            "Updated Post Pending Your Approval",
-                            f'Hello {post.client.full_name or post.client.email}, The post titled "{post.title}" has been updated and is now pending your approval. Please log in to review and approve or reject this post.',
-                            [post.client.email],
-                            fail_silently=False,
+                            email=f'Hello {post.client.full_name or post.client.email}, The post titled "{post.title}" has been updated and is now pending your approval. Please log in to review and approve or reject this post.',
                         )
 
                 updated_data = PostSerializer(post, context={"request": request}).data
@@ -790,15 +776,19 @@ class ApprovePostView(APIView):
         invalidate_cache(Post)
         invalidate_cache(Post, post_id)
 
+        notifications = []
+
         # Notify the creator about approval
         if post.creator and post.creator != request.user:
             if feedback:
                 approval_message += f" Feedback: {feedback}"
-            notify_user(
-                user=post.creator,
-                title="Post Approved",
-                message=approval_message,
-                type="post_approved",
+            notifications.append(
+                Notification(
+                    recipient=post.creator,
+                    title="Post Approved",
+                    message=approval_message,
+                    type="post_approved",
+                )
             )
 
         # Notify the client about approval (if approved by moderator or admin)
@@ -810,11 +800,13 @@ class ApprovePostView(APIView):
             client_message = f"The post '{post.title}' has been validated by moderator and scheduled."
             if feedback:
                 client_message += f" Feedback: {feedback}"
-            notify_user(
-                user=post.client,
-                title="Post Validated",
-                message=client_message,
-                type="post_approved",
+            notifications.append(
+                Notification(
+                    recipient=post.client,
+                    title="Post Validated",
+                    message=client_message,
+                    type="post_approved",
+                )
             )
 
         # Notify moderator if client approved the post (avoid double notification if creator is the assigned moderator)
@@ -827,11 +819,13 @@ class ApprovePostView(APIView):
             approval_message = f"The post '{post.title}' has been approved by the client and is now scheduled."
             if feedback:
                 approval_message += f" Client feedback: {feedback}"
-            notify_user(
-                user=post.creator,
-                title="Client Approved Post",
-                message=approval_message,
-                type="post_approved",
+            notifications.append(
+                Notification(
+                    recipient=post.creator,
+                    title="Client Approved Post",
+                    message=approval_message,
+                    type="post_approved",
+                )
             )
 
         # Notify assigned moderator when client approves the post (only if different from creator)
@@ -845,13 +839,17 @@ class ApprovePostView(APIView):
             )
             if feedback:
                 moderator_message += f" Client feedback: {feedback}"
-            notify_user(
-                user=post.client.assigned_moderator,
-                title="Client Approved Post - Validation Needed",
-                message=moderator_message,
-                type="post_pending_validation",
+            notifications.append(
+                Notification(
+                    recipient=post.client.assigned_moderator,
+                    title="Client Approved Post - Validation Needed",
+                    message=moderator_message,
+                    type="post_pending_validation",
+                )
             )
 
+        send_notifications(notifications)
+
         response_data = {
             "message": "Post approved successfully.",
             "post": PostSerializer(post).data,
@@ -938,13 +936,17 @@ class RejectPostView(APIView):
         invalidate_cache(Post)
         invalidate_cache(Post, post_id)
 
+        notifications = []
+
         # Notify the creator about rejection
         if post.creator and post.creator != request.user:
-            notify_user(
-                title=f"Post '{post.title}' Rejected",
-                user=post.creator,
-                message=f"Your post '{post.title}' has been rejected. Feedback: {feedback}",
-                type="post_rejected",
+            notifications.append(
+                Notification(
+                    title=f"Post '{post.title}' Rejected",
+                    recipient=post.creator,
+                    message=f"Your post '{post.title}' has been rejected. Feedback: {feedback}",
+                    type="post_rejected",
+                )
             )
 
         # Notify the client about rejection (if rejected by moderator or admin)
@@ -953,11 +955,13 @@ class RejectPostView(APIView):
             and post.client != request.user
             and (request.user.is_moderator or request.user.is_administrator)
         ):
-            notify_user(
-                title=f"Post '{post.title}' Rejected",
-                user=post.client,
-                message=f"The post '{post.title}' has been rejected. Feedback: {feedback}",
-                type="post_rejected",
+            notifications.append(
+                Notification(
+                    title=f"Post '{post.title}' Rejected",
+                    recipient=post.client,
+                    message=f"The post '{post.title}' has been rejected. Feedback: {feedback}",
+                    type="post_rejected",
+                )
             )
 
         # Notify moderator if client rejected the post (avoid double notification if creator is the assigned moderator)
@@ -967,11 +971,13 @@ class RejectPostView(APIView):
             and post.creator.is_moderator
             and post.creator != post.client.assigned_moderator
         ):
-            notify_user(
-                title=f"Post '{post.title}' Rejected",
-                user=post.creator,
-                message=f"The post '{post.title}' has been rejected by the client. Feedback: {feedback}",
-                type="post_rejected",
+            notifications.append(
+                Notification(
+                    title=f"Post '{post.title}' Rejected",
+                    recipient=post.creator,
+                    message=f"The post '{post.title}' has been rejected by the client. Feedback: {feedback}",
+                    type="post_rejected",
+                )
             )
 
         # Notify assigned moderator when client rejects the post (only if different from creator)
@@ -980,13 +986,17 @@ class RejectPostView(APIView):
             and post.client.assigned_moderator
             and post.client.assigned_moderator != post.creator
         ):
-            notify_user(
-                title=f"Post '{post.title}' Rejected by Client",
-                user=post.client.assigned_moderator,
-                message=f"The post '{post.title}' has been rejected by the client. Feedback: {feedback}",
-                type="post_rejected",
+            notifications.append(
+                Notification(
+                    title=f"Post '{post.title}' Rejected by Client",
+                    recipient=post.client.assigned_moderator,
+                    message=f"The post '{post.title}' has been rejected by the client. Feedback: {feedback}",
+                    type="post_rejected",
+                )
             )
 
+        send_notifications(notifications)
+
         return Response(
             {
                 "message": "Post rejected successfully.",
@@ -1077,10 +1087,8 @@ class PostFeedbackView(APIView):
             or request.user.is_moderator
             or (
                 request.user.is_community_manager
-                and post.client
-                and post.client.assigned_communitymanagerstoclient.filter(
-                    id=request.user.id
-                ).exists()
+                and post.client_id
+                and is_client_community_manager(post.client_id, request.user.id)
             )
         ):
             return Response(
@@ -1130,20 +1138,16 @@ class GetPostByIdView(APIView):
             # 5. User is a CM and the post creator is their assigned moderator
             cm_assigned_to_client = (
                 request.user.is_community_manager
-                and post.client
-                and post.client.assigned_communitymanagerstoclient.filter(
-                    id=request.user.id
-                ).exists()
+                and post.client_id
+                and is_client_community_manager(post.client_id, request.user.id)
             )
 
             cm_can_see_mod_post = (
                 request.user.is_community_manager
-                and post.creator
-                and post.creator == request.user.assigned_moderator
-                and post.client
-                and post.client.assigned_communitymanagerstoclient.filter(
-                    id=request.user.id
-                ).exists()
+                and post.creator_id
+                and post.creator_id == request.user.assigned_moderator_id
+                and post.client_id
+                and is_client_community_manager(post.client_id, request.user.id)
             )
 
             if not (
@@ -1215,13 +1219,17 @@ class PublishPostView(APIView):
         invalidate_cache(Post)
         invalidate_cache(Post, post_id)
 
+        notifications = []
+
         # Notify the creator about publication
         if post.creator and post.creator != request.user:
-            notify_user(
-                user=post.creator,
-                title="Post Published",
-                message=f"Your post '{post.title}' has been published successfully!",
-                type="post_published",
+            notifications.append(
+                Notification(
+                    recipient=post.creator,
+                    title="Post Published",
+                    message=f"Your post '{post.title}' has been published successfully!",
+                    type="post_published",
+                )
             )
 
         # Notify the client about publication (if published by moderator or admin)
@@ -1230,13 +1238,17 @@ class PublishPostView(APIView):
             and post.client != request.user
             and (request.user.is_moderator or request.user.is_administrator)
         ):
-            notify_user(
-                user=post.client,
-                title="Post Published",
-                message=f"The post '{post.title}' has been published successfully!",
-                type="post_published",
+            notifications.append(
+                Notification(
+                    recipient=post.client,
+                    title="Post Published",
+                    message=f"The post '{post.title}' has been published successfully!",
+                    type="post_published",
+                )
             )
 
+        send_notifications(notifications)
+
         response_data = {
             "message": "Post published successfully.",
             "post": PostSerializer(post).data,
@@ -1297,23 +1309,22 @@ class ResubmitPostView(APIView):
         invalidate_cache(Post)
         invalidate_cache(Post, post_id)
 
+        notifications = []
+        emails = []
+
         # Notify client about resubmission for approval
         if post.client:
-            notify_user(
-                user=post.client,
-                title="Post Resubmitted for Your Approval",
-                message=f"The post '{post.title}' has been resubmitted and is pending your approval. Please review and approve or reject it.",
-                type="post_pending_approval",
+            notifications.append(
+                Notification(
+                    recipient=post.client,
+                    title="Post Resubmitted for Your Approval",
+                    message=f"The post '{post.title}' has been resubmitted and is pending your approval. Please review and approve or reject it.",
+                    type="post_pending_approval",
+                )
             )
-
-            # Send email notification to client
-            from apps.accounts.tasks import send_celery_email
-
-            send_celery_email.delay(
-                "Post Resubmitted for Your Approval",
-                f'Hello {post.client.full_name or post.client.email}, The post titled "{post.title}" has been resubmitted and is now pending your approval. Please log in to review and approve or reject this post.',
-                [post.client.email],
-                fail_silently=False,
+            # Mailed with the notification, so it is digested along with it
+            emails.append(
+                f'Hello {post.client.full_name or post.client.email}, The post titled "{post.title}" has been resubmitted and is now pending your approval. Please log in to review and approve or reject this post.'
             )
 
         # Notify moderators about resubmission (avoid double notification if creator is the assigned moderator)
@@ -1322,12 +1333,17 @@ class ResubmitPostView(APIView):
             and post.client.assigned_moderator
             and post.client.assigned_moderator != post.creator
         ):
-            notify_user(
-                user=post.client.assigned_moderator,
-                title="Post Resubmitted",
-                message=f"The post '{post.title}' has been resubmitted for review.",
-                type="post_resubmitted",
+            notifications.append(
+                Notification(
+                    recipient=post.client.assigned_moderator,
+                    title="Post Resubmitted",
+                    message=f"The post '{post.title}' has been resubmitted for review.",
+                    type="post_resubmitted",
+                )
             )
+            emails.append(None)
+
+        send_notifications(notifications, emails=emails)
 
         response_data = {
             "message": "Post resubmitted successfully.",
@@ -1381,23 +1397,17 @@ class CancelApprovalView(APIView):
         invalidate_cache(Post)
         invalidate_cache(Post, post_id)
 
-        # Notify the creator about cancellation
-        if post.creator and post.creator != request.user:
-            notify_user(
-                user=post.creator,
-                title="Post Approval Cancelled",
-                message=f"The approval for post '{post.title}' has been cancelled. Feedback: {feedback}",
-                type="post_approval_cancelled",
-            )
-
-        # Notify the client about cancellation
-        if post.client and post.client != request.user:
-            notify_user(
-                user=post.client,
-                title="Post Approval Cancelled",
-                message=f"The approval for post '{post.title}' has been cancelled. Feedback: {feedback}",
-                type="post_approval_cancelled",
-            )
+        # Notify the creator and the client about cancellation
+        notify_users(
+            [
+                user
+                for user in (post.creator, post.client)
+                if user and user != request.user
+            ],
+            title="Post Approval Cancelled",
+            message=f"The approval for post '{post.title}' has been cancelled. Feedback: {feedback}",
+            type="post_approval_cancelled",
+        )
 
         response_data = {
             "message": "Post approval cancelled successfully.",
@@ -1475,6 +1485,8 @@ class ModeratorValidatePostView(APIView):
         invalidate_cache(Post)
         invalidate_cache(Post, post_id)
 
+        notifications = []
+
         # Notifications
         validation_message = (
             f"Post '{post.title}' validated by moderator and scheduled."
@@ -1484,20 +1496,24 @@ class ModeratorValidatePostView(APIView):
 
         # Notify the creator
         if post.creator and post.creator != request.user:
-            notify_user(
-                user=post.creator,
-                title="Post Validated",
-                message=validation_message,
-                type="post_validated",
+            notifications.append(
+                Notification(
+                    recipient=post.creator,
+                    title="Post Validated",
+                    message=validation_message,
+                    type="post_validated",
+                )
             )
 
         # Notify the client
         if post.client and post.client != request.user:
-            notify_user(
-                user=post.client,
-                title="Post Validated",
-                message=validation_message,
-                type="post_validated",
+            notifications.append(
+                Notification(
+                    recipient=post.client,
+                    title="Post Validated",
+                    message=validation_message,
+                    type="post_validated",
+                )
             )
 
         # Notify assigned moderator when admin validates the post (avoid notifying if they are the creator)
@@ -1513,13 +1529,17 @@ class ModeratorValidatePostView(APIView):
             )
             if feedback:
                 admin_validation_message += f" Admin feedback: {feedback}"
-            notify_user(
-                user=post.client.assigned_moderator,
-                title="Post Validated by Admin",
-                message=admin_validation_message,
-                type="post_validated",
+            notifications.append(
+                Notification(
+                    recipient=post.client.assigned_moderator,
+                    title="Post Validated by Admin",
+                    message=admin_validation_message,
+                    type="post_validated",
+                )
             )
 
+        send_notifications(notifications)
+
         response_data = {
             "message": "Post validated successfully.",
             "post": PostSerializer(post).data,
@@ -1,8 +1,7 @@
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.core.cache import cache
-from .models import Notification
+from . import services
 
 
 class NotificationConsumer(AsyncWebsocketConsumer):
@@ -62,66 +61,23 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             )
         )
 
-        # Update and send the new unread count
-        unread_count = await self.get_unread_count(self.user.id)
+        # The sender includes the new unread count, only look it up if missing
+        unread_count = event.get("unread_count")
+        if unread_count is None:
+            unread_count = await self.get_unread_count(self.user.id)
         await self.send(
             text_data=json.dumps({"type": "notification_count", "count": unread_count})
         )
 
     @database_sync_to_async
     def get_unread_count(self, user_id):
-        # Try to get count from cache
-        cache_key = f"user_unread_count:{user_id}"
-        cached_count = cache.get(cache_key)
-
-        if cached_count is not None:
-            return cached_count
-
-        # If not in cache, get from database and cache it
-        unread_count = Notification.objects.filter(
-            recipient_id=user_id, is_read=False
-        ).count()
-        cache.set(cache_key, unread_count, 3600)  # Cache for 1 hour
-
-        return unread_count
+        # Served from the Redis counter, the database is only hit on a miss
+        return services.get_unread_notification_count(user_id)
 
     @database_sync_to_async
     def mark_notification_read(self, notification_id):
-        try:
-            notification = Notification.objects.get(
-                id=notification_id, recipient=self.user
-            )
-            if not notification.is_read:
-                notification.is_read = True
-                notification.save()
-
-                # Invalidate user notifications cache
-                cache_key = f"user_notifications:{self.user.id}"
-                cache.delete(cache_key)
-
-                # Update unread count cache
-                unread_count = Notification.objects.filter(
-                    recipient=self.user, is_read=False
-                ).count()
-                cache.set(f"user_unread_count:{self.user.id}", unread_count, 3600)
-
-                return True
-            return False
-        except Notification.DoesNotExist:
-            return False
+        return services.mark_notification_read(notification_id, user=self.user)
 
     @database_sync_to_async
     def mark_all_read(self):
-        count = Notification.objects.filter(recipient=self.user, is_read=False).update(
-            is_read=True
-        )
-
-        if count > 0:
-            # Invalidate user notifications cache
-            cache_key = f"user_notifications:{self.user.id}"
-            cache.delete(cache_key)
-
-            # Update unread count cache
-            cache.set(f"user_unread_count:{self.user.id}", 0, 3600)
-
-        return count
+        return services.mark_all_read(self.user)
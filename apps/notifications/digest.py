@@ -0,0 +1,256 @@
+"""
+Digesting of bursty notifications.
+
+Types listed in ``settings.NOTIFICATION_DIGEST_RULES`` are rate-collapsed per
+(recipient, type): the first notification of a burst is delivered right
+away and opens a window, anything arriving while the window is open is
+buffered in Redis and delivered as a single collapsed notification (one
+database row, one WebSocket event and one email) when the window closes.
+
+A buffer is only trimmed once its records are delivered, and a failed
+delivery is retried. A marker key records that a flush is scheduled. Any
+push that finds no marker schedules a flush, so a lost task holds a buffer
+back for at most ``DIGEST_FLUSH_GRACE`` seconds. Buffers expire that long
+after their last push, so nothing is kept forever.
+
+Example rule::
+
+    NOTIFICATION_DIGEST_RULES = {
+        "post_approved": {"window": 300, "title": "{count} posts approved"},
+    }
+"""
+
+import json
+import logging
+
+from django.conf import settings
+
+from apps.notifications.models import Notification
+from planit.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIGEST_TITLE = "{count} new notifications"
+
+# Seconds a buffer and its flush marker outlive the scheduled flush
+DIGEST_FLUSH_GRACE = 300
+
+# Seconds before a digest whose delivery failed is tried again
+DIGEST_RETRY_DELAY = 60
+
+
+def get_digest_rule(notification_type):
+    return getattr(settings, "NOTIFICATION_DIGEST_RULES", {}).get(notification_type)
+
+
+def _window_key(user_id, notification_type):
+    return f"notification_digest_window:{user_id}:{notification_type}"
+
+
+def _buffer_key(user_id, notification_type):
+    return f"notification_digest:{user_id}:{notification_type}"
+
+
+def _scheduled_key(user_id, notification_type):
+    return f"notification_digest_scheduled:{user_id}:{notification_type}"
+
+
+def defer_notifications(items):
+    """
+    Buffer the items that fall inside an open digest window.
+
+    ``items`` is a list of ``(notification, email)`` pairs of unsaved
+    notifications and optional email bodies. Returns the pairs that must be
+    delivered now; the others are flushed later by
+    ``flush_notification_digest``. If Redis is unavailable nothing is held
+    back.
+    """
+    digested = [item for item in items if get_digest_rule(item[0].type) is not None]
+    if not digested:
+        return items
+
+    try:
+        redis_conn = get_redis()
+
+        # Opening a window claims the right to deliver immediately
+        pipe = redis_conn.pipeline()
+        for notification, _ in digested:
+            rule = get_digest_rule(notification.type)
+            pipe.set(
+                _window_key(notification.recipient_id, notification.type),
+                1,
+                ex=rule["window"],
+                nx=True,
+            )
+        opened = pipe.execute()
+
+        buffered = [item for item, is_open in zip(digested, opened) if not is_open]
+        records = [
+            json.dumps(
+                {
+                    "title": notification.title,
+                    "message": notification.message,
+                    "url": notification.url or "",
+                    "email": email,
+                }
+            )
+            for notification, email in buffered
+        ]
+        claimed = []
+        if buffered:
+            pipe = redis_conn.pipeline()
+            for (notification, _), record in zip(buffered, records):
+                timeout = get_digest_rule(notification.type)["window"]
+                timeout += DIGEST_FLUSH_GRACE
+                key = _buffer_key(notification.recipient_id, notification.type)
+                pipe.rpush(key, record)
+                pipe.expire(key, timeout)
+                pipe.set(
+                    _scheduled_key(notification.recipient_id, notification.type),
+                    1,
+                    ex=timeout,
+                    nx=True,
+                )
+            claimed = pipe.execute()[2::3]
+    except Exception as e:
+        logger.warning(f"Error buffering notification digest: {e}")
+        return items
+
+    # An item that finds no flush scheduled schedules one
+    from apps.notifications.tasks import flush_notification_digest
+
+    unscheduled = []
+    for item, record, is_claimed in zip(buffered, records, claimed):
+        if not is_claimed:
+            continue
+        notification = item[0]
+        try:
+            flush_notification_digest.apply_async(
+                (notification.recipient_id, notification.type),
+                countdown=get_digest_rule(notification.type)["window"],
+            )
+        except Exception as e:
+            logger.warning(f"Error scheduling notification digest: {e}")
+            unscheduled.append((item, record))
+
+    if unscheduled:
+        # Nothing would flush these buffers, deliver the item now and close
+        # the window so the rest of the burst isn't buffered behind it
+        try:
+            pipe = redis_conn.pipeline()
+            for (notification, _), record in unscheduled:
+                pipe.lrem(
+                    _buffer_key(notification.recipient_id, notification.type),
+                    1,
+                    record,
+                )
+                pipe.delete(
+                    _window_key(notification.recipient_id, notification.type),
+                    _scheduled_key(notification.recipient_id, notification.type),
+                )
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Error releasing notification digest: {e}")
+        unscheduled_ids = {id(item) for item, _ in unscheduled}
+        buffered = [item for item in buffered if id(item) not in unscheduled_ids]
+
+    buffered_ids = {id(item) for item in buffered}
+    return [item for item in items if id(item) not in buffered_ids]
+
+
+def _schedule_flush(redis_conn, user_id, notification_type, countdown):
+    """Schedule another flush of a buffer, e.g. after a failed delivery"""
+    from apps.notifications.tasks import flush_notification_digest
+
+    try:
+        flush_notification_digest.apply_async(
+            (user_id, notification_type), countdown=countdown
+        )
+        pipe = redis_conn.pipeline()
+        pipe.set(
+            _scheduled_key(user_id, notification_type),
+            1,
+            ex=countdown + DIGEST_FLUSH_GRACE,
+        )
+        pipe.expire(
+            _buffer_key(user_id, notification_type), countdown + DIGEST_FLUSH_GRACE
+        )
+        pipe.execute()
+    except Exception as e:
+        # The next push finds no marker and schedules the flush
+        logger.warning(f"Error rescheduling notification digest: {e}")
+
+
+def flush_digest(user_id, notification_type):
+    """
+    Deliver everything buffered for (user, type) as one notification. The
+    records are only removed once delivered; if delivery fails they are
+    kept, a retry is scheduled and the error is raised.
+
+    Returns the delivered notification, or ``None`` if the buffer was empty.
+    """
+    rule = get_digest_rule(notification_type) or {}
+    redis_conn = get_redis()
+    key = _buffer_key(user_id, notification_type)
+    records = [json.loads(record) for record in redis_conn.lrange(key, 0, -1)]
+    if not records:
+        redis_conn.delete(_scheduled_key(user_id, notification_type))
+        return None
+
+    # Keep collapsing while the burst goes on
+    if rule.get("window"):
+        redis_conn.set(_window_key(user_id, notification_type), 1, ex=rule["window"])
+
+    try:
+        notification = _deliver_digest(user_id, notification_type, rule, records)
+    except Exception as e:
+        logger.error(f"Error delivering notification digest: {e}")
+        _schedule_flush(redis_conn, user_id, notification_type, DIGEST_RETRY_DELAY)
+        raise
+
+    # Only the delivered records, others may have been pushed meanwhile
+    pipe = redis_conn.pipeline()
+    pipe.ltrim(key, len(records), -1)
+    pipe.delete(_scheduled_key(user_id, notification_type))
+    pipe.llen(key)
+    _, _, remaining = pipe.execute()
+    if remaining:
+        _schedule_flush(redis_conn, user_id, notification_type, rule.get("window") or 0)
+    return notification
+
+
+def _deliver_digest(user_id, notification_type, rule, records):
+    from apps.accounts.models import User
+    from apps.accounts.tasks import send_celery_email
+    from apps.notifications.services import send_notifications
+
+    user = User.objects.filter(id=user_id).first()
+    if user is None:
+        return None
+
+    if len(records) == 1:
+        title = records[0]["title"]
+        message = records[0]["message"]
+    else:
+        title = rule.get("title", DEFAULT_DIGEST_TITLE).format(count=len(records))
+        message = "\n".join(record["message"] for record in records)
+    urls = {record["url"] for record in records}
+
+    (notification,) = send_notifications(
+        [
+            Notification(
+                recipient=user,
+                title=title,
+                message=message,
+                type=notification_type,
+                url=urls.pop() if len(urls) == 1 else "",
+            )
+        ],
+        digest=False,
+    )
+
+    emails = [record["email"] for record in records if record["email"]]
+    if emails and user.email:
+        send_celery_email.delay(title, "\n\n".join(emails), [user.email])
+
+    return notification
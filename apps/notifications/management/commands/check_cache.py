@@ -2,6 +2,8 @@ from django.core.management.base import BaseCommand
 from django.core.cache import cache
 from apps.accounts.models import User
 from apps.notifications.models import Notification
+from apps.notifications.services import NOTIFICATION_FEED_SIZE
+from django_redis import get_redis_connection
 import json
 
 
@@ -56,47 +58,56 @@ class Command(BaseCommand):
             )
             return
 
-        # Check notification cache
-        cache_key = f"user_notifications:{user_id}"
-        cached_notifications = cache.get(cache_key)
-
+        # Check notification feed cache
         db_notifications = Notification.objects.filter(recipient_id=user_id).order_by(
             "-created_at"
         )
 
-        if cached_notifications is not None:
-            try:
-                num_cached = len(cached_notifications)
+        try:
+            redis_conn = get_redis_connection("default")
+            num_cached = redis_conn.llen(f"notification_feed:{user_id}")
+            if num_cached:
                 self.stdout.write(
                     self.style.SUCCESS(
-                        f"Notification cache exists! Contains {num_cached} notifications"
+                        f"Notification feed exists! Contains {num_cached} notifications"
                     )
                 )
 
-                # Compare with DB
-                num_db = db_notifications.count()
-                if num_cached == num_db:
+                # Compare with DB, the feed only holds the most recent ones
+                num_expected = min(db_notifications.count(), NOTIFICATION_FEED_SIZE)
+                if num_cached == num_expected:
                     self.stdout.write(
                         self.style.SUCCESS(
-                            f"Cache count matches database count: {num_db}"
+                            f"Feed size matches database: {num_expected}"
                         )
                     )
                 else:
                     self.stdout.write(
                         self.style.WARNING(
-                            f"Cache count ({num_cached}) doesn't match database ({num_db})"
+                            f"Feed size ({num_cached}) doesn't match database ({num_expected})"
                         )
                     )
-            except Exception as e:
+            else:
                 self.stdout.write(
-                    self.style.ERROR(f"Error accessing cached notifications: {str(e)}")
+                    self.style.WARNING("Notification feed does not exist")
                 )
-        else:
-            self.stdout.write(self.style.WARNING("Notification cache does not exist"))
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f"Error accessing notification feed: {str(e)}")
+            )
 
         # Check unread count cache
-        unread_key = f"user_unread_count:{user_id}"
-        cached_unread = cache.get(unread_key)
+        try:
+            cached_unread = get_redis_connection("default").get(
+                f"notification_unread_count:{user_id}"
+            )
+            if cached_unread is not None:
+                cached_unread = int(cached_unread)
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f"Error accessing unread count: {str(e)}")
+            )
+            cached_unread = None
         db_unread = db_notifications.filter(is_read=False).count()
 
         if cached_unread is not None:
@@ -2,6 +2,11 @@ from django.core.management.base import BaseCommand
 from django.core.cache import cache
 from apps.accounts.models import User
 from apps.notifications.models import Notification
+from apps.notifications.services import (
+    clear_notification_feed,
+    get_notification_feed,
+    set_unread_count,
+)
 from apps.accounts.services import get_cached_user_data
 from apps.accounts.serializers import GetUserSerializer
 
@@ -52,18 +57,18 @@ class Command(BaseCommand):
             cache.set(f"user_fullname:{user_id}", full_name, 3600)
             self.stdout.write(self.style.SUCCESS(f"✓ Cached user full name"))
 
-            # Cache notifications
-            notifications = Notification.objects.filter(recipient=user).order_by(
-                "-created_at"
-            )
-            cache.set(f"user_notifications:{user_id}", notifications, 3600)
+            # Rebuild the notification feed
+            clear_notification_feed(user_id)
+            feed = get_notification_feed(user_id)
             self.stdout.write(
-                self.style.SUCCESS(f"✓ Cached {notifications.count()} notifications")
+                self.style.SUCCESS(f"✓ Cached {len(feed)} notifications in feed")
             )
 
-            # Cache unread count
-            unread_count = notifications.filter(is_read=False).count()
-            cache.set(f"user_unread_count:{user_id}", unread_count, 3600)
+            # Seed the unread counter
+            unread_count = Notification.objects.filter(
+                recipient=user, is_read=False
+            ).count()
+            set_unread_count(user_id, unread_count)
             self.stdout.write(
                 self.style.SUCCESS(f"✓ Cached unread count: {unread_count}")
             )
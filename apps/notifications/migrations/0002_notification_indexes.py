@@ -0,0 +1,62 @@
+# Generated by Django 4.2.25 on 2026-10-19 07:03
+
+from django.db import migrations, models
+
+INDEXES = [
+    models.Index(
+        fields=["recipient", "-created_at"], name="notif_recipient_created_idx"
+    ),
+    models.Index(
+        condition=models.Q(("is_read", False)),
+        fields=["recipient"],
+        name="notif_recipient_unread_idx",
+    ),
+    models.Index(
+        condition=models.Q(("is_read", True)),
+        fields=["created_at"],
+        name="notif_read_created_idx",
+    ),
+]
+
+
+def add_indexes(apps, schema_editor):
+    model = apps.get_model("notifications", "Notification")
+    # PostgreSQL builds them without locking the table against writes,
+    # other databases (SQLite in tests) the plain way
+    concurrently = schema_editor.connection.vendor == "postgresql"
+    for index in INDEXES:
+        if concurrently:
+            schema_editor.add_index(model, index, concurrently=True)
+        else:
+            schema_editor.add_index(model, index)
+
+
+def remove_indexes(apps, schema_editor):
+    model = apps.get_model("notifications", "Notification")
+    concurrently = schema_editor.connection.vendor == "postgresql"
+    for index in INDEXES:
+        if concurrently:
+            schema_editor.remove_index(model, index, concurrently=True)
+        else:
+            schema_editor.remove_index(model, index)
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ("notifications", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(add_indexes, remove_indexes),
+            ],
+            state_operations=[
+                migrations.AddIndex(model_name="notification", index=index)
+                for index in INDEXES
+            ],
+        ),
+    ]
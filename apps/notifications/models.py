@@ -17,3 +17,22 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # Per-recipient feed, newest first
+            models.Index(
+                fields=["recipient", "-created_at"],
+                name="notif_recipient_created_idx",
+            ),
+            # Unread counts only ever touch the (small) unread subset
+            models.Index(
+                fields=["recipient"],
+                condition=models.Q(is_read=False),
+                name="notif_recipient_unread_idx",
+            ),
+            # Retention scans over read notifications by age
+            models.Index(
+                fields=["created_at"],
+                condition=models.Q(is_read=True),
+                name="notif_read_created_idx",
+            ),
+        ]
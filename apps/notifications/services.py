@@ -1,65 +1,526 @@
+import asyncio
+import json
+import logging
+from datetime import timedelta
+
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
+from apps.accounts.tasks import send_celery_email
+from apps.notifications.digest import defer_notifications
 from apps.notifications.models import Notification
+from apps.notifications.serializers import NotificationSerializer
+from django.conf import settings
+from django.db.models import Count
 from django.utils import timezone
-from django.core.cache import cache
+from planit.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
 
 # Cache timeout in seconds (1 hour)
 NOTIFICATION_CACHE_TIMEOUT = 3600
 
+# Number of most recent notifications kept in a user's cached feed
+NOTIFICATION_FEED_SIZE = getattr(settings, "NOTIFICATION_FEED_SIZE", 50)
 
-def notify_user(user, title, message, url="", type="general"):
-    # Create notification record in database
-    notification = Notification.objects.create(
+# Read notifications older than this are deleted by the retention task
+NOTIFICATION_RETENTION_DAYS = getattr(settings, "NOTIFICATION_RETENTION_DAYS", 30)
+
+# Rows deleted per statement, keeps each DELETE short and its locks small
+NOTIFICATION_DELETE_BATCH_SIZE = getattr(
+    settings, "NOTIFICATION_DELETE_BATCH_SIZE", 1000
+)
+
+# Placeholder written over feed entries before they are removed with LREM
+_FEED_TOMBSTONE = "__deleted__"
+
+# Adjusts an unread counter only if it is already seeded, so a missing
+# counter is recomputed from the database instead of starting from zero.
+# A negative result means the counter drifted and it is dropped as well.
+_ADJUST_UNREAD_COUNT_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return nil
+end
+local count = redis.call("INCRBY", KEYS[1], ARGV[1])
+if count < 0 then
+    redis.call("DEL", KEYS[1])
+    return nil
+end
+return count
+"""
+
+# Installs a rebuilt feed only if no write reached the feed since the
+# rebuild read its version, else the rebuild's snapshot may be missing it
+_STORE_FEED_SCRIPT = """
+if (redis.call("GET", KEYS[2]) or "0") ~= ARGV[1] then
+    return 0
+end
+redis.call("DEL", KEYS[1])
+redis.call("RPUSH", KEYS[1], unpack(ARGV, 3))
+redis.call("EXPIRE", KEYS[1], ARGV[2])
+return 1
+"""
+
+
+def _feed_key(user_id):
+    return f"notification_feed:{user_id}"
+
+
+def _feed_version_key(user_id):
+    return f"notification_feed_version:{user_id}"
+
+
+def _queue_feed_version_bump(pipe, user_id):
+    """Fail any rebuild of the feed that is in progress"""
+    key = _feed_version_key(user_id)
+    pipe.incr(key)
+    pipe.expire(key, NOTIFICATION_CACHE_TIMEOUT)
+
+
+def _feed_record(notification):
+    """Compact JSON record stored in the feed, same shape as the API output"""
+    return json.dumps(NotificationSerializer(notification).data)
+
+
+def get_notification_feed(user_id):
+    """
+    Return the user's most recent notifications as a list of dicts.
+
+    The feed is a capped Redis list of compact records, newest first. On a
+    miss it is rebuilt from the database; if Redis is unavailable the
+    database result is returned directly. Every write to a feed bumps its
+    version, and a rebuild is only stored if the version it started from
+    is still current.
+    """
+    key = _feed_key(user_id)
+    try:
+        redis_conn = get_redis()
+        pipe = redis_conn.pipeline(transaction=False)
+        pipe.lrange(key, 0, -1)
+        pipe.get(_feed_version_key(user_id))
+        records, version = pipe.execute()
+        if records:
+            return [json.loads(record) for record in records]
+    except Exception as e:
+        logger.warning(f"Error reading notification feed for user {user_id}: {e}")
+        redis_conn = None
+
+    notifications = Notification.objects.filter(recipient_id=user_id).order_by(
+        "-created_at"
+    )[:NOTIFICATION_FEED_SIZE]
+    records = [_feed_record(notification) for notification in notifications]
+
+    if records and redis_conn is not None:
+        try:
+            redis_conn.eval(
+                _STORE_FEED_SCRIPT,
+                2,
+                key,
+                _feed_version_key(user_id),
+                (version or b"0").decode(),
+                NOTIFICATION_CACHE_TIMEOUT,
+                *records,
+            )
+        except Exception as e:
+            logger.warning(f"Error caching notification feed for user {user_id}: {e}")
+
+    return [json.loads(record) for record in records]
+
+
+def _queue_feed_push(pipe, notification):
+    key = _feed_key(notification.recipient_id)
+    # LPUSHX only touches feeds that already exist, a missing feed is
+    # rebuilt from the database on the next read.
+    pipe.lpushx(key, _feed_record(notification))
+    pipe.ltrim(key, 0, NOTIFICATION_FEED_SIZE - 1)
+    pipe.expire(key, NOTIFICATION_CACHE_TIMEOUT)
+    _queue_feed_version_bump(pipe, notification.recipient_id)
+
+
+def push_to_feed(notification):
+    """Prepend a new notification to its recipient's cached feed, if cached"""
+    try:
+        pipe = get_redis().pipeline()
+        _queue_feed_push(pipe, notification)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(
+            f"Error updating notification feed for user {notification.recipient_id}: {e}"
+        )
+
+
+def _update_feed(user_id, update):
+    """
+    Apply ``update`` to every record of a cached feed in a single transaction.
+
+    ``update`` receives a record dict and returns the record to store, or
+    ``None`` to drop it from the feed. Unchanged records are not rewritten.
+    """
+    key = _feed_key(user_id)
+
+    def apply(pipe):
+        raw_records = pipe.lrange(key, 0, -1)
+        pipe.multi()
+        removed = False
+        for index, raw_record in enumerate(raw_records):
+            record = json.loads(raw_record)
+            updated = update(dict(record))
+            if updated is None:
+                pipe.lset(key, index, _FEED_TOMBSTONE)
+                removed = True
+            elif updated != record:
+                pipe.lset(key, index, json.dumps(updated))
+        if removed:
+            pipe.lrem(key, 0, _FEED_TOMBSTONE)
+
+    try:
+        redis_conn = get_redis()
+        pipe = redis_conn.pipeline(transaction=False)
+        _queue_feed_version_bump(pipe, user_id)
+        pipe.execute()
+        redis_conn.transaction(apply, key)
+    except Exception as e:
+        # A stale feed is worse than a missing one, drop it so it gets rebuilt
+        logger.warning(f"Error updating notification feed for user {user_id}: {e}")
+        clear_notification_feed(user_id)
+
+
+def mark_feed_read(user_id, notification_ids=None):
+    """Flag feed records as read in place. ``None`` marks the whole feed."""
+    if notification_ids is not None:
+        notification_ids = {
+            int(notification_id) for notification_id in notification_ids
+        }
+
+    def mark_read(record):
+        if notification_ids is None or record["id"] in notification_ids:
+            record["is_read"] = True
+        return record
+
+    _update_feed(user_id, mark_read)
+
+
+def replace_in_feed(notification):
+    """Overwrite the cached record of an edited notification"""
+    new_record = json.loads(_feed_record(notification))
+
+    def replace(record):
+        return new_record if record["id"] == notification.id else record
+
+    _update_feed(notification.recipient_id, replace)
+
+
+def remove_from_feed(user_id, notification_id):
+    """Drop a deleted notification from the cached feed"""
+    notification_id = int(notification_id)
+
+    def remove(record):
+        return None if record["id"] == notification_id else record
+
+    _update_feed(user_id, remove)
+
+
+def clear_notification_feed(user_id):
+    clear_notification_feeds([user_id])
+
+
+def clear_notification_feeds(user_ids):
+    """Drop the feeds of users, each is rebuilt on its next read"""
+    if not user_ids:
+        return
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.delete(_feed_key(user_id))
+            _queue_feed_version_bump(pipe, user_id)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Error clearing notification feeds of {user_ids}: {e}")
+
+
+def _unread_count_key(user_id):
+    return f"notification_unread_count:{user_id}"
+
+
+def get_unread_notification_count(user_id):
+    """
+    Get the number of unread notifications for a user.
+
+    Counts are kept as Redis integers updated with INCRBY/DECRBY by the
+    notification services; the database is only counted on a miss.
+    """
+    key = _unread_count_key(user_id)
+    try:
+        redis_conn = get_redis()
+        cached_count = redis_conn.get(key)
+        if cached_count is not None:
+            return int(cached_count)
+    except Exception as e:
+        logger.warning(f"Error reading unread count for user {user_id}: {e}")
+        redis_conn = None
+
+    unread_count = Notification.objects.filter(
+        recipient_id=user_id, is_read=False
+    ).count()
+
+    if redis_conn is not None:
+        try:
+            # nx: never overwrite a counter seeded concurrently
+            redis_conn.set(key, unread_count, ex=NOTIFICATION_CACHE_TIMEOUT, nx=True)
+        except Exception as e:
+            logger.warning(f"Error caching unread count for user {user_id}: {e}")
+
+    return unread_count
+
+
+def adjust_unread_count(user_id, delta):
+    """
+    Atomically add ``delta`` to a user's unread counter.
+
+    Returns the new count, or ``None`` if the counter is not cached.
+    """
+    try:
+        redis_conn = get_redis()
+        adjust = redis_conn.register_script(_ADJUST_UNREAD_COUNT_SCRIPT)
+        count = adjust(keys=[_unread_count_key(user_id)], args=[delta])
+    except Exception as e:
+        logger.warning(f"Error adjusting unread count for user {user_id}: {e}")
+        return None
+    return None if count is None else int(count)
+
+
+def set_unread_count(user_id, count):
+    try:
+        get_redis().set(
+            _unread_count_key(user_id), count, ex=NOTIFICATION_CACHE_TIMEOUT
+        )
+    except Exception as e:
+        logger.warning(f"Error setting unread count for user {user_id}: {e}")
+
+
+def reconcile_unread_counts(batch_size=500):
+    """
+    Correct cached unread counters that drifted from the database.
+
+    Only users with a live counter are checked, one grouped COUNT query per
+    batch. Returns the number of counters that were corrected.
+    """
+    redis_conn = get_redis()
+    user_ids = [
+        int(key.rsplit(b":", 1)[1])
+        for key in redis_conn.scan_iter(match=_unread_count_key("*"), count=batch_size)
+    ]
+
+    corrected = 0
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start : start + batch_size]
+        keys = [_unread_count_key(user_id) for user_id in batch]
+
+        db_counts = dict(
+            Notification.objects.filter(recipient_id__in=batch, is_read=False)
+            .values("recipient_id")
+            .annotate(count=Count("id"))
+            .values_list("recipient_id", "count")
+        )
+
+        pipe = redis_conn.pipeline()
+        for user_id, key, cached_count in zip(batch, keys, redis_conn.mget(keys)):
+            unread_count = db_counts.get(user_id, 0)
+            if cached_count is not None and int(cached_count) != unread_count:
+                # xx: counters that expired meanwhile are left to be reseeded
+                pipe.set(key, unread_count, ex=NOTIFICATION_CACHE_TIMEOUT, xx=True)
+                corrected += 1
+        pipe.execute()
+
+    if corrected:
+        logger.info(f"Reconciled {corrected} unread notification counters")
+    return corrected
+
+
+def _notification_payload(notification):
+    """Notification data sent through the WebSocket"""
+    return {
+        "id": notification.id,
+        "title": notification.title,
+        "message": notification.message,
+        "type": notification.type,
+        "url": notification.url,
+        "is_read": False,
+        "created_at": notification.created_at.isoformat(),
+    }
+
+
+def _seed_unread_counts(redis_conn, user_ids):
+    """Count unread notifications for cold counters with one grouped query"""
+    db_counts = dict(
+        Notification.objects.filter(recipient_id__in=user_ids, is_read=False)
+        .values("recipient_id")
+        .annotate(count=Count("id"))
+        .values_list("recipient_id", "count")
+    )
+    counts = {user_id: db_counts.get(user_id, 0) for user_id in user_ids}
+
+    if redis_conn is not None:
+        try:
+            pipe = redis_conn.pipeline()
+            for user_id, unread_count in counts.items():
+                pipe.set(
+                    _unread_count_key(user_id),
+                    unread_count,
+                    ex=NOTIFICATION_CACHE_TIMEOUT,
+                    nx=True,
+                )
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Error caching unread counts: {e}")
+
+    return counts
+
+
+def send_notifications(notifications, digest=True, emails=None):
+    """
+    Save and deliver a batch of unsaved ``Notification`` instances.
+
+    Rows are inserted with one ``bulk_create``, feeds and unread counters are
+    updated in a single Redis pipeline and the WebSocket events are sent
+    concurrently, so the number of round-trips does not grow with the number
+    of recipients. Notifications held back by a digest rule are delivered
+    later, only the saved notifications are returned.
+
+    ``emails`` optionally holds an email body per notification, mailed to
+    its recipient with the notification (and digested along with it).
+    """
+    items = list(zip(notifications, emails or [None] * len(notifications)))
+    if digest:
+        items = defer_notifications(items)
+    if not items:
+        return []
+    notifications = [notification for notification, _ in items]
+
+    notifications = Notification.objects.bulk_create(notifications)
+
+    # Number of new notifications per recipient, in order of appearance
+    new_counts = {}
+    for notification in notifications:
+        new_counts[notification.recipient_id] = (
+            new_counts.get(notification.recipient_id, 0) + 1
+        )
+
+    unread_counts = {}
+    try:
+        redis_conn = get_redis()
+        adjust = redis_conn.register_script(_ADJUST_UNREAD_COUNT_SCRIPT)
+        pipe = redis_conn.pipeline()
+        for notification in notifications:
+            _queue_feed_push(pipe, notification)
+        for user_id, delta in new_counts.items():
+            adjust(keys=[_unread_count_key(user_id)], args=[delta], client=pipe)
+        # The counter results are the last len(new_counts) replies
+        results = pipe.execute()[-len(new_counts) :]
+        for user_id, count in zip(new_counts, results):
+            if count is not None:
+                unread_counts[user_id] = int(count)
+    except Exception as e:
+        logger.warning(f"Error updating notification cache: {e}")
+        redis_conn = None
+
+    cold_user_ids = [user_id for user_id in new_counts if user_id not in unread_counts]
+    if cold_user_ids:
+        unread_counts.update(_seed_unread_counts(redis_conn, cold_user_ids))
+
+    # Each event carries the recipient's count as of the last notification
+    events = [
+        (
+            f"user_{notification.recipient_id}",
+            {
+                "type": "send_notification",
+                "content": _notification_payload(notification),
+                "unread_count": unread_counts[notification.recipient_id],
+            },
+        )
+        for notification in notifications
+    ]
+
+    channel_layer = get_channel_layer()
+
+    async def send_all():
+        await asyncio.gather(
+            *(channel_layer.group_send(group, event) for group, event in events)
+        )
+
+    async_to_sync(send_all)()
+
+    for notification, email in items:
+        if email and notification.recipient.email:
+            send_celery_email.delay(
+                notification.title,
+                email,
+                [notification.recipient.email],
+                fail_silently=False,
+            )
+
+    return notifications
+
+
+def notify_users(recipients, title, message, url="", type="general"):
+    """Send the same notification to several users, skipping duplicates"""
+    unique_recipients = {}
+    for user in recipients:
+        if user is not None:
+            unique_recipients.setdefault(user.id, user)
+
+    return send_notifications(
+        [
+            Notification(
+                recipient=user, title=title, message=message, type=type, url=url
+            )
+            for user in unique_recipients.values()
+        ]
+    )
+
+
+def notify_user(user, title, message, url="", type="general", email=None):
+    """
+    Notify a single user, optionally mailing them ``email`` as well.
+
+    Returns the notification, or ``None`` if it was held back to be
+    delivered with a digest of the same type.
+    """
+    notification = Notification(
         recipient=user,
         title=title,
         message=message,
         type=type,
         url=url,
-        created_at=timezone.now(),
         is_read=False,
     )
+    if not defer_notifications([(notification, email)]):
+        return None
 
-    # Handle notification cache update
-    cache_key = f"user_notifications:{user.id}"
-    cached_notifications = cache.get(cache_key)
+    # Create notification record in database
+    notification.save()
 
-    if cached_notifications is not None:
-        # If notifications are cached, add the new one to the cache instead of invalidating
-        try:
-            # Add new notification to the cached queryset
-            cached_notifications._result_cache.insert(0, notification)
-            cache.set(cache_key, cached_notifications, NOTIFICATION_CACHE_TIMEOUT)
-            print(f"Added notification to cache for user {user.id}")
-        except (AttributeError, TypeError):
-            # If we can't modify the cache, invalidate it
-            cache.delete(cache_key)
-            print(f"Failed to update cache, invalidated for user {user.id}")
-    else:
-        print(f"No cached notifications found for user {user.id}")
-
-    # Update unread count cache
-    unread_count = Notification.objects.filter(recipient=user, is_read=False).count()
-    cache.set(f"user_unread_count:{user.id}", unread_count, NOTIFICATION_CACHE_TIMEOUT)
-    print(f"Updated unread count cache for user {user.id}: {unread_count}")
-
-    # Prepare notification data to send through WebSocket
-    notification_data = {
-        "id": notification.id,
-        "title": title,
-        "message": message,
-        "type": type,
-        "url": url,
-        "is_read": False,
-        "created_at": notification.created_at.isoformat(),
-    }
+    # Add the new notification to the cached feed
+    push_to_feed(notification)
+
+    # Bump the unread counter, seeding it from the database if it is cold
+    unread_count = adjust_unread_count(user.id, 1)
+    if unread_count is None:
+        unread_count = get_unread_notification_count(user.id)
 
     # Send through WebSocket if the user is connected
     channel_layer = get_channel_layer()
     async_to_sync(channel_layer.group_send)(
-        f"user_{user.id}", {"type": "send_notification", "content": notification_data}
+        f"user_{user.id}",
+        {
+            "type": "send_notification",
+            "content": _notification_payload(notification),
+            "unread_count": unread_count,
+        },
     )
 
+    if email and user.email:
+        send_celery_email.delay(title, email, [user.email], fail_silently=False)
+
     return notification
 
 
@@ -69,10 +530,12 @@ def mark_notification_read(notification_id, user=None):
         if user is not None:
             query = query.filter(recipient=user)
 
-        notification = query.first()
+        notification = query.only("id", "recipient_id").first()
         if notification:
-            notification.is_read = True
-            notification.save()
+            # Only the request that actually flips is_read moves the counter
+            if query.filter(is_read=False).update(is_read=True):
+                adjust_unread_count(notification.recipient_id, -1)
+                mark_feed_read(notification.recipient_id, [notification.id])
             return True
         return False
     except Exception as e:
@@ -85,6 +548,9 @@ def mark_all_read(user):
         count = Notification.objects.filter(recipient=user, is_read=False).update(
             is_read=True
         )
+        set_unread_count(user.id, 0)
+        if count > 0:
+            mark_feed_read(user.id)
         return count
     except Exception as e:
         print(f"Error marking all notifications as read: {str(e)}")
@@ -92,27 +558,44 @@ def mark_all_read(user):
 
 
 def get_unread_count(user):
-    return Notification.objects.filter(recipient=user, is_read=False).count()
+    return get_unread_notification_count(user.id)
 
 
 def get_recent_notifications(user, limit=20):
     return Notification.objects.filter(recipient=user).order_by("-created_at")[:limit]
 
 
-def get_unread_notification_count(user_id):
-    """Get the number of unread notifications for a user"""
+def delete_old_notifications(
+    days=NOTIFICATION_RETENTION_DAYS, batch_size=NOTIFICATION_DELETE_BATCH_SIZE
+):
+    """
+    Delete read notifications older than ``days`` in bounded batches.
 
-    # Try to get count from cache
-    cache_key = f"user_unread_count:{user_id}"
-    cached_count = cache.get(cache_key)
+    Each batch selects its ids through the partial (created_at, is_read)
+    index and deletes them by primary key, so no statement holds locks on
+    more than ``batch_size`` rows. The feeds of the recipients are dropped
+    with each batch, so deleted notifications aren't served from them.
+    Returns the number of deleted rows.
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    expired = Notification.objects.filter(is_read=True, created_at__lt=cutoff)
 
-    if cached_count is not None:
-        return cached_count
-
-    # If not in cache, get from database and cache it
-    unread_count = Notification.objects.filter(
-        recipient_id=user_id, is_read=False
-    ).count()
-    cache.set(cache_key, unread_count, NOTIFICATION_CACHE_TIMEOUT)
+    deleted = 0
+    while True:
+        batch = list(
+            expired.order_by("created_at").values_list("id", "recipient_id")[
+                :batch_size
+            ]
+        )
+        if not batch:
+            break
+        deleted += Notification.objects.filter(
+            id__in=[notification_id for notification_id, _ in batch]
+        ).delete()[0]
+        clear_notification_feeds({recipient_id for _, recipient_id in batch})
+        if len(batch) < batch_size:
+            break
 
-    return unread_count
+    if deleted:
+        logger.info(f"Deleted {deleted} read notifications older than {days} days")
+    return deleted
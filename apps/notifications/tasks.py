@@ -1,14 +1,23 @@
-from datetime import timedelta
 from celery import shared_task
-from django.utils.timezone import now
-from apps.notifications.models import Notification
+from apps.notifications import digest, services
 
 
 @shared_task
 def clean_old_notifications():
-    Notification.objects.filter(
-        is_read=True, created_at__lt=now() - timedelta(days=30)
-    ).delete()
+    return services.delete_old_notifications()
+
+
+@shared_task
+def flush_notification_digest(user_id, notification_type):
+    """Deliver the notifications buffered for a user during a digest window"""
+    notification = digest.flush_digest(user_id, notification_type)
+    return notification.id if notification else None
+
+
+@shared_task
+def reconcile_unread_counts():
+    """Periodically correct cached unread counters against the database"""
+    return services.reconcile_unread_counts()
 
 
 @shared_task
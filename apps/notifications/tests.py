@@ -1,8 +1,31 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from rest_framework import status
+from django.utils import timezone
+from apps.notifications import services
+from apps.notifications.digest import flush_digest
 from apps.notifications.models import Notification
+from apps.notifications.services import (
+    NOTIFICATION_FEED_SIZE,
+    clear_notification_feed,
+    delete_old_notifications,
+    get_notification_feed,
+    get_unread_notification_count,
+    mark_all_read,
+    mark_notification_read,
+    notify_user,
+    notify_users,
+    reconcile_unread_counts,
+    remove_from_feed,
+    send_notifications,
+    set_unread_count,
+)
+from planit.redis_client import get_redis
 
 User = get_user_model()
 
@@ -73,3 +96,400 @@ class NotificationModelTestCase(TestCase):
         notification.is_read = True
         notification.save()
         self.assertTrue(notification.is_read)
+
+
+class NotificationFeedTestCase(TestCase):
+    """Test cases for the cached notification feed"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="feed@example.com",
+            password="testpass123",
+        )
+        clear_notification_feed(self.user.id)
+
+    def tearDown(self):
+        clear_notification_feed(self.user.id)
+
+    def test_feed_is_built_from_database(self):
+        """Test a missing feed is rebuilt newest first"""
+        Notification.objects.create(recipient=self.user, title="First", message="1")
+        Notification.objects.create(recipient=self.user, title="Second", message="2")
+
+        feed = get_notification_feed(self.user.id)
+
+        self.assertEqual([record["title"] for record in feed], ["Second", "First"])
+        self.assertEqual(feed[0]["recipient"], self.user.id)
+
+    def test_notify_user_prepends_to_cached_feed(self):
+        """Test new notifications are pushed onto an existing feed"""
+        Notification.objects.create(recipient=self.user, title="Old", message="old")
+        get_notification_feed(self.user.id)
+
+        notification = notify_user(self.user, "New", "new message")
+
+        feed = get_notification_feed(self.user.id)
+        self.assertEqual(feed[0]["id"], notification.id)
+        self.assertEqual(len(feed), 2)
+
+    def test_feed_is_capped(self):
+        """Test the feed never grows past NOTIFICATION_FEED_SIZE"""
+        Notification.objects.create(recipient=self.user, title="Seed", message="s")
+        get_notification_feed(self.user.id)
+
+        for i in range(NOTIFICATION_FEED_SIZE + 5):
+            notify_user(self.user, f"Notification {i}", "message")
+
+        self.assertEqual(
+            len(get_notification_feed(self.user.id)), NOTIFICATION_FEED_SIZE
+        )
+
+    def test_mark_read_updates_feed_in_place(self):
+        """Test marking notifications read updates the cached records"""
+        first = Notification.objects.create(
+            recipient=self.user, title="First", message="1"
+        )
+        Notification.objects.create(recipient=self.user, title="Second", message="2")
+        get_notification_feed(self.user.id)
+
+        mark_notification_read(first.id, self.user)
+
+        feed = {record["id"]: record for record in get_notification_feed(self.user.id)}
+        self.assertTrue(feed[first.id]["is_read"])
+        self.assertEqual([r["is_read"] for r in feed.values()].count(False), 1)
+
+        mark_all_read(self.user)
+        self.assertTrue(
+            all(record["is_read"] for record in get_notification_feed(self.user.id))
+        )
+
+    def test_remove_from_feed(self):
+        """Test deleted notifications are dropped from the feed"""
+        first = Notification.objects.create(
+            recipient=self.user, title="First", message="1"
+        )
+        second = Notification.objects.create(
+            recipient=self.user, title="Second", message="2"
+        )
+        get_notification_feed(self.user.id)
+
+        remove_from_feed(self.user.id, first.id)
+
+        feed = get_notification_feed(self.user.id)
+        self.assertEqual([record["id"] for record in feed], [second.id])
+
+    def test_rebuild_does_not_hide_concurrent_notification(self):
+        """Test a notification sent during a rebuild isn't lost from the feed"""
+        Notification.objects.create(recipient=self.user, title="Old", message="old")
+        feed_record = services._feed_record
+        concurrent = []
+
+        def record_during_rebuild(notification):
+            if not concurrent:
+                concurrent.append(None)
+                concurrent[0] = notify_user(self.user, "New", "new message")
+            return feed_record(notification)
+
+        with patch.object(services, "_feed_record", record_during_rebuild):
+            # The snapshot taken before the notification is not cached
+            self.assertEqual(len(get_notification_feed(self.user.id)), 1)
+
+        feed = get_notification_feed(self.user.id)
+        self.assertEqual(feed[0]["id"], concurrent[0].id)
+        self.assertEqual(len(feed), 2)
+
+
+class UnreadCountTestCase(TestCase):
+    """Test cases for the cached unread notification counter"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="unread@example.com",
+            password="testpass123",
+        )
+        self._clear_counter()
+
+    def tearDown(self):
+        self._clear_counter()
+
+    def _clear_counter(self):
+        from django_redis import get_redis_connection
+
+        get_redis_connection("default").delete(
+            f"notification_unread_count:{self.user.id}"
+        )
+
+    def test_count_is_seeded_from_database(self):
+        """Test a cold counter is computed from the database"""
+        Notification.objects.create(recipient=self.user, title="Test", message="1")
+        Notification.objects.create(
+            recipient=self.user, title="Test", message="2", is_read=True
+        )
+
+        self.assertEqual(get_unread_notification_count(self.user.id), 1)
+
+    def test_notify_user_increments_counter(self):
+        """Test notify_user bumps the cached counter"""
+        self.assertEqual(get_unread_notification_count(self.user.id), 0)
+
+        notify_user(self.user, "Title", "Message")
+        notify_user(self.user, "Title", "Message")
+
+        self.assertEqual(get_unread_notification_count(self.user.id), 2)
+
+    def test_mark_read_decrements_once(self):
+        """Test marking the same notification read twice only decrements once"""
+        notification = notify_user(self.user, "Title", "Message")
+        notify_user(self.user, "Title", "Message")
+        self.assertEqual(get_unread_notification_count(self.user.id), 2)
+
+        self.assertTrue(mark_notification_read(notification.id, self.user))
+        self.assertTrue(mark_notification_read(notification.id, self.user))
+
+        self.assertEqual(get_unread_notification_count(self.user.id), 1)
+
+    def test_mark_all_read_resets_counter(self):
+        """Test mark_all_read sets the counter to zero"""
+        notify_user(self.user, "Title", "Message")
+        notify_user(self.user, "Title", "Message")
+
+        self.assertEqual(mark_all_read(self.user), 2)
+        self.assertEqual(get_unread_notification_count(self.user.id), 0)
+
+    def test_reconcile_fixes_drift(self):
+        """Test reconciliation corrects counters that drifted"""
+        Notification.objects.create(recipient=self.user, title="Test", message="1")
+        set_unread_count(self.user.id, 5)
+
+        self.assertEqual(reconcile_unread_counts(), 1)
+        self.assertEqual(get_unread_notification_count(self.user.id), 1)
+        self.assertEqual(reconcile_unread_counts(), 0)
+
+
+class NotifyUsersTestCase(TestCase):
+    """Test cases for multi-recipient notification fan-out"""
+
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(
+                email=f"fanout{i}@example.com",
+                password="testpass123",
+            )
+            for i in range(3)
+        ]
+        self._clear_cache()
+
+    def tearDown(self):
+        self._clear_cache()
+
+    def _clear_cache(self):
+        from django_redis import get_redis_connection
+
+        redis_conn = get_redis_connection("default")
+        for user in self.users:
+            redis_conn.delete(
+                f"notification_unread_count:{user.id}", f"notification_feed:{user.id}"
+            )
+
+    def test_notify_users_creates_one_notification_per_user(self):
+        """Test each distinct recipient gets exactly one notification"""
+        notifications = notify_users(
+            self.users + [self.users[0], None], "Title", "Message", type="test"
+        )
+
+        self.assertEqual(len(notifications), 3)
+        for user in self.users:
+            self.assertEqual(
+                Notification.objects.filter(recipient=user, type="test").count(), 1
+            )
+
+    def test_send_notifications_updates_counters_and_feeds(self):
+        """Test counters and cached feeds are updated for the whole batch"""
+        first, second = self.users[:2]
+        get_notification_feed(first.id)
+        self.assertEqual(get_unread_notification_count(first.id), 0)
+
+        send_notifications(
+            [
+                Notification(recipient=first, title="A", message="1"),
+                Notification(recipient=first, title="B", message="2"),
+                Notification(recipient=second, title="C", message="3"),
+            ]
+        )
+
+        self.assertEqual(get_unread_notification_count(first.id), 2)
+        self.assertEqual(get_unread_notification_count(second.id), 1)
+        feed = get_notification_feed(first.id)
+        self.assertEqual({record["title"] for record in feed}, {"A", "B"})
+
+    def test_send_notifications_empty(self):
+        """Test sending an empty batch is a no-op"""
+        self.assertEqual(send_notifications([]), [])
+
+
+class NotificationRetentionTestCase(TestCase):
+    """Test cases for deleting old notifications"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="retention@example.com",
+            password="testpass123",
+        )
+
+    def test_only_old_read_notifications_are_deleted(self):
+        """Test retention deletes old read notifications in batches"""
+        old = timezone.now() - timedelta(days=40)
+        for i in range(5):
+            Notification.objects.create(
+                recipient=self.user, title="Old", message=str(i), is_read=True
+            )
+        old_unread = Notification.objects.create(
+            recipient=self.user, title="Old unread", message="x"
+        )
+        Notification.objects.update(created_at=old)
+        recent = Notification.objects.create(
+            recipient=self.user, title="Recent", message="y", is_read=True
+        )
+
+        self.assertEqual(delete_old_notifications(days=30, batch_size=2), 5)
+        self.assertEqual(
+            set(Notification.objects.values_list("id", flat=True)),
+            {old_unread.id, recent.id},
+        )
+
+    def test_deleted_notifications_leave_the_feed(self):
+        """Test retention drops the cached feeds of the recipients"""
+        clear_notification_feed(self.user.id)
+        Notification.objects.create(
+            recipient=self.user, title="Old", message="x", is_read=True
+        )
+        Notification.objects.update(created_at=timezone.now() - timedelta(days=40))
+        kept = Notification.objects.create(recipient=self.user, title="Kept")
+        self.assertEqual(len(get_notification_feed(self.user.id)), 2)
+
+        delete_old_notifications(days=30)
+
+        self.assertEqual(
+            [record["id"] for record in get_notification_feed(self.user.id)],
+            [kept.id],
+        )
+        clear_notification_feed(self.user.id)
+
+
+@override_settings(
+    NOTIFICATION_DIGEST_RULES={"digest_test": {"window": 60, "title": "{count} tests"}}
+)
+class NotificationDigestTestCase(TestCase):
+    """Test cases for collapsing bursts of notifications into digests"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="digest@example.com",
+            password="testpass123",
+        )
+        self._clear_digest()
+
+    def tearDown(self):
+        self._clear_digest()
+
+    def _clear_digest(self):
+        get_redis().delete(
+            f"notification_digest:{self.user.id}:digest_test",
+            f"notification_digest_window:{self.user.id}:digest_test",
+            f"notification_digest_scheduled:{self.user.id}:digest_test",
+        )
+
+    @patch("apps.accounts.tasks.send_celery_email.delay")
+    @patch("apps.notifications.tasks.flush_notification_digest.apply_async")
+    def test_burst_is_collapsed(self, mock_schedule, mock_email):
+        """Test a burst yields one immediate and one collapsed notification"""
+        first = notify_user(self.user, "Test", "First", type="digest_test")
+        second = notify_user(
+            self.user, "Test", "Second", type="digest_test", email="Mail 2"
+        )
+        third = notify_user(
+            self.user, "Test", "Third", type="digest_test", email="Mail 3"
+        )
+
+        self.assertIsNotNone(first)
+        self.assertIsNone(second)
+        self.assertIsNone(third)
+        mock_schedule.assert_called_once()
+        self.assertEqual(Notification.objects.filter(recipient=self.user).count(), 1)
+
+        digest = flush_digest(self.user.id, "digest_test")
+
+        self.assertEqual(digest.title, "2 tests")
+        self.assertEqual(digest.message, "Second\nThird")
+        self.assertEqual(Notification.objects.filter(recipient=self.user).count(), 2)
+        mock_email.assert_called_once_with(
+            "2 tests", "Mail 2\n\nMail 3", [self.user.email]
+        )
+        self.assertIsNone(flush_digest(self.user.id, "digest_test"))
+
+    @patch("apps.accounts.tasks.send_celery_email.delay")
+    @patch("apps.notifications.tasks.flush_notification_digest.apply_async")
+    def test_send_notifications_digests_emails(self, mock_schedule, mock_email):
+        """Test emails passed to send_notifications are digested with them"""
+        for body in ("Mail 1", "Mail 2"):
+            send_notifications(
+                [Notification(recipient=self.user, title="Test", type="digest_test")],
+                emails=[body],
+            )
+
+        mock_email.assert_called_once_with(
+            "Test", "Mail 1", [self.user.email], fail_silently=False
+        )
+        flush_digest(self.user.id, "digest_test")
+        mock_email.assert_called_with("Test", "Mail 2", [self.user.email])
+
+    @patch(
+        "apps.notifications.tasks.flush_notification_digest.apply_async",
+        side_effect=ConnectionError("broker down"),
+    )
+    def test_unschedulable_digest_is_delivered(self, mock_schedule):
+        """Test a digest that can't be scheduled doesn't fail or hold back"""
+        for message in ("First", "Second", "Third"):
+            notify_user(self.user, "Test", message, type="digest_test")
+
+        self.assertEqual(Notification.objects.filter(recipient=self.user).count(), 3)
+
+    @patch("apps.notifications.tasks.flush_notification_digest.apply_async")
+    def test_failed_delivery_keeps_the_digest(self, mock_schedule):
+        """Test buffered items are only removed once they are delivered"""
+        for message in ("First", "Second", "Third"):
+            notify_user(self.user, "Test", message, type="digest_test")
+
+        with patch(
+            "apps.notifications.services.send_notifications",
+            side_effect=DatabaseError("down"),
+        ):
+            with self.assertRaises(DatabaseError):
+                flush_digest(self.user.id, "digest_test")
+        self.assertEqual(mock_schedule.call_count, 2)
+
+        digest = flush_digest(self.user.id, "digest_test")
+        self.assertEqual(digest.message, "Second\nThird")
+        self.assertIsNone(flush_digest(self.user.id, "digest_test"))
+
+    @patch("apps.notifications.tasks.flush_notification_digest.apply_async")
+    def test_lost_flush_is_rescheduled(self, mock_schedule):
+        """Test a push reschedules the flush once its marker is gone"""
+        for message in ("First", "Second"):
+            notify_user(self.user, "Test", message, type="digest_test")
+        redis_conn = get_redis()
+        buffer_key = f"notification_digest:{self.user.id}:digest_test"
+        self.assertGreater(redis_conn.ttl(buffer_key), 60)
+
+        # The scheduled task was lost and its marker expired
+        redis_conn.delete(f"notification_digest_scheduled:{self.user.id}:digest_test")
+        notify_user(self.user, "Test", "Third", type="digest_test")
+        notify_user(self.user, "Test", "Fourth", type="digest_test")
+
+        self.assertEqual(mock_schedule.call_count, 2)
+
+    def test_types_without_rule_are_not_digested(self):
+        """Test notifications without a digest rule are always delivered"""
+        for _ in range(3):
+            self.assertIsNotNone(notify_user(self.user, "Test", "Message"))
+        self.assertEqual(Notification.objects.filter(recipient=self.user).count(), 3)
@@ -5,13 +5,17 @@ from .models import Notification
 from .serializers import NotificationSerializer
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status, viewsets
-from django.core.cache import cache
-from django.conf import settings
 from django.views.decorators.cache import cache_page
 from django.utils.decorators import method_decorator
-
-# Cache timeout in seconds (1 hour)
-NOTIFICATION_CACHE_TIMEOUT = getattr(settings, "NOTIFICATION_CACHE_TIMEOUT", 3600)
+from .services import (
+    adjust_unread_count,
+    get_notification_feed,
+    mark_all_read,
+    mark_notification_read,
+    push_to_feed,
+    remove_from_feed,
+    replace_in_feed,
+)
 
 
 # New ViewSet for Notifications with caching
@@ -28,36 +32,26 @@ class NotificationViewSet(viewsets.ModelViewSet):
         return super().list(request, *args, **kwargs)
 
     def perform_create(self, serializer):
-        serializer.save(recipient=self.request.user)
+        notification = serializer.save(recipient=self.request.user)
+        push_to_feed(notification)
+        if not notification.is_read:
+            adjust_unread_count(self.request.user.id, 1)
 
     def perform_update(self, serializer):
-        instance = self.get_object()
-        # If marking as read, update the unread count cache
-        if (
-            "is_read" in serializer.validated_data
-            and serializer.validated_data["is_read"]
-        ):
-            cache_key = f"user_notifications:{self.request.user.id}"
-            cache.delete(cache_key)
-            self._update_unread_count_cache(self.request.user.id)
-        serializer.save()
+        was_read = serializer.instance.is_read
+        notification = serializer.save()
+        # Keep the cached feed record in sync with the edited notification
+        replace_in_feed(notification)
+        # Move the unread counter if the read flag flipped
+        if was_read != notification.is_read:
+            adjust_unread_count(self.request.user.id, -1 if notification.is_read else 1)
 
     def perform_destroy(self, instance):
+        notification_id = instance.id
         instance.delete()
-        # Invalidate user notifications cache
-        cache_key = f"user_notifications:{self.request.user.id}"
-        cache.delete(cache_key)
-        # Update unread count cache
-        self._update_unread_count_cache(self.request.user.id)
-
-    def _update_unread_count_cache(self, user_id):
-        """Update the cached unread notification count"""
-        unread_count = Notification.objects.filter(
-            recipient_id=user_id, is_read=False
-        ).count()
-        cache.set(
-            f"user_unread_count:{user_id}", unread_count, NOTIFICATION_CACHE_TIMEOUT
-        )
+        remove_from_feed(self.request.user.id, notification_id)
+        if not instance.is_read:
+            adjust_unread_count(self.request.user.id, -1)
 
 
 # Keep your existing views below
@@ -66,20 +60,11 @@ class UserNotificationsView(ListAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        # Check if user notifications are cached
-        cache_key = f"user_notifications:{self.request.user.id}"
-        cached_notifications = cache.get(cache_key)
-
-        if cached_notifications is not None:
-            return cached_notifications
-
-        # If not cached, fetch from database
-        queryset = Notification.objects.filter(recipient=self.request.user)
-
-        # Cache the queryset
-        cache.set(cache_key, queryset, NOTIFICATION_CACHE_TIMEOUT)
+        return Notification.objects.filter(recipient=self.request.user)
 
-        return queryset
+    def list(self, request, *args, **kwargs):
+        # Served from the capped Redis feed of the most recent notifications
+        return Response(get_notification_feed(request.user.id))
 
 
 class MarkNotificationAsReadView(APIView):
@@ -87,42 +72,11 @@ class MarkNotificationAsReadView(APIView):
 
     def post(self, request, *args, **kwargs):
         notification_id = kwargs.get("pk")
-        try:
-            notification = Notification.objects.get(
-                id=notification_id, recipient=request.user
-            )
-            notification.is_read = True
-            notification.save()
-
-            # Invalidate user notifications cache
-            cache_key = f"user_notifications:{request.user.id}"
-            cache.delete(cache_key)
-
-            # Update unread count cache
-            self._update_unread_count_cache(request.user.id)
-
+        # Updates the cached feed and unread counter as well
+        if mark_notification_read(notification_id, user=request.user):
             return Response({"marked_as_read": True}, status=status.HTTP_200_OK)
-        except Notification.DoesNotExist:
-            return Response(
-                {"error": "Notification not found"}, status=status.HTTP_404_NOT_FOUND
-            )
-
-    def _update_unread_count_cache(self, user_id):
-        """Update the cached unread notification count"""
-        unread_count = Notification.objects.filter(
-            recipient_id=user_id, is_read=False
-        ).count()
-        cache.set(
-            f"user_unread_count:{user_id}", unread_count, NOTIFICATION_CACHE_TIMEOUT
-        )
-
-    def _update_unread_count_cache(self, user_id):
-        """Update the cached unread notification count"""
-        unread_count = Notification.objects.filter(
-            recipient_id=user_id, is_read=False
-        ).count()
-        cache.set(
-            f"user_unread_count:{user_id}", unread_count, NOTIFICATION_CACHE_TIMEOUT
+        return Response(
+            {"error": "Notification not found"}, status=status.HTTP_404_NOT_FOUND
         )
 
 
@@ -130,16 +84,7 @@ class MarkAllAsReadView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, *args, **kwargs):
-        count = Notification.objects.filter(
-            recipient=request.user, is_read=False
-        ).update(is_read=True)
-
-        # Invalidate user notifications cache
-        cache_key = f"user_notifications:{request.user.id}"
-        cache.delete(cache_key)
-
-        # Update unread count cache
-        cache.set(f"user_unread_count:{request.user.id}", 0, NOTIFICATION_CACHE_TIMEOUT)
+        count = mark_all_read(request.user)
 
         return Response({"marked_as_read": count})
 
@@ -154,19 +99,12 @@ class DeleteNotificationView(DestroyAPIView):
             notification = self.queryset.get(id=notification_id, recipient=request.user)
             notification.delete()
 
-            # Invalidate user notifications cache
-            cache_key = f"user_notifications:{request.user.id}"
-            cache.delete(cache_key)
+            # Drop the notification from the cached feed
+            remove_from_feed(request.user.id, notification_id)
 
             # Update unread count cache
-            unread_count = Notification.objects.filter(
-                recipient=request.user, is_read=False
-            ).count()
-            cache.set(
-                f"user_unread_count:{request.user.id}",
-                unread_count,
-                NOTIFICATION_CACHE_TIMEOUT,
-            )
+            if not notification.is_read:
+                adjust_unread_count(request.user.id, -1)
 
             return Response({"deleted": True}, status=status.HTTP_204_NO_CONTENT)
         except Notification.DoesNotExist:
@@ -42,8 +42,6 @@ def check_django_cache(user_id=None):
         "user_fullname",
         "user_profile",
         "user_stats",
-        "user_notifications",
-        "user_unread_count",
     ]
 
     for user in users:
@@ -0,0 +1,12 @@
+"""
+The raw Redis connection shared by the modules that keep their own data
+structures in Redis (feeds, counters, queues, sets), beyond what the Django
+cache API offers.
+"""
+
+
+def get_redis():
+    """The ``default`` cache's Redis connection"""
+    from django_redis import get_redis_connection
+
+    return get_redis_connection("default")
@@ -409,6 +409,20 @@ CHANNEL_LAYERS = {
     }
 }
 
+# Notification types collapsed into digests during bursts. The first
+# notification of a burst is sent right away, later ones within ``window``
+# seconds are delivered together as one notification titled ``title``.
+NOTIFICATION_DIGEST_RULES = {
+    "post_pending_approval": {
+        "window": 300,
+        "title": "{count} posts pending your approval",
+    },
+    "post_approved": {"window": 300, "title": "{count} posts approved"},
+    "post_rejected": {"window": 300, "title": "{count} posts rejected"},
+    "post_validated": {"window": 300, "title": "{count} posts validated"},
+    "post_published": {"window": 300, "title": "{count} posts published"},
+}
+
 CELERY_BROKER_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}/0"
 CELERY_RESULT_BACKEND = f"redis://{REDIS_HOST}:{REDIS_PORT}/0"
 CELERY_ACCEPT_CONTENT = ["json"]
@@ -421,6 +435,21 @@ CELERY_BEAT_SCHEDULE = {
         "schedule": 60.0,  # Run every 60 seconds (1 minute)
         "options": {"expires": 59},  # Expire task if not executed within 59 seconds
     },
+    "deliver-queued-emails": {
+        "task": "apps.accounts.tasks.deliver_queued_emails",
+        "schedule": 30.0,  # Catch up on anything a scheduled run missed
+        "options": {"expires": 29},
+    },
+    "clean-old-notifications": {
+        "task": "apps.notifications.tasks.clean_old_notifications",
+        "schedule": 3600.0,  # Run every hour
+        "options": {"expires": 3599},
+    },
+    "reconcile-unread-notification-counts": {
+        "task": "apps.notifications.tasks.reconcile_unread_counts",
+        "schedule": 900.0,  # Run every 15 minutes
+        "options": {"expires": 899},
+    },
 }
 
 # Security Logging Configuration
@@ -480,6 +509,11 @@ LOGGING = {
             "level": "WARNING",  # DEBUG messages won't show during tests
             "propagate": False,
         },
+        "planit.websocket_auth": {
+            "handlers": ["console"],
+            "level": "INFO",  # Sampled, see WEBSOCKET_AUTH_LOG_SAMPLE_RATES
+            "propagate": False,
+        },
     },
 }
 
@@ -1,15 +1,40 @@
-from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
+from django.conf import settings
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+import logging
+import random
 import urllib.parse
 
+logger = logging.getLogger(__name__)
+
+# Fraction of connection attempts that get logged. Reconnect storms after a
+# deploy produce thousands of identical lines, failures are kept more often.
+LOG_SAMPLE_RATES = getattr(
+    settings, "WEBSOCKET_AUTH_LOG_SAMPLE_RATES", {"success": 0.01, "failure": 0.1}
+)
+
+
+def log_auth_event(outcome, event, client_ip, **fields):
+    """Log a sampled ``key=value`` line for a socket authentication attempt"""
+    rate = LOG_SAMPLE_RATES.get(outcome, 1.0)
+    if random.random() >= rate:
+        return
+
+    fields = {"event": event, "client_ip": client_ip, **fields, "sample_rate": rate}
+    level = logging.INFO if outcome == "success" else logging.WARNING
+    logger.log(
+        level,
+        "websocket_auth %s",
+        " ".join(f"{key}={value}" for key, value in fields.items()),
+    )
+
 
 class TokenAuthMiddleware(BaseMiddleware):
     async def __call__(self, scope, receive, send):
         # Import inside the method to avoid AppRegistryNotReady error
         from django.contrib.auth.models import AnonymousUser
-        from apps.accounts.models import User
 
         scope["user"] = AnonymousUser()
 
@@ -21,47 +46,46 @@ class TokenAuthMiddleware(BaseMiddleware):
         if query_string:
             try:
                 query_params = dict(urllib.parse.parse_qsl(query_string))
-                token = query_params.get("token", "")  # <-- FIXED
-                print(
-                    f"WebSocket auth attempt from {client_ip}: Token present: {bool(token)}"
-                )
+                token = query_params.get("token", "")
                 if token:
                     access_token = AccessToken(token)
                     user_id = access_token.payload.get("user_id")
                     if user_id:
-                        user = await self.get_user(user_id, User)
-                        if user and not user.is_anonymous:
+                        user = await self.get_user(
+                            user_id, access_token.payload.get(api_settings.JTI_CLAIM)
+                        )
+                        if user is not None:
                             scope["user"] = user
-                            print(
-                                f"WebSocket auth success: User {user_id} ({user.email}) authenticated"
+                            log_auth_event(
+                                "success", "authenticated", client_ip, user_id=user_id
                             )
                         else:
-                            print(f"WebSocket auth failed: User {user_id} not found")
+                            log_auth_event(
+                                "failure", "user_not_found", client_ip, user_id=user_id
+                            )
                     else:
-                        print("WebSocket auth failed: No user_id in token payload")
+                        log_auth_event("failure", "no_user_id", client_ip)
                 else:
-                    print(
-                        f"WebSocket auth failed from {client_ip}: No token in query params"
-                    )
+                    log_auth_event("failure", "no_token", client_ip)
             except (InvalidToken, TokenError) as e:
-                print(f"WebSocket auth failed from {client_ip}: Invalid token - {e}")
+                log_auth_event(
+                    "failure", "invalid_token", client_ip, error=repr(str(e))
+                )
             except (ValueError, UnicodeDecodeError) as e:
-                print(
-                    f"WebSocket auth failed from {client_ip}: Query string parsing error - {e}"
+                log_auth_event(
+                    "failure", "bad_query_string", client_ip, error=repr(str(e))
                 )
         else:
-            print(f"WebSocket connection from {client_ip}: No query string provided")
+            log_auth_event("failure", "no_query_string", client_ip)
 
         return await super().__call__(scope, receive, send)
 
-    @database_sync_to_async
-    def get_user(self, user_id, User):
-        try:
-            return User.objects.get(id=user_id)
-        except User.DoesNotExist:
-            from django.contrib.auth.models import AnonymousUser
+    async def get_user(self, user_id, jti):
+        # Shared with the HTTP authentication classes, a warm connect costs
+        # one cache round-trip and no trip through the database thread
+        from apps.accounts.principal_cache import aget_principal
 
-            return AnonymousUser()
+        return await aget_principal(user_id, jti)
 
 
 def TokenAuthMiddlewareStack(inner):